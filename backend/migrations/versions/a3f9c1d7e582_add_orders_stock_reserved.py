@@ -0,0 +1,27 @@
+"""add orders stock_reserved
+
+Revision ID: a3f9c1d7e582
+Revises: f2d8b6e4a193
+Create Date: 2025-09-29 10:21:36.184702
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f9c1d7e582'
+down_revision = 'f2d8b6e4a193'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Существующие заказы остатки не списывали — при отмене их не возвращаем
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('stock_reserved', sa.Boolean(), server_default=sa.text('false'), nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_column('stock_reserved')
@@ -0,0 +1,34 @@
+"""add catalog keyset indexes
+
+Revision ID: b61f0c2d9a47
+Revises: 7d563dcfea3f
+Create Date: 2025-09-15 10:12:41.508213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b61f0c2d9a47'
+down_revision = '7d563dcfea3f'
+branch_labels = None
+depends_on = None
+
+TABLES = ('shoes', 'clothing', 'accessories')
+
+
+def upgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index(f'ix_{table}_price_variant_sku', ['price', 'variant_sku'], unique=False)
+            batch_op.create_index(f'ix_{table}_created_at_variant_sku', ['created_at', 'variant_sku'], unique=False)
+            batch_op.create_index(f'ix_{table}_count_sales_variant_sku', ['count_sales', 'variant_sku'], unique=False)
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(f'ix_{table}_count_sales_variant_sku')
+            batch_op.drop_index(f'ix_{table}_created_at_variant_sku')
+            batch_op.drop_index(f'ix_{table}_price_variant_sku')
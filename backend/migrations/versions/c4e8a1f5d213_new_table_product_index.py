@@ -0,0 +1,47 @@
+"""new table product_index
+
+Revision ID: c4e8a1f5d213
+Revises: b61f0c2d9a47
+Create Date: 2025-09-18 14:03:27.115904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a1f5d213'
+down_revision = 'b61f0c2d9a47'
+branch_labels = None
+depends_on = None
+
+TABLES = ('shoes', 'clothing', 'accessories')
+
+
+def upgrade():
+    op.create_table('product_index',
+    sa.Column('variant_sku', sa.String(length=100), nullable=False),
+    sa.Column('category', sa.String(length=50), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('color_sku', sa.String(length=100), nullable=True),
+    sa.PrimaryKeyConstraint('variant_sku')
+    )
+    with op.batch_alter_table('product_index', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_product_index_category'), ['category'], unique=False)
+        batch_op.create_index(batch_op.f('ix_product_index_color_sku'), ['color_sku'], unique=False)
+
+    # Первичное заполнение из таблиц товаров
+    for table in TABLES:
+        op.execute(
+            f"INSERT INTO product_index (variant_sku, category, product_id, color_sku) "
+            f"SELECT variant_sku, '{table}', id, color_sku FROM {table} "
+            f"ON CONFLICT (variant_sku) DO NOTHING"
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('product_index', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_product_index_color_sku'))
+        batch_op.drop_index(batch_op.f('ix_product_index_category'))
+
+    op.drop_table('product_index')
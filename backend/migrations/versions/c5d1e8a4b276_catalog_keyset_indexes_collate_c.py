@@ -0,0 +1,37 @@
+"""catalog keyset indexes collate C
+
+Revision ID: c5d1e8a4b276
+Revises: a3f9c1d7e582
+Create Date: 2025-09-30 11:04:52.317640
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d1e8a4b276'
+down_revision = 'a3f9c1d7e582'
+branch_labels = None
+depends_on = None
+
+TABLES = ('shoes', 'clothing', 'accessories')
+SORT_COLUMNS = ('price', 'created_at', 'count_sales')
+
+
+def upgrade():
+    # keyset-пагинация сравнивает variant_sku в COLLATE "C" — индексы должны совпадать по collation
+    for table in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in SORT_COLUMNS:
+                batch_op.drop_index(f'ix_{table}_{column}_variant_sku')
+                batch_op.create_index(f'ix_{table}_{column}_variant_sku',
+                                      [column, sa.text('variant_sku COLLATE "C"')], unique=False)
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in reversed(SORT_COLUMNS):
+                batch_op.drop_index(f'ix_{table}_{column}_variant_sku')
+                batch_op.create_index(f'ix_{table}_{column}_variant_sku', [column, 'variant_sku'], unique=False)
@@ -0,0 +1,57 @@
+"""add product search columns
+
+Revision ID: d9a3b7e21f60
+Revises: c4e8a1f5d213
+Create Date: 2025-09-19 11:47:05.392871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9a3b7e21f60'
+down_revision = 'c4e8a1f5d213'
+branch_labels = None
+depends_on = None
+
+TABLES = ('shoes', 'clothing', 'accessories')
+
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('russian', coalesce(t.name, '') || ' ' || coalesce(t.brand, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(t.name, '') || ' ' || coalesce(t.brand, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(t.color, '') || ' ' || coalesce(t.material, '')), 'B') || "
+    "setweight(to_tsvector('russian', coalesce(t.description, '')), 'D')"
+)
+SEARCH_TEXT_SQL = "lower(coalesce(t.brand, '') || ' ' || coalesce(t.name, ''))"
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    with op.batch_alter_table('product_index', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+        batch_op.add_column(sa.Column('search_text', sa.Text(), nullable=True))
+
+    # Заполнение поисковых колонок для уже проиндексированных товаров
+    for table in TABLES:
+        op.execute(
+            f"UPDATE product_index pi SET search_vector = {SEARCH_VECTOR_SQL}, "
+            f"search_text = {SEARCH_TEXT_SQL} "
+            f"FROM {table} t WHERE pi.category = '{table}' AND pi.product_id = t.id"
+        )
+
+    with op.batch_alter_table('product_index', schema=None) as batch_op:
+        batch_op.create_index('ix_product_index_search_vector', ['search_vector'], unique=False,
+                              postgresql_using='gin')
+        batch_op.create_index('ix_product_index_search_text_trgm', ['search_text'], unique=False,
+                              postgresql_using='gin', postgresql_ops={'search_text': 'gin_trgm_ops'})
+
+
+def downgrade():
+    with op.batch_alter_table('product_index', schema=None) as batch_op:
+        batch_op.drop_index('ix_product_index_search_text_trgm', postgresql_using='gin')
+        batch_op.drop_index('ix_product_index_search_vector', postgresql_using='gin')
+        batch_op.drop_column('search_text')
+        batch_op.drop_column('search_vector')
@@ -0,0 +1,44 @@
+"""add orders summary columns
+
+Revision ID: f2d8b6e4a193
+Revises: e7c5a2b9d418
+Create Date: 2025-09-25 16:08:14.927153
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2d8b6e4a193'
+down_revision = 'e7c5a2b9d418'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('item_count', sa.Integer(), server_default=sa.text('0'), nullable=False))
+        batch_op.add_column(sa.Column('thumbnail_sku', sa.String(length=100), nullable=True))
+
+    # Заполняем сводку существующих заказов из items_json
+    op.execute("""
+        UPDATE orders SET
+            item_count = COALESCE((
+                SELECT SUM(GREATEST(COALESCE(NULLIF(e->>'qty', '')::numeric::int, 1), 0))
+                FROM jsonb_array_elements(orders.items_json) AS e
+            ), 0),
+            thumbnail_sku = (
+                SELECT e->>'variant_sku'
+                FROM jsonb_array_elements(orders.items_json) WITH ORDINALITY AS t(e, n)
+                WHERE COALESCE(e->>'variant_sku', '') <> ''
+                ORDER BY n
+                LIMIT 1
+            )
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_column('thumbnail_sku')
+        batch_op.drop_column('item_count')
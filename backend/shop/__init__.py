@@ -7,6 +7,7 @@ from .core.logging import setup_logging, logger
 from .extensions import mail
 from .models import db
 from .utils.cache_utils import load_delivery_options, load_parameters
+from .utils.redis_sweeper import start_sweeper
 from .routes.general import general_api
 from .routes.product import product_api
 from .routes.admin import admin_api
@@ -69,6 +70,9 @@ def create_app() -> Flask:
             load_delivery_options()
             logger.debug("%s: delivery options cached", context)
 
+        # ——— Фоновая чистка брошенных корзин и избранного ————————
+        start_sweeper(app)
+
     except Exception:
         logger.exception("%s: Error during app initialization", context)
         raise
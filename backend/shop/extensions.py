@@ -36,6 +36,15 @@ try:
         socket_connect_timeout=5,
         socket_keepalive=True,
     )
+    # Отдельный клиент без декодирования для бинарных значений (сжатые снапшоты и т.п.)
+    redis_bin_client = Redis(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        password=REDIS_PASSWORD,
+        decode_responses=False,
+        socket_connect_timeout=5,
+        socket_keepalive=True,
+    )
     logger.debug("%s: Redis client initialized for %s:%d", _context, REDIS_HOST, REDIS_PORT)
 except Exception as e:
     logger.exception("%s: failed to initialize Redis client", _context)
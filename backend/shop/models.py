@@ -1,7 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timezone
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy import text
+from sqlalchemy.orm import declared_attr
 
 db = SQLAlchemy()
 
@@ -85,6 +86,11 @@ class Addresses(db.Model):
 
 class Orders(db.Model):
     __tablename__  = 'orders'
+    __table_args__ = (
+        # Keyset-пагинация списков заказов по created_at с фильтром по статусу или клиенту
+        db.Index('ix_orders_status_created_at', 'status', 'created_at'),
+        db.Index('ix_orders_user_id_created_at', 'user_id', 'created_at'),
+    )
     id             = db.Column(db.Integer, primary_key=True)
     user_id        = db.Column(db.BigInteger, db.ForeignKey('users.user_id'), nullable=False)
     status         = db.Column(db.String(50), nullable=False, default='new')
@@ -108,10 +114,27 @@ class Orders(db.Model):
     pvz_lon        = db.Column(db.Float)
     address_id     = db.Column(db.Integer, db.ForeignKey('addresses.id'))
     items_json     = db.Column(JSONB, nullable=False, default=list, server_default=text("'[]'::jsonb"))
+    # Для списка заказов без чтения items_json
+    item_count     = db.Column(db.Integer, nullable=False, default=0, server_default=text("0"))
+    thumbnail_sku  = db.Column(db.String(100))
+    # Остатки списаны при оформлении: только такие заказы возвращают их при отмене
+    stock_reserved = db.Column(db.Boolean, nullable=False, default=False, server_default=text("false"))
 
 
 class BaseProduct(db.Model):
     __abstract__   = True
+
+    @declared_attr
+    def __table_args__(cls):
+        # Композитные индексы под keyset-пагинацию каталога (sort_key, variant_sku COLLATE "C"):
+        # порядок SKU побайтовый, как при слиянии страниц разных таблиц в Python
+        sku = text('variant_sku COLLATE "C"')
+        return (
+            db.Index(f"ix_{cls.__tablename__}_price_variant_sku", "price", sku),
+            db.Index(f"ix_{cls.__tablename__}_created_at_variant_sku", "created_at", sku),
+            db.Index(f"ix_{cls.__tablename__}_count_sales_variant_sku", "count_sales", sku),
+        )
+
     id             = db.Column(db.Integer, primary_key=True)
     variant_sku    = db.Column(db.String(100), unique=True, nullable=False, index=True)
     color_sku      = db.Column(db.String(100), index=True)
@@ -152,3 +175,19 @@ class Accessory(BaseProduct):
     width_cm       = db.Column(db.Float)
     height_cm      = db.Column(db.Float)
     depth_cm       = db.Column(db.Float)
+
+
+class ProductIndex(db.Model):
+    __tablename__  = 'product_index'
+    __table_args__ = (
+        # Полнотекстовый поиск и поиск с опечатками (pg_trgm)
+        db.Index('ix_product_index_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_product_index_search_text_trgm', 'search_text', postgresql_using='gin',
+                 postgresql_ops={'search_text': 'gin_trgm_ops'}),
+    )
+    variant_sku    = db.Column(db.String(100), primary_key=True)
+    category       = db.Column(db.String(50), nullable=False, index=True)
+    product_id     = db.Column(db.Integer, nullable=False)
+    color_sku      = db.Column(db.String(100), index=True)
+    search_vector  = db.Column(TSVECTOR)
+    search_text    = db.Column(db.Text)
@@ -1,23 +1,32 @@
 import csv
 import io
 import os
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from zoneinfo import ZoneInfo
-from typing import Tuple, List, Dict, Any
+from typing import Tuple, List, Dict, Any, Iterator, Optional
 import requests
 from flask import Blueprint, jsonify, request, Response
 from flask_jwt_extended import get_jwt_identity
-from sqlalchemy import func
+from sqlalchemy import func, select
 from ..core.logging import logger
 from ..core.config import BACKEND_URL
 from ..extensions import redis_client, minio_client, BUCKET
 from ..models import ChangeLog, AdminSetting, Users, Review, RequestItem, Addresses, Orders
 from ..utils.db_utils import session_scope, adjust_user_order_stats
+from ..utils.facet_index import rebuild_facet_index
 from ..utils.google_sheets import get_sheet_url, process_rows, preview_rows
 from ..utils.jwt_utils import admin_required
-from ..utils.logging_utils import log_change
-from ..utils.route_utils import handle_errors, require_json
-from ..utils.cache_utils import load_delivery_options, load_parameters
+from ..utils.logging_utils import log_change, log_changes
+from ..utils.order_queries import admin_orders_select, bulk_set_status, keyset_orders
+from ..utils.pagination import ORDERS_DEFAULT_LIMIT, ORDERS_MAX_LIMIT, decode_order_cursor, parse_limit
+from ..utils.route_utils import STREAM_YIELD_PER, handle_errors, require_json, stream_json
+from ..utils.cache_utils import (
+    load_delivery_options, load_parameters, bump_catalog_version, bump_reviews_version, bump_stock_db_version,
+)
+from ..utils.catalog_snapshot import rebuild_catalog_snapshot
+from ..utils.suggest_index import rebuild_suggest_index
+from ..utils.redis_sweeper import get_sweep_stats
+from ..utils.stock_index import adjust_stock, apply_stock_db, order_stock_deltas
 from ..utils.storage_utils import (
     cleanup_product_images,
     upload_product_images,
@@ -54,6 +63,16 @@ def get_daily_visits() -> Tuple[Response, int]:
     return jsonify({"date": date_str, "hours": hours}), 200
 
 
+@admin_api.route("/get_sweep_stats", methods=["GET"])
+@admin_required
+@handle_errors
+def get_sweep_stats_route() -> Tuple[Response, int]:
+    """GET /api/admin/get_sweep_stats?weeks=8 — брошенные корзины и освобождённая память по неделям"""
+    weeks = max(1, min(request.args.get("weeks", 8, type=int), 52))
+    logger.debug("get_sweep_stats: weeks=%d", weeks)
+    return jsonify({"weeks": get_sweep_stats(weeks)}), 200
+
+
 @admin_api.route("/get_logs", methods=["GET"])
 @admin_required
 @handle_errors
@@ -210,6 +229,15 @@ def sync_all() -> Tuple[Any, int]:
         }
         log_change(action_type=f"Импорт {cat}.zip", description=str(image_stats[cat]))
 
+    # Новая версия каталога: перестраиваем индекс фасетов, снапшот и подсказки этого воркера сразу,
+    # остальные воркеры подхватят версию лениво
+    if archives:
+        bump_catalog_version()
+    if sheets_data or archives:
+        rebuild_facet_index()
+        rebuild_catalog_snapshot()
+        rebuild_suggest_index()
+
     # Лог успешной синхронизации
     log_change(action_type="Синхронизация данных (успешно)",
                description=f"sheet_stats={sheet_stats}, image_stats={image_stats}")
@@ -260,6 +288,9 @@ def update_setting() -> Tuple[Response, int]:
     # обновить кеш параметров
     load_parameters()
     load_delivery_options()
+    if key.startswith("delivery_"):
+        # delivery_options входят в сериализованные товары
+        bump_catalog_version()
 
     action_type = "Создание параметра" if new_key else "Изменение параметра"
     description = f"{key}: {value}" if new_key else f"{key}: {old_value} -> {value}"
@@ -338,6 +369,7 @@ def create_review() -> Tuple[Response, int]:
         logger.debug("create_review: saved review_id=%d photos=%d", review.id, saved)
         review_id = review.id
 
+    bump_reviews_version()
     log_change(action_type="Создание отзыва", description=f"id={review_id}")
 
     return jsonify({"status": "ok", "message": "Отзыв успешно добавлен", "review_id": review_id}), 201
@@ -356,6 +388,7 @@ def delete_review(review_id: int) -> Tuple[Response, int]:
         session.delete(rev)
 
     removed = cleanup_review_images()
+    bump_reviews_version()
 
     log_change(action_type="Удаление отзыва", description=f"id={review_id}")
 
@@ -370,27 +403,25 @@ def delete_review(review_id: int) -> Tuple[Response, int]:
 def list_users() -> Tuple[Response, int]:
     """GET /api/admin/list_users"""
     hidden_fields = {"avatar_url", "email_verified", "updated_at"}
-    users_list: List[Dict[str, Any]] = []
+    columns = [col for col in Users.__table__.columns if col.name not in hidden_fields]
+    names = [col.name for col in columns]
+    tz = ZoneInfo("Europe/Moscow")
     logger.debug("list_users: called")
 
-    with session_scope() as session:
-        users = session.query(Users).order_by(Users.user_id).all()
-        for u in users:
-            row: Dict[str, Any] = {}
-            for col in Users.__table__.columns:
-                name = col.name
-                if name in hidden_fields:
-                    continue
-                val = getattr(u, name)
-                if isinstance(val, datetime):
-                    val = val.astimezone(ZoneInfo("Europe/Moscow")).isoformat()
-                elif isinstance(val, date):
-                    val = val.isoformat()  # 'YYYY-MM-DD'
-                row[name] = val
-            users_list.append(row)
-
-    logger.debug("list_users: returned %d users", len(users_list))
-    return jsonify({"users": users_list}), 200
+    def generate() -> Iterator[Dict[str, Any]]:
+        with session_scope() as session:
+            stmt = select(*columns).order_by(Users.user_id).execution_options(yield_per=STREAM_YIELD_PER)
+            for values in session.execute(stmt):
+                row: Dict[str, Any] = {}
+                for name, val in zip(names, values):
+                    if isinstance(val, datetime):
+                        val = val.astimezone(tz).isoformat()
+                    elif isinstance(val, date):
+                        val = val.isoformat()  # 'YYYY-MM-DD'
+                    row[name] = val
+                yield row
+
+    return stream_json(generate, key="users"), 200
 
 
 @admin_api.route("/list_requests", methods=["GET"])
@@ -402,27 +433,32 @@ def list_requests() -> Tuple[Response, int]:
     Возвращает все заявки.
     """
     logger.debug("list_requests: called")
-    data = []
-    with session_scope() as session:
-        items = session.query(RequestItem).order_by(RequestItem.created_at.desc()).all()
-        for r in items:
-            file_url = None
-            if r.has_file:
-                objs = minio_client.list_objects(BUCKET, prefix=f"requests/{r.id}_", recursive=True)
-                for obj in objs:
-                    file_url = f"{BACKEND_URL}/{BUCKET}/{obj.object_name}"
-                    break
-            data.append({
-                "id":         r.id,
-                "name":       r.name,
-                "email":      r.email,
-                "sku":        r.sku,
-                "file_url":   file_url,
-                "created_at": r.created_at.isoformat()
-            })
 
-    logger.debug("list_requests: returned %d requests", len(data))
-    return jsonify({"requests": data}), 200
+    def generate() -> Iterator[Dict[str, Any]]:
+        with session_scope() as session:
+            stmt = (
+                select(RequestItem.id, RequestItem.name, RequestItem.email, RequestItem.sku,
+                       RequestItem.has_file, RequestItem.created_at)
+                .order_by(RequestItem.created_at.desc())
+                .execution_options(yield_per=STREAM_YIELD_PER)
+            )
+            for r in session.execute(stmt):
+                file_url = None
+                if r.has_file:
+                    objs = minio_client.list_objects(BUCKET, prefix=f"requests/{r.id}_", recursive=True)
+                    for obj in objs:
+                        file_url = f"{BACKEND_URL}/{BUCKET}/{obj.object_name}"
+                        break
+                yield {
+                    "id":         r.id,
+                    "name":       r.name,
+                    "email":      r.email,
+                    "sku":        r.sku,
+                    "file_url":   file_url,
+                    "created_at": r.created_at.isoformat()
+                }
+
+    return stream_json(generate, key="requests"), 200
 
 
 @admin_api.route("/delete_request/<int:request_id>", methods=["DELETE"])
@@ -479,40 +515,85 @@ def set_user_role() -> Tuple[Response, int]:
 def admin_list_orders() -> Tuple[Response, int]:
     """
     GET /api/admin/list_orders
-    Возвращает краткие данные по всем заказам с полями пользователя/адреса.
+    Краткие данные заказов с полями пользователя/адреса — одним запросом с JOIN.
+    Фильтры: ?status=a,b ?date_from=YYYY-MM-DD ?date_to=YYYY-MM-DD (включительно)
+             ?user_id= ?payment_method= ?delivery_type= ?q= (имя, телефон, email, номер заказа)
+    Пагинация: ?limit=N&cursor=... -> {orders, next_cursor}; без них — все заказы потоком.
     """
-    logger.debug("list_orders: called")
-    with session_scope() as session:
-        qs = session.query(Orders).order_by(Orders.created_at.desc()).all()
-        out = []
-        tz = ZoneInfo("Europe/Moscow")
-        for o in qs:
-            u = session.get(Users, o.user_id)
-            a = session.get(Addresses, o.address_id) if o.address_id else None
-            address_short = None
-            if a:
-                address_short = f"г.{a.city}, ул. {a.street}, дом {a.house}"
-
-            created_local = o.created_at.astimezone(tz).isoformat() if o.created_at else None
-
-            out.append({
-                "id":             o.id,
-                "status":         o.status,
-                "created_at":     created_local,
-                "total":          o.total,
-                "delivery_price": o.delivery_price,
-                "user": {
-                    "id":         u.user_id if u else None,
-                    "first_name": u.first_name if u else None,
-                    "last_name":  u.last_name if u else None,
-                    "phone":      u.phone if u else None,
-                    "email":      u.email if u else None,
-                },
-                "address": address_short,
-            })
-
-    logger.debug("list_orders: returned %d orders", len(out))
-    return jsonify({"orders": out}), 200
+    tz = ZoneInfo("Europe/Moscow")
+    args = request.args
+    logger.debug("list_orders: args=%s", dict(args))
+
+    def day(name: str) -> Optional[datetime]:
+        raw = args.get(name, "").strip()
+        return datetime.strptime(raw, "%Y-%m-%d").replace(tzinfo=tz) if raw else None
+
+    try:
+        date_from = day("date_from")
+        date_to = day("date_to")
+        user_id = int(args["user_id"]) if args.get("user_id") else None
+    except ValueError:
+        logger.warning("list_orders: invalid filter %s", dict(args))
+        return jsonify({"error": "invalid filter"}), 400
+    if date_to is not None:
+        date_to += timedelta(days=1)
+
+    stmt = admin_orders_select(
+        statuses=[s.strip() for s in args.get("status", "").split(",") if s.strip()],
+        date_from=date_from,
+        date_to=date_to,
+        user_id=user_id,
+        payment_method=args.get("payment_method", "").strip() or None,
+        delivery_type=args.get("delivery_type", "").strip() or None,
+        q=args.get("q", "").strip()[:100] or None,
+    )
+
+    def serialize(r) -> Dict[str, Any]:
+        address_short = None
+        if r.city is not None:
+            address_short = f"г.{r.city}, ул. {r.street}, дом {r.house}"
+        return {
+            "id":             r.id,
+            "status":         r.status,
+            "created_at":     r.created_at.astimezone(tz).isoformat() if r.created_at else None,
+            "total":          r.total,
+            "delivery_price": r.delivery_price,
+            "payment_method": r.payment_method,
+            "delivery_type":  r.delivery_type,
+            "user": {
+                "id":         r.user_id,
+                "first_name": r.first_name,
+                "last_name":  r.last_name,
+                "phone":      r.phone,
+                "email":      r.email,
+            },
+            "address": address_short,
+        }
+
+    if any(args.get(p) for p in ("limit", "cursor")):
+        limit = parse_limit(args.get("limit"), ORDERS_DEFAULT_LIMIT, ORDERS_MAX_LIMIT)
+        if limit is None:
+            logger.warning("admin_list_orders: invalid limit %r", args.get("limit"))
+            return jsonify({"error": "invalid limit"}), 400
+        after = None
+        cursor = args.get("cursor", "").strip()
+        if cursor:
+            after = decode_order_cursor(cursor)
+            if after is None:
+                return jsonify({"error": "invalid cursor"}), 400
+        with session_scope() as session:
+            rows, next_cursor = keyset_orders(session, stmt, limit, after)
+            orders = [serialize(r) for r in rows]
+        logger.debug("list_orders: returned %d orders", len(orders))
+        return jsonify({"orders": orders, "next_cursor": next_cursor}), 200
+
+    def generate() -> Iterator[Dict[str, Any]]:
+        with session_scope() as session:
+            ordered = stmt.order_by(Orders.created_at.desc(), Orders.id.desc())
+            for r in session.execute(ordered.execution_options(yield_per=STREAM_YIELD_PER)):
+                yield serialize(r)
+
+    return stream_json(generate, key="orders"), 200
 
 
 @admin_api.route("/get_order/<int:order_id>", methods=["GET"])
@@ -569,6 +650,28 @@ def admin_get_order(order_id: int) -> Tuple[Response, int]:
     return jsonify({"order": data}), 200
 
 
+# Цепочка статусов заказа и дата, проставляемая при переходе в статус
+STATUS_FLOW = [
+    "Дата заказа",         # created_at
+    "В обработке",         # processed_at
+    "Выкуплен",            # purchased_at
+    "Собран",              # assembled_at
+    "В пути",              # shipped_at
+    "Передан в доставку",  # delivered_at
+    "Выполнен",            # completed_at
+]
+STATUS_TO_COLUMN = {
+    "В обработке":         "processed_at",
+    "Выкуплен":            "purchased_at",
+    "Собран":              "assembled_at",
+    "В пути":              "shipped_at",
+    "Передан в доставку":  "delivered_at",
+    "Выполнен":            "completed_at",
+}
+FINAL_STATUSES = ("Отменен", "Выполнен")
+BULK_STATUS_MAX = 500
+
+
 @admin_api.route("/set_next_status/<int:order_id>", methods=["POST"])
 @admin_required
 @handle_errors
@@ -578,24 +681,6 @@ def admin_set_next_status(order_id: int) -> Tuple[Response, int]:
     Переводит заказ на следующий статус и проставляет соответствующую *_at дату.
     Переход из 'Отменен'/'Выполнен' запрещён.
     """
-    STATUS_FLOW = [
-        "Дата заказа",         # created_at
-        "В обработке",         # processed_at
-        "Выкуплен",            # purchased_at
-        "Собран",              # assembled_at
-        "В пути",              # shipped_at
-        "Передан в доставку",  # delivered_at
-        "Выполнен",            # completed_at
-    ]
-    STATUS_TO_COLUMN = {
-        "В обработке":         "processed_at",
-        "Выкуплен":            "purchased_at",
-        "Собран":              "assembled_at",
-        "В пути":              "shipped_at",
-        "Передан в доставку":  "delivered_at",
-        "Выполнен":            "completed_at",
-    }
-
     logger.debug("set_next_status: order_id=%d", order_id)
     now = datetime.now(ZoneInfo("Europe/Moscow"))
     with session_scope() as session:
@@ -605,7 +690,7 @@ def admin_set_next_status(order_id: int) -> Tuple[Response, int]:
             return jsonify({"error": "not found"}), 404
 
         # запрет перехода из финальных статусов
-        if o.status in ("Отменен", "Выполнен"):
+        if o.status in FINAL_STATUSES:
             logger.debug("set_next_status: blocked from status=%s order_id=%d", o.status, order_id)
             return jsonify({"status": o.status, "message": "blocked from final status"}), 400
 
@@ -647,6 +732,79 @@ def admin_set_next_status(order_id: int) -> Tuple[Response, int]:
         return jsonify({"order_id": out_order_id, "status": out_status, "set_at": out_set_at}), 200
 
 
+@admin_api.route("/set_status_bulk", methods=["POST"])
+@admin_required
+@handle_errors
+@require_json("order_ids", "status")
+def admin_set_status_bulk() -> Tuple[Response, int]:
+    """
+    POST /api/admin/set_status_bulk
+    JSON {order_ids: [int], status: str} — переводит заказы, стоящие на предыдущем
+    шаге STATUS_FLOW, в status одной транзакцией:
+      - текущие статусы — одним SELECT;
+      - статус и *_at дата — одним UPDATE ... FROM (VALUES ...) с проверкой прежнего статуса;
+      - записи ChangeLog — одним multi-row INSERT.
+    Заказы не на том шаге (или уже изменённые параллельно) возвращаются в skipped.
+    """
+    data = request.get_json()
+    target = data["status"]
+    raw_ids = data["order_ids"]
+    if target not in STATUS_FLOW[1:]:
+        logger.warning("set_status_bulk: invalid target status %r", target)
+        return jsonify({"error": "invalid status"}), 400
+    if not isinstance(raw_ids, list) or not raw_ids or len(raw_ids) > BULK_STATUS_MAX:
+        return jsonify({"error": f"order_ids must be a list of 1..{BULK_STATUS_MAX} ids"}), 400
+    try:
+        order_ids = list(dict.fromkeys(int(i) for i in raw_ids))
+    except (TypeError, ValueError):
+        return jsonify({"error": "order_ids must be integers"}), 400
+
+    prev_status = STATUS_FLOW[STATUS_FLOW.index(target) - 1]
+    col = STATUS_TO_COLUMN[target]
+    now = datetime.now(ZoneInfo("Europe/Moscow"))
+    logger.debug("set_status_bulk: %d orders -> %s", len(order_ids), target)
+
+    with session_scope() as session:
+        current = dict(session.execute(
+            select(Orders.id, Orders.status).where(Orders.id.in_(order_ids))
+        ).all())
+
+        skipped: List[Dict[str, Any]] = []
+        rows: List[Tuple[int, str]] = []
+        for oid in order_ids:
+            status = current.get(oid)
+            if status is None:
+                skipped.append({"order_id": oid, "reason": "not found"})
+            elif status in FINAL_STATUSES:
+                skipped.append({"order_id": oid, "status": status, "reason": "final status"})
+            # статус вне цепочки считается «Дата заказа», как в set_next_status
+            elif status == prev_status or (status not in STATUS_FLOW and prev_status == STATUS_FLOW[0]):
+                rows.append((oid, status))
+            else:
+                skipped.append({"order_id": oid, "status": status, "reason": "wrong step"})
+
+        updated: List[int] = []
+        if rows:
+            updated = bulk_set_status(session, rows, target, col, now)
+            lost = set(oid for oid, _ in rows) - set(updated)
+            skipped += [{"order_id": oid, "reason": "changed concurrently"} for oid in sorted(lost)]
+
+            admin_id = get_jwt_identity()
+            admin_user = session.get(Users, admin_id)
+            admin_name = f"{admin_user.first_name} {admin_user.last_name}" if admin_user else f"id={admin_id}"
+            log_changes(session, "Смена статуса заказа", (
+                f"{admin_name} обновил статус заказа #{oid} → {target}" for oid in updated
+            ))
+
+    logger.debug("set_status_bulk: updated=%d skipped=%d", len(updated), len(skipped))
+    return jsonify({
+        "status":  target,
+        "set_at":  now.isoformat(),
+        "updated": updated,
+        "skipped": skipped,
+    }), 200
+
+
 @admin_api.route("/cancel_order/<int:order_id>", methods=["POST"])
 @admin_required
 @handle_errors
@@ -673,12 +831,17 @@ def admin_cancel_order(order_id: int) -> Tuple[Response, int]:
 
         prev_total = o.total or 0
         user_id_for_stats = o.user_id
+        # возвращаем только то, что этот заказ действительно списал при оформлении
+        restock = order_stock_deltas(o.items_json, +1) if o.stock_reserved else {}
 
         o.status = "Отменен"
         o.canceled_at = now
+        o.stock_reserved = False
         session.flush()
 
         adjust_user_order_stats(session, user_id_for_stats, count_delta=-1, amount_delta=-prev_total)
+        if restock:
+            apply_stock_db(session, restock)
 
         out_order_id = o.id
         out_status   = o.status
@@ -689,8 +852,13 @@ def admin_cancel_order(order_id: int) -> Tuple[Response, int]:
         admin_name = f"{admin_user.first_name} {admin_user.last_name}" if admin_user else f"id={admin_id}"
         log_change(action_type="Отмена заказа", description=f"{admin_name} отменил заказ #{out_order_id}")
 
-        logger.debug("cancel_order: ok order_id=%d canceled_at=%s", out_order_id, out_canceled)
-        return jsonify({"order_id": out_order_id, "status": out_status, "canceled_at": out_canceled}), 200
+    # Возвращаем остатки только после фиксации отмены в БД
+    if restock:
+        adjust_stock(restock)
+        bump_stock_db_version()
+
+    logger.debug("cancel_order: ok order_id=%d canceled_at=%s", out_order_id, out_canceled)
+    return jsonify({"order_id": out_order_id, "status": out_status, "canceled_at": out_canceled}), 200
 
 
 @admin_api.route("/delete_order/<int:order_id>", methods=["DELETE"])
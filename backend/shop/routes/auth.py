@@ -2,9 +2,9 @@ import secrets
 import string
 from datetime import timedelta, datetime
 from zoneinfo import ZoneInfo
-from typing import Tuple, Dict
+from typing import Tuple, Dict, Optional
 from email_validator import validate_email, EmailNotValidError
-from flask import Blueprint, jsonify, Response, request
+from flask import Blueprint, jsonify, Response, request, has_request_context
 from flask_jwt_extended import (
     create_access_token,
     create_refresh_token,
@@ -14,6 +14,7 @@ from flask_jwt_extended import (
 )
 from flask_mail import Message
 from ..models import Users, ChangeLog
+from ..utils.cart_store import GUEST_TOKEN_HEADER, merge_guest_state
 from ..utils.db_utils import session_scope
 from ..core.logging import logger
 from ..extensions import redis_client, mail
@@ -43,9 +44,11 @@ def touch_last_visit(user_id: int, strict: bool = False) -> None:
         logger.warning("touch_last_visit: failed to update last_visit for user_id=%s: %s", user_id, exc, exc_info=True)
 
 
-def make_tokens(user_id: str, role: str) -> Dict[str, str]:
+def make_tokens(user_id: str, role: str, guest_token: Optional[str] = None) -> Dict[str, str]:
     """
     Генерирует пару access/refresh токенов для заданного user_id и роли.
+    Гостевая корзина и избранное (guest_token или заголовок X-Guest-Token)
+    сливаются с пользовательскими.
     """
     claims = {"role": role}
 
@@ -65,6 +68,15 @@ def make_tokens(user_id: str, role: str) -> Dict[str, str]:
 
     touch_last_visit(int(user_id))
 
+    if guest_token is None and has_request_context():
+        guest_token = request.headers.get(GUEST_TOKEN_HEADER)
+    if guest_token:
+        try:
+            merge_guest_state(int(user_id), guest_token)
+        except Exception as exc:
+            # вход не должен падать из-за корзины
+            logger.warning("make_tokens: guest merge failed for user_id=%s: %s", user_id, exc, exc_info=True)
+
     return {
         "access_token": access_token,
         "refresh_token": refresh_token,
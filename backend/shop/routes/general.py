@@ -2,9 +2,9 @@ import io
 import os
 import json
 import requests
-from datetime import datetime
+from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
-from typing import Any, Dict, Tuple, List
+from typing import Any, Dict, Tuple, List, Optional
 from flask import Blueprint, jsonify, request, Response
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
@@ -15,13 +15,33 @@ from ..utils.db_utils import session_scope, adjust_user_order_stats
 from ..models import Users, ChangeLog, Review, RequestItem, Addresses, Orders
 from ..extensions import redis_client, minio_client, BUCKET
 from ..utils.logging_utils import log_change
+from ..utils.order_pricing import OrderPricingError, price_delivery, price_order_items
+from ..utils.order_queries import keyset_orders, order_summary, user_orders_select
+from ..utils.pagination import ORDERS_DEFAULT_LIMIT, ORDERS_MAX_LIMIT, decode_order_cursor, parse_limit
 from ..utils.redis_utils import track_visit_counts
-from ..utils.route_utils import handle_errors, require_args, require_json
+from ..utils.cache_utils import bump_stock_db_version, get_parameters_meta, get_reviews_version
+from ..utils.route_utils import handle_errors, idempotent, require_args, require_json, conditional_get
+from ..utils.stock_index import (
+    InsufficientStock, apply_stock_db, confirm_hold, order_stock_deltas, release_hold, reserve_stock,
+)
 from ..utils.storage_utils import upload_request_file
 
 general_api: Blueprint = Blueprint("general_api", __name__, url_prefix="/api/general")
 
 
+def _parameters_version() -> Tuple[Optional[str], Optional[datetime]]:
+    """ETag/Last-Modified публичных параметров из метаданных кеша (AdminSetting.updated_at)."""
+    meta = get_parameters_meta()
+    etag = f"params-{meta['etag']}" if meta.get("etag") else None
+    ts = meta.get("last_modified")
+    return etag, datetime.fromtimestamp(ts, timezone.utc) if ts else None
+
+
+def _reviews_version() -> Tuple[Optional[str], Optional[datetime]]:
+    """ETag набора отзывов: меняется при создании/удалении отзыва."""
+    return f"reviews-{get_reviews_version()}", None
+
+
 @general_api.route("/")
 @handle_errors
 def home() -> Tuple[Response, int]:
@@ -276,6 +296,7 @@ def delete_avatar() -> Tuple[Response, int]:
 
 @general_api.route("/get_parameters", methods=["GET"])
 @handle_errors
+@conditional_get(_parameters_version, "public, max-age=60")
 def get_parameters() -> Tuple[Response, int]:
     """
     GET /api/general/get_parameters
@@ -294,6 +315,7 @@ def get_parameters() -> Tuple[Response, int]:
 
 @general_api.route("/list_reviews", methods=["GET"])
 @handle_errors
+@conditional_get(_reviews_version, "public, max-age=60")
 def list_reviews() -> Tuple[Response, int]:
     """
     GET /api/general/list_reviews
@@ -323,6 +345,7 @@ def list_reviews() -> Tuple[Response, int]:
 
 @general_api.route("/create_request", methods=["POST"])
 @handle_errors
+@idempotent
 def create_request() -> Tuple[Response, int]:
     """
     POST /api/general/create_request
@@ -371,15 +394,18 @@ def create_request() -> Tuple[Response, int]:
 @general_api.route("/create_order", methods=["POST"])
 @jwt_required()
 @handle_errors
+@idempotent
 @require_json("items")
 def create_order() -> Tuple[Response, int]:
     """
     POST /api/general/create_order
     JSON body:
       - items: список объектов { variant_sku, price, qty, delivery_option }
+        (цены пересчитываются на сервере, price клиента только сверяется)
       - address_id
       - payment_method
-      - delivery_type
+      - delivery_type: один из DELIVERY_TARIFFS; стоимость доставки считается на сервере,
+        delivery_price клиента только сверяется
     """
     user_id = int(get_jwt_identity())
     data = request.get_json()
@@ -399,70 +425,111 @@ def create_order() -> Tuple[Response, int]:
         logger.warning("create_order: invalid or empty items for user_id=%d", user_id)
         return jsonify({"error": "items must be a non-empty list"}), 400
 
-    # Определяем адрес доставки
-    address_id = data.get("address_id")
-    with session_scope() as session:
-        if not address_id:
-            primary = session.query(Addresses).filter_by(user_id=user_id, select=True).first()
-            if not primary:
-                logger.warning("create_order: no primary address for user_id=%d", user_id)
-                return jsonify({"error": "No primary address set"}), 400
-            address_id = primary.id
-
-        # Подсчёт суммы товаров
-        subtotal = 0
-        for it in items:
-            price = it.get("price") or 0
-            qty = it.get("qty") or 0
-            subtotal += int(price) * int(qty)
-
-        # Параметры оплаты и доставки
-        first_name = data.get("first_name", "Неизвестное имя")
-        last_name = data.get("last_name", "Неизвестная фамилия")
-        middle_name = data.get("middle_name", "Неизвестное отчество")
-        phone = data.get("phone", "Неизвестный телефон")
-        email = data.get("email", "Неизвестный адрес эл.почты")
-        payment_method = data.get("payment_method", "Нет данных")
-        delivery_type = data.get("delivery_type", "Нет данных")
-        delivery_price = data.get("delivery_price", 0)
-        total = subtotal + delivery_price
-        pvz_id = data.get("pvz_id")
-        pvz_name = data.get("pvz_name")
-        pvz_address = data.get("pvz_address")
-        pvz_lat = data.get("pvz_lat")
-        pvz_lon = data.get("pvz_lon")
-
-        if delivery_type.startswith("Курьер") and not address_id:
-            return jsonify({"error": "address_required"}), 400
-
-        # Создаём заказ
-        order = Orders(
-            user_id=user_id,
-            status='Дата заказа',
-            items_json=items,
-            address_id=address_id,
-            delivery_date=est_date,
-            payment_method=payment_method,
-            delivery_type=delivery_type,
-            delivery_price=delivery_price,
-            total=total,
-            pvz_id=pvz_id,
-            pvz_name=pvz_name,
-            pvz_address=pvz_address,
-            pvz_lat=pvz_lat,
-            pvz_lon=pvz_lon,
-        )
-        session.add(order)
-        session.flush()
-        order_id = order.id
+    client_delivery_price = data.get("delivery_price")
+    if client_delivery_price is not None:
+        try:
+            client_delivery_price = round(float(client_delivery_price))
+        except (TypeError, ValueError, OverflowError):
+            logger.warning("create_order: invalid delivery_price %r", client_delivery_price)
+            return jsonify({"error": "Invalid delivery_price"}), 400
 
-        adjust_user_order_stats(session, user_id, count_delta=1, amount_delta=total)
+    # Цены и сумма считаются на сервере; расхождение с ценой клиента — 409 с актуальными ценами
+    delivery_type = data.get("delivery_type")
+    try:
+        delivery_price = price_delivery(delivery_type)
+        with session_scope() as session:
+            items, subtotal = price_order_items(session, items)
+    except OrderPricingError as e:
+        logger.warning("create_order: %s for user_id=%d", e.code, user_id)
+        status = 400 if e.code in ("invalid_items", "invalid_delivery_type") else 409
+        return jsonify({"error": e.code, "items": e.details}), status
+    if client_delivery_price is not None and client_delivery_price != delivery_price:
+        logger.warning("create_order: delivery_price %d != %d for user_id=%d",
+                       client_delivery_price, delivery_price, user_id)
+        return jsonify({"error": "price_changed", "items": [], "delivery_price": delivery_price}), 409
+
+    # Резервируем остатки до записи заказа: при нехватке — 409 без создания заказа
+    deltas = order_stock_deltas(items, -1)
+    try:
+        hold_id = reserve_stock(deltas)
+    except InsufficientStock as e:
+        logger.warning("create_order: insufficient stock user_id=%d skus=%s", user_id, e.skus)
+        return jsonify({"error": "insufficient_stock", "skus": e.skus}), 409
 
-        log_text = (f"Номер заказа: {order_id}. Сумма заказа: {subtotal}. "
-                    f"Клиент: #{user_id} {first_name} {last_name} {middle_name}. "
-                    f"Контакты: {phone} {email}")
-        logger.debug("create_order: created order_id=%d for user_id=%d subtotal=%.2f total=%.2f address_id=%d",
-                     order_id, user_id, subtotal, total, address_id)
+    # Определяем адрес доставки
+    address_id = data.get("address_id")
+    committed = False
+    try:
+        with session_scope() as session:
+            if not address_id:
+                primary = session.query(Addresses).filter_by(user_id=user_id, select=True).first()
+                if not primary:
+                    logger.warning("create_order: no primary address for user_id=%d", user_id)
+                    return jsonify({"error": "No primary address set"}), 400
+                address_id = primary.id
+
+            # Параметры оплаты и доставки
+            first_name = data.get("first_name", "Неизвестное имя")
+            last_name = data.get("last_name", "Неизвестная фамилия")
+            middle_name = data.get("middle_name", "Неизвестное отчество")
+            phone = data.get("phone", "Неизвестный телефон")
+            email = data.get("email", "Неизвестный адрес эл.почты")
+            payment_method = data.get("payment_method", "Нет данных")
+            total = subtotal + delivery_price
+            pvz_id = data.get("pvz_id")
+            pvz_name = data.get("pvz_name")
+            pvz_address = data.get("pvz_address")
+            pvz_lat = data.get("pvz_lat")
+            pvz_lon = data.get("pvz_lon")
+
+            if delivery_type.startswith("Курьер") and not address_id:
+                return jsonify({"error": "address_required"}), 400
+
+            # Создаём заказ
+            item_count, thumbnail_sku = order_summary(items)
+            order = Orders(
+                user_id=user_id,
+                status='Дата заказа',
+                items_json=items,
+                item_count=item_count,
+                thumbnail_sku=thumbnail_sku,
+                stock_reserved=True,
+                address_id=address_id,
+                delivery_date=est_date,
+                payment_method=payment_method,
+                delivery_type=delivery_type,
+                delivery_price=delivery_price,
+                total=total,
+                pvz_id=pvz_id,
+                pvz_name=pvz_name,
+                pvz_address=pvz_address,
+                pvz_lat=pvz_lat,
+                pvz_lon=pvz_lon,
+            )
+            session.add(order)
+            session.flush()
+            order_id = order.id
+
+            adjust_user_order_stats(session, user_id, count_delta=1, amount_delta=total)
+            apply_stock_db(session, deltas)
+
+            log_text = (f"Номер заказа: {order_id}. Сумма заказа: {subtotal}. "
+                        f"Клиент: #{user_id} {first_name} {last_name} {middle_name}. "
+                        f"Контакты: {phone} {email}")
+            logger.debug("create_order: created order_id=%d for user_id=%d subtotal=%.2f total=%.2f address_id=%d",
+                         order_id, user_id, subtotal, total, address_id)
+        committed = True
+    except InsufficientStock as e:
+        # Остатки в БД разошлись с Redis — заказ откатывается, резерв снимается ниже
+        logger.warning("create_order: db stock short user_id=%d skus=%s", user_id, e.skus)
+        return jsonify({"error": "insufficient_stock", "skus": e.skus}), 409
+    finally:
+        # Заказ зафиксирован — резерв становится списанием, иначе остатки возвращаются
+        if committed:
+            confirm_hold(hold_id)
+            bump_stock_db_version()
+        else:
+            release_hold(hold_id)
 
     # Логируем создание
     log_change("Создание заказа", log_text)
@@ -507,6 +574,48 @@ def get_user_orders() -> Tuple[Response, int]:
     return jsonify({"orders": out}), 200
 
 
+@general_api.route("/list_user_orders", methods=["GET"])
+@jwt_required()
+@handle_errors
+def list_user_orders() -> Tuple[Response, int]:
+    """
+    GET /api/general/list_user_orders?limit=N&cursor=...
+    Страница сводки заказов текущего пользователя (новые первыми):
+    дата, статус, сумма, количество товаров и SKU превью. Состав заказа — в get_user_order.
+    """
+    user_id = int(get_jwt_identity())
+    limit = parse_limit(request.args.get("limit"), ORDERS_DEFAULT_LIMIT, ORDERS_MAX_LIMIT)
+    if limit is None:
+        logger.warning("list_user_orders: invalid limit %r", request.args.get("limit"))
+        return jsonify({"error": "invalid limit"}), 400
+    logger.debug("list_user_orders: user_id=%d limit=%d", user_id, limit)
+
+    after = None
+    cursor = request.args.get("cursor", "").strip()
+    if cursor:
+        after = decode_order_cursor(cursor)
+        if after is None:
+            return jsonify({"error": "invalid cursor"}), 400
+
+    with session_scope() as session:
+        rows, next_cursor = keyset_orders(session, user_orders_select(user_id), limit, after)
+        out: List[Dict[str, Any]] = []
+        for r in rows:
+            finish = r.completed_at or r.delivery_date
+            out.append({
+                "id":            r.id,
+                "status":        r.status,
+                "created_at":    r.created_at.strftime("%d.%m"),
+                "total":         r.total,
+                "finish_date":   finish.strftime("%d.%m") if finish else None,
+                "item_count":    r.item_count,
+                "thumbnail_sku": r.thumbnail_sku,
+            })
+
+    logger.debug("list_user_orders: returned %d orders", len(out))
+    return jsonify({"orders": out, "next_cursor": next_cursor}), 200
+
+
 @general_api.route("/get_user_order/<int:order_id>", methods=["GET"])
 @jwt_required()
 @handle_errors
@@ -1,22 +1,83 @@
-from typing import Tuple, Dict, Any, List
+import json
+from datetime import datetime
+from typing import Tuple, Dict, Any, List, Optional, Iterator
 from flask import Blueprint, request, jsonify, Response
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from ..core.logging import logger
 from ..models import Shoe, Clothing, Accessory
-from ..utils.cache_utils import cache_get, cache_set
+from ..utils.cart_store import (
+    CART_MAX_QTY,
+    GUEST_TOKEN_HEADER,
+    CartVersionConflict,
+    add_line,
+    change_line_label,
+    guest_owner,
+    load_priced_cart,
+    new_guest_token,
+    read_cart,
+    remove_line,
+    replace_cart,
+    save_priced_cart,
+    set_line_qty,
+)
+from ..utils.favorites_store import (
+    add_favorite,
+    hydrate_favorites,
+    list_favorites,
+    remove_favorites,
+    replace_favorites,
+)
+from ..utils.catalog_snapshot import SNAPSHOT_ALL, get_catalog_snapshot, get_listing_version
 from ..utils.db_utils import session_scope
-from ..utils.product_serializer import serialize_product, model_by_category
-from ..utils.route_utils import handle_errors, require_args, require_json
+from ..utils.facet_index import FACET_FIELDS, FACETS_SORT, get_facet_index
+from ..utils.product_index import fetch_products_by_sku
+from ..utils.stock_index import get_stock, get_stock_mirror
+from ..utils.suggest_index import SUGGEST_TOP_K, get_suggest_index
+from ..utils.search import SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT, SEARCH_MAX_OFFSET, search_skus
+from ..utils.pagination import SORT_MODES, DEFAULT_SORT, DEFAULT_LIMIT, MAX_LIMIT, decode_cursor, keyset_page, parse_limit
+from ..utils.product_serializer import (
+    get_delivery_options,
+    group_by_color,
+    model_by_category,
+    product_select,
+    resolve_fields,
+    serialize_row,
+    with_group_fields,
+)
+from ..utils.route_utils import (
+    STREAM_YIELD_PER,
+    conditional_get,
+    handle_errors,
+    require_args,
+    require_json,
+    stream_json,
+)
 
 product_api: Blueprint = Blueprint("product_api", __name__, url_prefix="/api/product")
 
+CATALOG_CACHE_CONTROL = "public, max-age=30"
+BATCH_MAX_SKUS = 300
+
+
+def _catalog_version() -> Tuple[Optional[str], Optional[datetime]]:
+    """ETag каталога: меняется с catalog:version и фоновым обновлением остатков в снапшоте."""
+    return f"catalog-{get_listing_version()}", None
+
 
 @product_api.route("/list_products", methods=["GET"])
 @handle_errors
+@conditional_get(_catalog_version, CATALOG_CACHE_CONTROL, weak=True, vary="Accept-Encoding")
 def list_products() -> Tuple[Response, int]:
     """
     GET /api/product/list_products?category=<cat>
     Возвращает все товары или только указанной категории.
+
+    GET /api/product/list_products?category=<cat>&sort=<mode>&limit=<n>&cursor=<c>
+    Постраничная выдача по ключу (keyset): sort = price_asc | price_desc | newest | popular.
+    Ответ: {items, next_cursor, sort}.
+
+    Набор полей: ?view=card|full (по умолчанию full) или ?fields=a,b,c.
+    ?group=color — одна карточка на color_sku с массивом sizes (без пагинации).
     """
     category = request.args.get("category", "").lower().strip()
     logger.debug("list_products: category=%s", category)
@@ -28,55 +89,362 @@ def list_products() -> Tuple[Response, int]:
             return jsonify({"error": "unknown category"}), 400
         models = [Model]
     else:
+        # product_index не хранит ключей сортировки, поэтому выдача без категории идёт
+        # по таблицам: keyset_page читает из каждой не больше limit + 1 строк по индексу,
+        # полный список отдаётся из снапшота "all"
         models = [Shoe, Clothing, Accessory]
 
-    result: List[Dict[str, Any]] = []
+    view = request.args.get("view", "").strip().lower() or "full"
+    fields, err = resolve_fields(view, request.args.get("fields", ""))
+    if err:
+        logger.warning("list_products: %s", err)
+        return jsonify({"error": err}), 400
+
+    group = request.args.get("group", "").strip().lower()
+    if group not in ("", "color"):
+        logger.warning("list_products: unknown group %s", group)
+        return jsonify({"error": "unknown group"}), 400
+
+    paginated = any(request.args.get(p) for p in ("sort", "limit", "cursor"))
+    if paginated:
+        if group:
+            return jsonify({"error": "group is not supported with pagination"}), 400
+        sort = request.args.get("sort", DEFAULT_SORT).strip().lower()
+        if sort not in SORT_MODES:
+            logger.warning("list_products: unknown sort %s", sort)
+            return jsonify({"error": "unknown sort"}), 400
+        limit = parse_limit(request.args.get("limit"), DEFAULT_LIMIT, MAX_LIMIT)
+        if limit is None:
+            logger.warning("list_products: invalid limit %r", request.args.get("limit"))
+            return jsonify({"error": "invalid limit"}), 400
+
+        after = None
+        cursor = request.args.get("cursor", "").strip()
+        if cursor:
+            after = decode_cursor(cursor, sort)
+            if after is None:
+                return jsonify({"error": "invalid cursor"}), 400
+
+        with session_scope() as session:
+            page, next_cursor = keyset_page(session, models, sort, limit, after, fields)
+            opts = get_delivery_options()
+            items = [serialize_row(M, row, opts, fields) for M, row in page]
+
+        logger.debug("list_products: returned %d items sort=%s", len(items), sort)
+        return jsonify({"items": items, "next_cursor": next_cursor, "sort": sort}), 200
+
+    # Снапшот собран только для именованных представлений
+    snapshot = None if request.args.get("fields") else get_catalog_snapshot()
+    if snapshot is not None:
+        key = models[0].__tablename__ if category else SNAPSHOT_ALL
+        accepted = [enc for enc in ("br", "gzip") if request.accept_encodings[enc]]
+        found = snapshot.body(key, view, accepted, group)
+        if found:
+            body, encoding = found
+            resp = Response(body, mimetype="application/json")
+            if encoding:
+                resp.headers["Content-Encoding"] = encoding
+            logger.debug("list_products: snapshot v%s %s.%s group=%s %dB enc=%s",
+                         snapshot.version, key, view, group, len(body), encoding)
+            return resp, 200
+
+    opts = get_delivery_options()
+    if group:
+        fields = with_group_fields(fields)
+
+    def rows_of(session, Model) -> Iterator[Dict[str, Any]]:
+        stmt = product_select(Model, fields).where(Model.count_in_stock >= 0)
+        if group:
+            # размеры одного цвета идут подряд — группируем на лету по индексу color_sku
+            stmt = stmt.order_by(Model.color_sku)
+        for row in session.execute(stmt.execution_options(yield_per=STREAM_YIELD_PER)):
+            yield serialize_row(Model, row, opts, fields)
+
+    def generate() -> Iterator[Dict[str, Any]]:
+        with session_scope() as session:
+            for Model in models:
+                items = rows_of(session, Model)
+                yield from group_by_color(items) if group else items
+
+    logger.debug("list_products: streaming from db group=%s", group)
+    return stream_json(generate), 200
+
+
+@product_api.route("/search", methods=["GET"])
+@handle_errors
+@require_args("q")
+@conditional_get(_catalog_version, CATALOG_CACHE_CONTROL)
+def search_products() -> Tuple[Response, int]:
+    """
+    GET /api/product/search?q=<text>[&category=<cat>][&limit=<n>][&offset=<n>][&view=card|full][&fields=a,b]
+    Полнотекстовый поиск (русская морфология) с допуском опечаток по триграммам.
+    Ответ: {items, next_offset, q} — товары в порядке релевантности.
+    """
+    q = request.args["q"].strip()
+    if len(q) < 2:
+        logger.warning("search_products: query too short %r", q)
+        return jsonify({"error": "query too short"}), 400
+
+    table = None
+    category = request.args.get("category", "").lower().strip()
+    if category:
+        Model = model_by_category(category)
+        if not Model:
+            logger.error("search_products: unknown category %s", category)
+            return jsonify({"error": "unknown category"}), 400
+        table = Model.__tablename__
+
+    limit = parse_limit(request.args.get("limit"), SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT)
+    try:
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        offset = None
+    if limit is None or offset is None:
+        logger.warning("search_products: invalid limit/offset")
+        return jsonify({"error": "invalid limit or offset"}), 400
+    offset = max(0, min(offset, SEARCH_MAX_OFFSET))
+
+    fields, err = resolve_fields(request.args.get("view", ""), request.args.get("fields", ""))
+    if err:
+        logger.warning("search_products: %s", err)
+        return jsonify({"error": err}), 400
+
     with session_scope() as session:
-        for Model in models:
-            objs = session.query(Model).filter(Model.count_in_stock >= 0).all()
-            for obj in objs:
-                result.append(serialize_product(obj))
+        skus, has_more = search_skus(session, q, limit, offset, table)
+        data_map = fetch_products_by_sku(session, skus, fields, visible_only=True)
+    items = [data_map[sku] for sku in skus if sku in data_map]
+    next_offset = offset + limit if has_more else None
+
+    logger.debug("search_products: q=%r returned %d items", q, len(items))
+    return jsonify({"items": items, "next_offset": next_offset, "q": q}), 200
 
-    logger.debug("list_products: returned %d items", len(result))
+
+@product_api.route("/suggest", methods=["GET"])
+@handle_errors
+@require_args("q")
+def suggest() -> Tuple[Response, int]:
+    """
+    GET /api/product/suggest?q=<prefix>[&limit=<n>]
+    Подсказки по брендам, названиям и подкатегориям из in-memory префиксного дерева.
+    Ответ: {q, items: [{text, type}]} в порядке популярности.
+    """
+    q = request.args["q"]
+    limit = parse_limit(request.args.get("limit"), SUGGEST_TOP_K, SUGGEST_TOP_K)
+    if limit is None:
+        logger.warning("suggest: invalid limit %r", request.args.get("limit"))
+        return jsonify({"error": "invalid limit"}), 400
+
+    index = get_suggest_index()
+    items = index.lookup(q, limit) if index is not None and q.strip() else []
+
+    logger.debug("suggest: q=%r returned %d items", q, len(items))
+    resp = jsonify({"q": q, "items": items})
+    resp.headers["Cache-Control"] = "public, max-age=60"
+    return resp, 200
+
+
+@product_api.route("/stock", methods=["GET"])
+@handle_errors
+@require_args("skus")
+def get_stock_levels() -> Tuple[Response, int]:
+    """
+    GET /api/product/stock?skus=<sku1,sku2,...>
+    Остатки по списку SKU из in-memory копии Redis-хеша остатков.
+    Ответ: {stock: {variant_sku: count | null}} — null для неизвестных SKU.
+    """
+    skus = list(dict.fromkeys(s.strip() for s in request.args["skus"].split(",") if s.strip()))
+    if len(skus) > BATCH_MAX_SKUS:
+        logger.warning("get_stock_levels: too many skus %d", len(skus))
+        return jsonify({"error": f"too many skus (max {BATCH_MAX_SKUS})"}), 400
+
+    mirror = get_stock_mirror()
+    stock = {sku: mirror.get(sku) for sku in skus}
+
+    logger.debug("get_stock_levels: skus=%d", len(skus))
+    resp = jsonify({"stock": stock})
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp, 200
+
+
+@product_api.route("/facets", methods=["GET"])
+@handle_errors
+def get_facets() -> Tuple[Response, int]:
+    """
+    GET /api/product/facets?category=&brand=&color=&size_label=&gender=&subcategory=
+                           &price=&in_stock=&price_min=&price_max=&limit=&cursor=
+    Фильтрация каталога по in-memory индексу фасетов. Несколько значений — через запятую.
+    Возвращает {ids, count, facets, next_cursor}: страница variant_sku в порядке цены
+    (limit по умолчанию DEFAULT_LIMIT), общее число совпадений и счётчики по каждому фасету.
+    """
+    filters: Dict[str, List[str]] = {}
+    for field in FACET_FIELDS + ("price", "in_stock"):
+        raw = request.args.get(field, "").strip()
+        if raw:
+            filters[field] = [v.strip() for v in raw.split(",") if v.strip()]
+
+    if "category" in filters:
+        tables = []
+        for cat in filters["category"]:
+            Model = model_by_category(cat)
+            if not Model:
+                logger.warning("get_facets: unknown category %s", cat)
+                return jsonify({"error": "unknown category"}), 400
+            tables.append(Model.__tablename__)
+        filters["category"] = tables
+
+    bounds: Dict[str, Any] = {}
+    for name in ("price_min", "price_max"):
+        raw = request.args.get(name, "").strip()
+        if not raw:
+            bounds[name] = None
+            continue
+        try:
+            bounds[name] = int(raw)
+        except ValueError:
+            logger.warning("get_facets: invalid %s=%r", name, raw)
+            return jsonify({"error": f"invalid {name}"}), 400
+
+    limit = parse_limit(request.args.get("limit"), DEFAULT_LIMIT, MAX_LIMIT)
+    if limit is None:
+        logger.warning("get_facets: invalid limit %r", request.args.get("limit"))
+        return jsonify({"error": "invalid limit"}), 400
+    after = None
+    cursor = request.args.get("cursor", "").strip()
+    if cursor:
+        after = decode_cursor(cursor, FACETS_SORT)
+        if after is None or after[0] is None:
+            return jsonify({"error": "invalid cursor"}), 400
+
+    logger.debug("get_facets: filters=%s bounds=%s limit=%d after=%r", filters, bounds, limit, after)
+    result = get_facet_index().query(filters, bounds["price_min"], bounds["price_max"], limit, after)
+
+    logger.debug("get_facets: matched %d variants", result["count"])
     return jsonify(result), 200
 
 
 @product_api.route("/get_product", methods=["GET"])
 @handle_errors
-@require_args("category", "variant_sku")
+@require_args("variant_sku")
+@conditional_get(_catalog_version, CATALOG_CACHE_CONTROL)
 def get_product() -> Tuple[Response, int]:
     """
-    GET /api/product/get_product?category=<cat>&variant_sku=<sku>
-    Возвращает один товар по SKU.
+    GET /api/product/get_product?variant_sku=<sku>[&category=<cat>][&view=card|full][&fields=a,b]
+    Возвращает один товар по SKU. Без category таблица определяется по реестру SKU.
     """
-    category = request.args["category"].lower().strip()
+    category = request.args.get("category", "").lower().strip()
     variant_sku = request.args["variant_sku"].strip()
     logger.debug("get_product: category=%s variant_sku=%s", category, variant_sku)
 
-    Model = model_by_category(category)
-    if not Model:
-        logger.error("get_product: unknown category %s", category)
-        return jsonify({"error": "unknown category"}), 400
+    Model = None
+    if category:
+        Model = model_by_category(category)
+        if not Model:
+            logger.error("get_product: unknown category %s", category)
+            return jsonify({"error": "unknown category"}), 400
+
+    fields, err = resolve_fields(request.args.get("view", ""), request.args.get("fields", ""))
+    if err:
+        logger.warning("get_product: %s", err)
+        return jsonify({"error": err}), 400
 
     with session_scope() as session:
-        obj = session.query(Model).filter_by(variant_sku=variant_sku).first()
-        if not obj:
-            logger.warning("get_product: not found %s/%s", category, variant_sku)
-            return jsonify({"error": "not found"}), 404
-        data = serialize_product(obj)
+        if Model is None:
+            data = fetch_products_by_sku(session, [variant_sku], fields).get(variant_sku)
+        else:
+            stmt = product_select(Model, fields).where(Model.variant_sku == variant_sku)
+            row = session.execute(stmt).first()
+            data = serialize_row(Model, row, fields=fields) if row else None
+
+    if not data:
+        logger.warning("get_product: not found %s/%s", category, variant_sku)
+        return jsonify({"error": "not found"}), 404
 
     logger.debug("get_product: found product %s/%s", category, variant_sku)
     return jsonify(data), 200
 
 
+@product_api.route("/by_sku/<string:variant_sku>", methods=["GET"])
+@handle_errors
+@conditional_get(_catalog_version, CATALOG_CACHE_CONTROL)
+def get_product_by_sku(variant_sku: str) -> Tuple[Response, int]:
+    """
+    GET /api/product/by_sku/<variant_sku>[?view=card|full][&fields=a,b]
+    Возвращает товар по SKU без указания категории (через product_index).
+    """
+    variant_sku = variant_sku.strip()
+    logger.debug("get_product_by_sku: variant_sku=%s", variant_sku)
+
+    fields, err = resolve_fields(request.args.get("view", ""), request.args.get("fields", ""))
+    if err:
+        logger.warning("get_product_by_sku: %s", err)
+        return jsonify({"error": err}), 400
+
+    with session_scope() as session:
+        data = fetch_products_by_sku(session, [variant_sku], fields, visible_only=True).get(variant_sku)
+
+    if not data:
+        logger.warning("get_product_by_sku: not found %s", variant_sku)
+        return jsonify({"error": "not found"}), 404
+
+    logger.debug("get_product_by_sku: found %s", variant_sku)
+    return jsonify(data), 200
+
+
+@product_api.route("/batch", methods=["POST"])
+@handle_errors
+@require_json("skus")
+def get_products_batch() -> Tuple[Response, int]:
+    """
+    POST /api/product/batch
+    JSON {skus: [variant_sku, ...], view?: card|full, fields?: "a,b,c" | [...]}
+    Возвращает товары в порядке входного списка; ненайденные — {variant_sku, missing: true}.
+    Ответ: {items, missing}.
+    """
+    data = request.get_json()
+    skus = data["skus"]
+    if not isinstance(skus, list) or not all(isinstance(s, str) for s in skus):
+        logger.warning("get_products_batch: skus must be a list of strings")
+        return jsonify({"error": "skus must be a list of strings"}), 400
+    if len(skus) > BATCH_MAX_SKUS:
+        logger.warning("get_products_batch: too many skus %d", len(skus))
+        return jsonify({"error": f"too many skus (max {BATCH_MAX_SKUS})"}), 400
+    skus = [s.strip() for s in skus]
+    logger.debug("get_products_batch: skus=%d", len(skus))
+
+    raw_fields = data.get("fields") or ""
+    if isinstance(raw_fields, list):
+        raw_fields = ",".join(str(f) for f in raw_fields)
+    fields, err = resolve_fields(data.get("view") or "", raw_fields)
+    if err:
+        logger.warning("get_products_batch: %s", err)
+        return jsonify({"error": err}), 400
+
+    with session_scope() as session:
+        data_map = fetch_products_by_sku(session, skus, fields, visible_only=True)
+
+    items: List[Dict[str, Any]] = []
+    missing: List[str] = []
+    for sku in skus:
+        found = data_map.get(sku)
+        if found is None:
+            missing.append(sku)
+            items.append({"variant_sku": sku, "missing": True})
+        else:
+            items.append(found)
+
+    logger.debug("get_products_batch: found=%d missing=%d", len(items) - len(missing), len(missing))
+    return jsonify({"items": items, "missing": missing}), 200
+
+
 @product_api.route("/get_cart", methods=["GET"])
 @jwt_required()
 @handle_errors
 @require_args("user_id")
 def get_cart() -> Tuple[Response, int]:
     """
-    GET /api/product/get_cart?user_id=<id>
-    Возвращает содержимое корзины из Redis.
+    GET /api/product/get_cart?user_id=<id>[&view=card|full][&fields=a,b]
+    Возвращает содержимое корзины из Redis: items — по записи на единицу товара,
+    lines — строки {variant_sku, delivery_label, qty}, version — версия корзины.
     """
     uid_str = request.args["user_id"]
     logger.debug("get_cart: raw user_id=%r", uid_str)
@@ -92,41 +460,115 @@ def get_cart() -> Tuple[Response, int]:
         logger.warning("get_cart: access denied for token %d vs param %d", current, uid)
         return jsonify({"error": "Access denied"}), 403
 
-    key = f"cart:{uid}"
-    payload = cache_get(key) or {"items": []}
-    records = payload.get("items", [])
+    return _cart_response(uid)
+
+
+def _cart_owner() -> Optional[Any]:
+    """
+    Владелец корзины/избранного: user_id из JWT или гость по заголовку X-Guest-Token.
+    """
+    identity = get_jwt_identity()
+    if identity:
+        return int(identity)
+    return guest_owner(request.headers.get(GUEST_TOKEN_HEADER))
+
+
+def _cart_response(owner: Any) -> Tuple[Response, int]:
+    """
+    Посчитанная корзина owner: items — по записи на единицу товара,
+    lines — строки {variant_sku, delivery_label, qty}, version — версия корзины.
+    """
+    fields, err = resolve_fields(request.args.get("view", ""), request.args.get("fields", ""))
+    if err:
+        logger.warning("get_cart: %s", err)
+        return jsonify({"error": err}), 400
+    if fields is not None:
+        # для расчёта строк корзины нужны SKU и базовая цена
+        fields = fields + tuple(f for f in ("variant_sku", "price") if f not in fields)
+
+    # Повторное открытие корзины без изменений — цены из кеша, наличие одним HMGET
+    signature, cached = load_priced_cart(owner, ",".join(fields) if fields is not None else "full")
+    if cached is not None:
+        logger.debug("get_cart: priced cache hit for %s", owner)
+        payload = json.loads(cached)
+        stock = get_stock(list(dict.fromkeys(ln["variant_sku"] for ln in payload["lines"] if ln["variant_sku"])))
+        for item in payload["items"]:
+            item["available"] = stock.get(item["variant_sku"])
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        return Response(body, mimetype="application/json"), 200
+
+    version, lines = read_cart(owner)
 
     # Собираем список SKU и пометок доставки
     total = 0
     result_items = []
-    skus = [rec.get("variant_sku") for rec in records]
+    skus = [ln["variant_sku"] for ln in lines]
     # Затем загружаем товары разом
+    opts = get_delivery_options()
+    opt_by_label = {o["label"]: o for o in opts}
     with session_scope() as session:
-        shoes       = session.query(Shoe).filter(Shoe.variant_sku.in_(skus)).all()
-        clothing    = session.query(Clothing).filter(Clothing.variant_sku.in_(skus)).all()
-        accessories = session.query(Accessory).filter(Accessory.variant_sku.in_(skus)).all()
-        obj_map = {obj.variant_sku: obj for obj in shoes + clothing + accessories}
+        data_map = fetch_products_by_sku(session, skus, fields, opts)
+    # Наличие всей корзины — одним HMGET
+    stock = get_stock(list(dict.fromkeys(s for s in skus if s)))
+
+    for ln in lines:
+        sku = ln["variant_sku"]
+        label = ln["delivery_label"]
+        base = data_map.get(sku)
+        if not base:
+            logger.warning("get_cart: item %r not found, skipping", sku)
+            continue
+
+        data = dict(base)
+        opt = opt_by_label.get(label)
+        unit_price = round(data["price"] * (opt["multiplier"] if opt else 1))
+
+        data["unit_price"] = unit_price
+        data["delivery_option"] = opt
+        data["available"] = stock.get(sku)
+
+        result_items.extend([data] * ln["qty"])
+        total += unit_price * ln["qty"]
+
+    body = json.dumps({
+        "items": result_items,
+        "lines": lines,
+        "count": len(result_items),
+        "total": total,
+        "version": version,
+    }, ensure_ascii=False, separators=(",", ":"))
+    save_priced_cart(owner, signature, body)
 
-        for rec in records:
-            sku = rec.get("variant_sku")
-            label = rec.get("delivery_label")
-            obj = obj_map.get(sku)
-            if not obj:
-                logger.warning("get_cart: item %r not found, skipping", sku)
-                continue
+    logger.debug("get_cart: returning %d items, total=%d", len(result_items), total)
+    return Response(body, mimetype="application/json"), 200
 
-            data = serialize_product(obj)
-            opt = next((o for o in data["delivery_options"] if o["label"] == label), None)
-            unit_price = round(obj.price * (opt["multiplier"] if opt else 1))
 
-            data["unit_price"] = unit_price
-            data["delivery_option"] = opt
+@product_api.route("/guest_token", methods=["POST"])
+@handle_errors
+def issue_guest_token() -> Tuple[Response, int]:
+    """
+    POST /api/product/guest_token
+    Выдаёт анонимный токен гостевой корзины/избранного (заголовок X-Guest-Token).
+    При входе гостевые данные сливаются с пользовательскими.
+    """
+    token = new_guest_token()
+    logger.debug("issue_guest_token: issued")
+    return jsonify({"guest_token": token}), 201
 
-            result_items.append(data)
-            total += unit_price
 
-    logger.debug("get_cart: returning %d items, total=%d", len(result_items), total)
-    return jsonify({"items": result_items, "count": len(result_items), "total": total}), 200
+@product_api.route("/cart", methods=["GET"])
+@jwt_required(optional=True)
+@handle_errors
+def get_own_cart() -> Tuple[Response, int]:
+    """
+    GET /api/product/cart[?view=card|full][&fields=a,b]
+    Корзина текущего пользователя или гостя (X-Guest-Token) в формате get_cart.
+    """
+    owner = _cart_owner()
+    if owner is None:
+        logger.warning("get_own_cart: no user and no guest token")
+        return jsonify({"error": "Authorization or guest token required"}), 401
+    return _cart_response(owner)
 
 
 @product_api.route("/save_cart", methods=["POST"])
@@ -136,7 +578,8 @@ def get_cart() -> Tuple[Response, int]:
 def save_cart() -> Tuple[Response, int]:
     """
     POST /api/product/save_cart
-    JSON {user_id: int, items: List[...] }
+    JSON {user_id: int, items: List[{variant_sku, delivery_label}], version?: int}
+    Полная замена корзины; для точечных изменений — /cart/items.
     """
     data = request.get_json()
     uid_str = data["user_id"]
@@ -144,9 +587,14 @@ def save_cart() -> Tuple[Response, int]:
     logger.debug("save_cart: payload=%s", data)
     try:
         uid = int(uid_str)
-    except ValueError:
+    except (TypeError, ValueError):
         logger.warning("save_cart: invalid user_id param %r", uid_str)
         return jsonify({"error": "invalid user_id"}), 400
+    version, err = _cart_version_arg(data.get("version"))
+    err = err or _cart_records_error(items)
+    if err:
+        logger.warning("save_cart: %s", err)
+        return jsonify({"error": err}), 400
     logger.debug("save_cart: user_id=%d items=%d", uid, len(items))
 
     current = int(get_jwt_identity())
@@ -154,11 +602,115 @@ def save_cart() -> Tuple[Response, int]:
         logger.warning("save_cart: access denied for token %d vs param %d", current, uid)
         return jsonify({"error": "Access denied"}), 403
 
-    key = f"cart:{uid}"
-    cache_set(key, {"items": items}, ttl_seconds=60*60*24*365)
+    try:
+        version = replace_cart(uid, items, version)
+    except CartVersionConflict as exc:
+        return jsonify({"error": "version conflict", "version": exc.version}), 409
 
     logger.debug("save_cart: saved %d items for user %d", len(items), uid)
-    return jsonify({"status": "ok"}), 200
+    return jsonify({"status": "ok", "version": version}), 200
+
+
+def _cart_version_arg(raw: Any) -> Tuple[Optional[int], Optional[str]]:
+    """
+    version из тела запроса к корзине: целое или отсутствует.
+    """
+    if raw is None:
+        return None, None
+    if isinstance(raw, bool) or not isinstance(raw, (int, str)):
+        return None, "version must be an integer"
+    try:
+        return int(raw), None
+    except ValueError:
+        return None, "version must be an integer"
+
+
+def _cart_records_error(items: Any) -> Optional[str]:
+    """
+    Проверка items для save_cart: список {variant_sku, delivery_label?, qty?}.
+    """
+    if not isinstance(items, list):
+        return "items must be a list"
+    for rec in items:
+        if not isinstance(rec, dict) or not isinstance(rec.get("variant_sku"), str) or not rec["variant_sku"]:
+            return "each item must have a non-empty string variant_sku"
+        if not isinstance(rec.get("delivery_label") or "", str):
+            return "delivery_label must be a string"
+        try:
+            qty = int(rec.get("qty") or 1)
+        except (TypeError, ValueError, OverflowError):
+            return "qty must be an integer"
+        if not 0 <= qty <= CART_MAX_QTY:
+            return f"qty must be between 0 and {CART_MAX_QTY}"
+    return None
+
+
+def _cart_line_args(data: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Разбор тела запроса к /cart/items: {variant_sku, delivery_label?, qty?, new_label?, version?}.
+    """
+    sku = data.get("variant_sku")
+    if not isinstance(sku, str) or not sku.strip():
+        return None, "variant_sku must be a non-empty string"
+    for name in ("delivery_label", "new_label"):
+        if not isinstance(data.get(name) or "", str):
+            return None, f"{name} must be a string"
+    try:
+        qty = int(data.get("qty", 1))
+    except (TypeError, ValueError, OverflowError):
+        return None, "qty must be an integer"
+    if not 0 <= qty <= CART_MAX_QTY:
+        return None, f"qty must be between 0 and {CART_MAX_QTY}"
+    version, err = _cart_version_arg(data.get("version"))
+    if err:
+        return None, err
+    return {
+        "sku": sku.strip(),
+        "label": data.get("delivery_label") or None,
+        "new_label": data.get("new_label") or None,
+        "qty": qty,
+        "version": version,
+    }, None
+
+
+@product_api.route("/cart/items", methods=["POST", "PUT", "PATCH", "DELETE"])
+@jwt_required(optional=True)
+@handle_errors
+@require_json("variant_sku")
+def cart_items() -> Tuple[Response, int]:
+    """
+    Точечные изменения строки корзины текущего пользователя или гостя (X-Guest-Token):
+      POST   — добавить qty (по умолчанию 1)
+      PUT    — установить qty (0 удаляет строку)
+      PATCH  — сменить вариант доставки: {delivery_label, new_label}
+      DELETE — удалить строку
+    JSON {variant_sku, delivery_label?, qty?, new_label?, version?}.
+    Если передан version и корзина уже изменилась — 409 {error, version}.
+    """
+    uid = _cart_owner()
+    if uid is None:
+        logger.warning("cart_items: no user and no guest token")
+        return jsonify({"error": "Authorization or guest token required"}), 401
+    args, err = _cart_line_args(request.get_json())
+    if err:
+        logger.warning("cart_items: %s", err)
+        return jsonify({"error": err}), 400
+    logger.debug("cart_items: %s owner=%s %s", request.method, uid, args)
+
+    sku, label, version = args["sku"], args["label"], args["version"]
+    try:
+        if request.method == "POST":
+            version = add_line(uid, sku, label, args["qty"] or 1, version)
+        elif request.method == "PUT":
+            version = set_line_qty(uid, sku, label, args["qty"], version)
+        elif request.method == "PATCH":
+            version = change_line_label(uid, sku, label, args["new_label"], version)
+        else:
+            version = remove_line(uid, sku, label, version)
+    except CartVersionConflict as exc:
+        return jsonify({"error": "version conflict", "version": exc.version}), 409
+
+    return jsonify({"status": "ok", "version": version}), 200
 
 
 @product_api.route("/get_favorites", methods=["GET"])
@@ -184,11 +736,11 @@ def get_favorites() -> Tuple[Response, int]:
         logger.warning("get_favorites: access denied for token %d vs param %d", current, uid)
         return jsonify({"error": "Access denied"}), 403
 
-    key = f"favorites:{uid}"
-    payload = cache_get(key) or {"items": [], "count": 0}
+    # в порядке добавления, как клиент хранил список раньше
+    skus, count = list_favorites(uid, newest_first=False)
 
-    logger.debug("get_favorites: returning %d items", payload.get("count", 0))
-    return jsonify(payload), 200
+    logger.debug("get_favorites: returning %d items", count)
+    return jsonify({"items": skus, "count": count}), 200
 
 
 @product_api.route("/save_favorites", methods=["POST"])
@@ -216,9 +768,80 @@ def save_favorites() -> Tuple[Response, int]:
         logger.warning("save_favorites: access denied for token %d vs param %d", current, uid)
         return jsonify({"error": "Access denied"}), 403
 
-    payload = {"items": items, "count": len(items)}
-    key = f"favorites:{uid}"
-    cache_set(key, payload, ttl_seconds=60*60*24*365)
+    if not isinstance(items, list):
+        logger.warning("save_favorites: items must be a list")
+        return jsonify({"error": "items must be a list"}), 400
+    count = replace_favorites(uid, items)
+
+    logger.debug("save_favorites: saved %d items for user %d", count, uid)
+    return jsonify({"status": "ok", "count": count}), 200
+
+
+@product_api.route("/favorites", methods=["GET"])
+@jwt_required(optional=True)
+@handle_errors
+def list_favorite_products() -> Tuple[Response, int]:
+    """
+    GET /api/product/favorites[?offset=<n>][&limit=<n>][&view=card|full][&fields=a,b]
+    Избранное текущего пользователя или гостя (X-Guest-Token) от новых к старым
+    с актуальными данными товаров.
+    Ответ: {items, count, next_offset}; скрытые товары не отдаются, удалённые из каталога — выбрасываются.
+    """
+    uid = _cart_owner()
+    if uid is None:
+        logger.warning("list_favorite_products: no user and no guest token")
+        return jsonify({"error": "Authorization or guest token required"}), 401
+    limit = parse_limit(request.args.get("limit"), DEFAULT_LIMIT, MAX_LIMIT)
+    try:
+        offset = max(0, int(request.args.get("offset", 0)))
+    except ValueError:
+        offset = None
+    if limit is None or offset is None:
+        logger.warning("list_favorite_products: invalid offset/limit")
+        return jsonify({"error": "invalid offset or limit"}), 400
+
+    fields, err = resolve_fields(request.args.get("view", "") or "card", request.args.get("fields", ""))
+    if err:
+        logger.warning("list_favorite_products: %s", err)
+        return jsonify({"error": err}), 400
+
+    skus, count = list_favorites(uid, offset, limit)
+    with session_scope() as session:
+        items, removed = hydrate_favorites(session, uid, skus, fields)
+    # удалённые SKU выпали из множества — следующая страница сдвигается на них;
+    # скрытые товары остаются в множестве и занимают свои позиции
+    count -= removed
+    next_offset = offset + len(skus) - removed
+    if next_offset >= count:
+        next_offset = None
+
+    logger.debug("list_favorite_products: owner %s returned %d of %d", uid, len(items), count)
+    return jsonify({"items": items, "count": count, "next_offset": next_offset}), 200
+
+
+@product_api.route("/favorites", methods=["POST", "DELETE"])
+@jwt_required(optional=True)
+@handle_errors
+@require_json("variant_sku")
+def update_favorite() -> Tuple[Response, int]:
+    """
+    POST   /api/product/favorites {variant_sku} — добавить в избранное
+    DELETE /api/product/favorites {variant_sku} — убрать из избранного
+    Ответ: {status, count}.
+    """
+    uid = _cart_owner()
+    if uid is None:
+        logger.warning("update_favorite: no user and no guest token")
+        return jsonify({"error": "Authorization or guest token required"}), 401
+    sku = request.get_json()["variant_sku"]
+    if not isinstance(sku, str) or not sku.strip():
+        return jsonify({"error": "variant_sku must be a non-empty string"}), 400
+    sku = sku.strip()
+
+    if request.method == "POST":
+        count = add_favorite(uid, sku)
+    else:
+        count = remove_favorites(uid, [sku])
 
-    logger.debug("save_favorites: saved %d items for user %d", len(items), uid)
-    return jsonify({"status": "ok"}), 200
+    logger.debug("update_favorite: %s owner %s sku=%s count=%d", request.method, uid, sku, count)
+    return jsonify({"status": "ok", "count": count}), 200
@@ -1,5 +1,7 @@
+import hashlib
 import json
-from typing import List, Dict, Any
+import secrets
+from typing import List, Dict, Any, Optional
 from sqlalchemy import or_
 from .db_utils import session_scope
 from ..core.logging import logger
@@ -7,6 +9,10 @@ from ..extensions import redis_client
 from ..models import AdminSetting
 
 
+PARAMETERS_META_KEY = "parameters:meta"
+DELIVERY_OPTIONS_VERSION_KEY = "delivery_options:version"
+
+
 # Client Options Cache
 def load_parameters() -> None:
     """
@@ -25,7 +31,16 @@ def load_parameters() -> None:
                 )
             ).all()
             payload = {s.key: s.value or "" for s in settings}
-            redis_client.set("parameters", json.dumps(payload))
+            raw = json.dumps(payload)
+            last_modified = max((s.updated_at for s in settings), default=None)
+            meta = {
+                "etag": hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16],
+                "last_modified": last_modified.timestamp() if last_modified else None,
+            }
+            pipe = redis_client.pipeline()
+            pipe.set("parameters", raw)
+            pipe.set(PARAMETERS_META_KEY, json.dumps(meta))
+            pipe.execute()
             logger.debug("%s END loaded_count=%d", context, len(payload))
     except Exception as exc:
         logger.exception("%s: failed to load parameters", context, exc_info=exc)
@@ -65,10 +80,104 @@ def load_delivery_options() -> None:
         logger.exception("%s: unexpected error loading delivery options", context, exc_info=exc)
         return
 
-    redis_client.set("delivery_options", json.dumps(opts))
+    raw = json.dumps(opts)
+    if redis_client.get("delivery_options") != raw:
+        # версия меняется только при реальном изменении опций (для кеша цен корзин)
+        pipe = redis_client.pipeline()
+        pipe.set("delivery_options", raw)
+        pipe.incr(DELIVERY_OPTIONS_VERSION_KEY)
+        pipe.execute()
     logger.debug("%s END loaded_count=%d", context, len(opts))
 
 
+# Catalog version: общий счётчик изменений каталога для всех воркеров
+CATALOG_VERSION_KEY = "catalog:version"
+
+
+def get_catalog_version() -> int:
+    """
+    Текущая версия каталога (0, если ещё ни разу не увеличивалась).
+    """
+    raw = redis_client.get(CATALOG_VERSION_KEY)
+    try:
+        return int(raw or 0)
+    except (TypeError, ValueError):
+        logger.warning("get_catalog_version: invalid value %r", raw)
+        return 0
+
+
+def bump_catalog_version() -> int:
+    """
+    Увеличивает версию каталога. Вызывать после любых изменений товаров или остатков,
+    чтобы воркеры перестроили производные in-memory структуры.
+    """
+    version = int(redis_client.incr(CATALOG_VERSION_KEY))
+    logger.debug("bump_catalog_version: catalog version -> %d", version)
+    return version
+
+
+# Stock version: увеличивается после заказов и отмен, меняющих count_in_stock в БД.
+# По нему снапшот каталога в фоне догоняет остатки (catalog_snapshot.refresh_catalog_snapshot).
+STOCK_DB_VERSION_KEY = "stock:db:version"
+
+
+def bump_stock_db_version() -> int:
+    """
+    Увеличивает версию остатков в БД. Вызывать после commit, изменившего count_in_stock.
+    """
+    version = int(redis_client.incr(STOCK_DB_VERSION_KEY))
+    logger.debug("bump_stock_db_version: stock db version -> %d", version)
+    return version
+
+
+def get_parameters_meta() -> Dict[str, Any]:
+    """
+    Метаданные кеша parameters: {etag, last_modified (unix ts)}.
+    """
+    return cache_get(PARAMETERS_META_KEY) or {}
+
+
+# Reviews version: увеличивается при создании/удалении отзывов
+REVIEWS_VERSION_KEY = "reviews:version"
+
+
+def get_reviews_version() -> int:
+    raw = redis_client.get(REVIEWS_VERSION_KEY)
+    try:
+        return int(raw or 0)
+    except (TypeError, ValueError):
+        logger.warning("get_reviews_version: invalid value %r", raw)
+        return 0
+
+
+def bump_reviews_version() -> int:
+    version = int(redis_client.incr(REVIEWS_VERSION_KEY))
+    logger.debug("bump_reviews_version: reviews version -> %d", version)
+    return version
+
+
+# Redis locks: снимает только владелец (по токену), чтобы не удалить лок,
+# который после истечения TTL уже взял другой процесс
+_UNLOCK_SCRIPT = redis_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+def acquire_lock(key: str, ttl: int) -> Optional[str]:
+    """
+    SET NX EX со случайным токеном. Возвращает токен или None, если лок занят.
+    """
+    token = secrets.token_hex(8)
+    return token if redis_client.set(key, token, nx=True, ex=ttl) else None
+
+
+def release_lock(key: str, token: str) -> bool:
+    return bool(_UNLOCK_SCRIPT(keys=[key], args=[token]))
+
+
 # Cache utils: Redis JSON access
 def cache_get(key: str):
     """
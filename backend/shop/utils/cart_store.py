@@ -0,0 +1,343 @@
+import json
+import re
+import secrets
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from .cache_utils import CATALOG_VERSION_KEY, DELIVERY_OPTIONS_VERSION_KEY
+from .favorites_store import FAVORITES_MAX, FAVORITES_TTL, GUEST_TTL, ensure_favorites, favorites_key
+from .stock_index import STOCK_KEY
+from ..core.logging import logger
+from ..extensions import redis_client
+
+# Корзина: Redis-хеш cart:{owner}:lines, поле "variant_sku|delivery_label" -> qty,
+# служебное поле "#v" — версия для оптимистичной блокировки.
+# owner — user_id или "g:<token>" для гостя
+CART_TTL = 60 * 60 * 24 * 365
+GUEST_TOKEN_HEADER = "X-Guest-Token"
+GUEST_TOKEN_RE = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+CART_VERSION_FIELD = "#v"
+CART_MAX_QTY = 99
+PRICED_CART_TTL = 60 * 60 * 24
+
+# Операции над строками корзины одним вызовом: проверка версии, изменение, +1 к версии, TTL.
+# ARGV: op, expected_version ('' — без проверки), ttl, далее аргументы операции.
+_CART_SCRIPT = redis_client.register_script("""
+local key = KEYS[1]
+local op = ARGV[1]
+local expected = ARGV[2]
+local ttl = tonumber(ARGV[3])
+local max_qty = tonumber(ARGV[4])
+local current = tonumber(redis.call('HGET', key, '#v') or '0')
+if expected ~= '' and tonumber(expected) ~= current then
+    return {0, current}
+end
+
+if op == 'add' then
+    local qty = redis.call('HINCRBY', key, ARGV[5], tonumber(ARGV[6]))
+    if qty > max_qty then
+        redis.call('HSET', key, ARGV[5], max_qty)
+    elseif qty <= 0 then
+        redis.call('HDEL', key, ARGV[5])
+    end
+elseif op == 'set' then
+    local qty = tonumber(ARGV[6])
+    if qty <= 0 then
+        redis.call('HDEL', key, ARGV[5])
+    else
+        redis.call('HSET', key, ARGV[5], math.min(qty, max_qty))
+    end
+elseif op == 'remove' then
+    redis.call('HDEL', key, ARGV[5])
+elseif op == 'move' then
+    local qty = tonumber(redis.call('HGET', key, ARGV[5]) or '0')
+    if qty > 0 and ARGV[5] ~= ARGV[6] then
+        redis.call('HDEL', key, ARGV[5])
+        local merged = redis.call('HINCRBY', key, ARGV[6], qty)
+        if merged > max_qty then
+            redis.call('HSET', key, ARGV[6], max_qty)
+        end
+    end
+elseif op == 'replace' then
+    redis.call('DEL', key)
+    redis.call('HSET', key, '#v', current)
+    for i = 5, #ARGV, 2 do
+        local qty = tonumber(ARGV[i + 1])
+        if qty > 0 then
+            redis.call('HSET', key, ARGV[i], math.min(qty, max_qty))
+        end
+    end
+else
+    return redis.error_reply('unknown cart op ' .. op)
+end
+
+local version = redis.call('HINCRBY', key, '#v', 1)
+redis.call('EXPIRE', key, ttl)
+return {1, version}
+""")
+
+
+class CartVersionConflict(Exception):
+    """Версия корзины на клиенте устарела."""
+
+    def __init__(self, version: int) -> None:
+        super().__init__(f"cart version conflict, current={version}")
+        self.version = version
+
+
+Owner = Union[int, str]
+
+
+def _lines_key(uid: Owner) -> str:
+    return f"cart:{uid}:lines"
+
+
+def _legacy_key(uid: Owner) -> str:
+    return f"cart:{uid}"
+
+
+def _priced_key(uid: Owner) -> str:
+    return f"cart:{uid}:priced"
+
+
+def _ttl(uid: Owner) -> int:
+    return GUEST_TTL if str(uid).startswith("g:") else CART_TTL
+
+
+def guest_owner(token: Optional[str]) -> Optional[str]:
+    """
+    Владелец гостевой корзины по анонимному токену (None, если токен невалиден).
+    """
+    if not token or not GUEST_TOKEN_RE.match(token):
+        return None
+    return f"g:{token}"
+
+
+def new_guest_token() -> str:
+    return secrets.token_urlsafe(24)
+
+
+def line_field(variant_sku: str, delivery_label: Optional[str]) -> str:
+    return f"{variant_sku}|{delivery_label or ''}"
+
+
+def parse_field(field: str) -> Tuple[str, Optional[str]]:
+    sku, _, label = field.partition("|")
+    return sku, label or None
+
+
+def _count_records(records: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    # старый формат и save_cart: по записи {variant_sku, delivery_label} на единицу товара
+    counts: Dict[str, int] = {}
+    for rec in records or []:
+        sku = (rec or {}).get("variant_sku")
+        if not sku:
+            continue
+        field = line_field(sku, rec.get("delivery_label"))
+        try:
+            qty = int(rec.get("qty") or 1)
+        except (TypeError, ValueError):
+            qty = 1
+        counts[field] = counts.get(field, 0) + max(qty, 0)
+    return counts
+
+
+def migrate_legacy_cart(uid: Owner) -> None:
+    """
+    Переносит JSON-корзину cart:{uid} в хеш при первом обращении.
+    """
+    context = "cart_migrate_legacy"
+    raw = redis_client.get(_legacy_key(uid))
+    if raw is None:
+        return
+    try:
+        records = json.loads(raw).get("items", [])
+    except (ValueError, AttributeError):
+        logger.warning("%s: broken legacy cart for user %s, dropping", context, uid)
+        records = []
+    counts = _count_records(records)
+    args: List[Any] = []
+    for field, qty in counts.items():
+        args += [field, qty]
+    _CART_SCRIPT(keys=[_lines_key(uid)], args=["replace", "", _ttl(uid), CART_MAX_QTY, *args])
+    redis_client.delete(_legacy_key(uid))
+    logger.debug("%s: user %s migrated %d lines", context, uid, len(counts))
+
+
+def read_cart(uid: Owner) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Строки корзины и её версия. TTL продлевается в том же pipeline, что и чтение.
+    Возвращает (version, [{variant_sku, delivery_label, qty}]).
+    """
+    key = _lines_key(uid)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hgetall(key)
+    pipe.expire(key, _ttl(uid))
+    raw, _ = pipe.execute()
+    if not raw and redis_client.exists(_legacy_key(uid)):
+        migrate_legacy_cart(uid)
+        raw = redis_client.hgetall(key)
+
+    version = int(raw.pop(CART_VERSION_FIELD, 0) or 0)
+    lines = []
+    for field, qty in raw.items():
+        sku, label = parse_field(field)
+        lines.append({"variant_sku": sku, "delivery_label": label, "qty": int(qty)})
+    lines.sort(key=lambda ln: (ln["variant_sku"], ln["delivery_label"] or ""))
+    return version, lines
+
+
+def cart_version(uid: Owner) -> int:
+    return int(redis_client.hget(_lines_key(uid), CART_VERSION_FIELD) or 0)
+
+
+def _apply(uid: Owner, op: str, expected: Optional[int], *args: Any) -> int:
+    if not redis_client.exists(_lines_key(uid)):
+        migrate_legacy_cart(uid)
+    ok, version = _CART_SCRIPT(
+        keys=[_lines_key(uid)],
+        args=[op, "" if expected is None else int(expected), _ttl(uid), CART_MAX_QTY, *args],
+    )
+    if not ok:
+        logger.debug("cart_%s: version conflict for user %s (expected %s, current %s)",
+                     op, uid, expected, version)
+        raise CartVersionConflict(int(version))
+    logger.debug("cart_%s: user %s -> version %s", op, uid, version)
+    return int(version)
+
+
+def add_line(uid: Owner, sku: str, label: Optional[str], qty: int = 1, expected: Optional[int] = None) -> int:
+    return _apply(uid, "add", expected, line_field(sku, label), qty)
+
+
+def set_line_qty(uid: Owner, sku: str, label: Optional[str], qty: int, expected: Optional[int] = None) -> int:
+    return _apply(uid, "set", expected, line_field(sku, label), qty)
+
+
+def remove_line(uid: Owner, sku: str, label: Optional[str], expected: Optional[int] = None) -> int:
+    return _apply(uid, "remove", expected, line_field(sku, label))
+
+
+def change_line_label(
+    uid: Owner, sku: str, label: Optional[str], new_label: Optional[str], expected: Optional[int] = None,
+) -> int:
+    return _apply(uid, "move", expected, line_field(sku, label), line_field(sku, new_label))
+
+
+def replace_cart(uid: Owner, records: Iterable[Dict[str, Any]], expected: Optional[int] = None) -> int:
+    """
+    Полная замена корзины (save_cart): записи по единице товара или с полем qty.
+    """
+    args: List[Any] = []
+    for field, qty in _count_records(records).items():
+        args += [field, qty]
+    version = _apply(uid, "replace", expected, *args)
+    redis_client.delete(_legacy_key(uid))
+    return version
+
+
+# Priced cart cache: готовый ответ get_cart, действительный для конкретных версий
+def load_priced_cart(uid: Owner, variant: str) -> Tuple[str, Optional[str]]:
+    """
+    Одним pipeline читает версии корзины, каталога и опций доставки
+    вместе с закешированным ответом (и продлевает TTL корзины).
+    Возвращает (signature, body): body — JSON-ответ, если он посчитан для этих же версий.
+    Остатки в подпись не входят (меняются при каждом оформлении заказа):
+    поле available вызывающий код обновляет сам.
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hget(_lines_key(uid), CART_VERSION_FIELD)
+    pipe.get(CATALOG_VERSION_KEY)
+    pipe.get(DELIVERY_OPTIONS_VERSION_KEY)
+    pipe.get(_priced_key(uid))
+    pipe.expire(_lines_key(uid), _ttl(uid))
+    cart_v, catalog_v, delivery_v, cached, _ = pipe.execute()
+
+    signature = f"{cart_v or 0}:{catalog_v or 0}:{delivery_v or 0}:{variant}"
+    if cached:
+        sig, _, body = cached.partition("\n")
+        if sig == signature:
+            return signature, body
+    return signature, None
+
+
+def save_priced_cart(uid: Owner, signature: str, body: str) -> None:
+    redis_client.set(_priced_key(uid), f"{signature}\n{body}", ex=PRICED_CART_TTL)
+
+
+# Guest merge: слияние гостевой корзины и избранного с пользовательскими при входе.
+# KEYS: user lines, guest lines, user favorites, guest favorites, stock, guest priced cart
+# ARGV: cart ttl, max qty, favorites ttl, favorites max
+_MERGE_SCRIPT = redis_client.register_script("""
+local user_key, guest_key = KEYS[1], KEYS[2]
+local user_fav, guest_fav = KEYS[3], KEYS[4]
+local stock_key = KEYS[5]
+local max_qty = tonumber(ARGV[2])
+local merged = 0
+
+local guest = redis.call('HGETALL', guest_key)
+if #guest > 0 then
+    -- строка пользователя для каждого SKU (дедупликация по variant_sku)
+    local by_sku = {}
+    local user = redis.call('HGETALL', user_key)
+    for i = 1, #user, 2 do
+        local sku = string.match(user[i], '^([^|]*)|')
+        if sku and by_sku[sku] == nil then
+            by_sku[sku] = user[i]
+        end
+    end
+    for i = 1, #guest, 2 do
+        local field, qty = guest[i], tonumber(guest[i + 1])
+        local sku = string.match(field, '^([^|]*)|')
+        if sku and qty and qty > 0 then
+            local target = by_sku[sku] or field
+            local have = tonumber(redis.call('HGET', user_key, target) or '0')
+            local limit = max_qty
+            local stock = redis.call('HGET', stock_key, sku)
+            if stock then
+                limit = math.min(limit, math.max(tonumber(stock), have))
+            end
+            local total = math.min(have + qty, limit)
+            if total > have then
+                redis.call('HSET', user_key, target, total)
+                merged = merged + 1
+            end
+            by_sku[sku] = target
+        end
+    end
+    redis.call('HINCRBY', user_key, '#v', 1)
+    redis.call('EXPIRE', user_key, tonumber(ARGV[1]))
+    redis.call('DEL', guest_key, KEYS[6])
+end
+
+if redis.call('EXISTS', guest_fav) == 1 then
+    redis.call('ZUNIONSTORE', user_fav, 2, user_fav, guest_fav, 'AGGREGATE', 'MIN')
+    redis.call('ZREMRANGEBYRANK', user_fav, 0, -tonumber(ARGV[4]) - 1)
+    redis.call('EXPIRE', user_fav, tonumber(ARGV[3]))
+    redis.call('DEL', guest_fav)
+end
+return merged
+""")
+
+
+def merge_guest_state(uid: int, token: Optional[str]) -> int:
+    """
+    Переносит гостевую корзину и избранное в пользовательские одним Lua-вызовом:
+    количества одного SKU суммируются в пределах остатка, гостевые ключи удаляются.
+    Возвращает число изменённых строк корзины.
+    """
+    guest = guest_owner(token)
+    if guest is None:
+        return 0
+    # JSON-корзины старого формата переносим заранее, иначе хеш их «перекроет»
+    if not redis_client.exists(_lines_key(uid)):
+        migrate_legacy_cart(uid)
+    ensure_favorites(uid)
+
+    merged = _MERGE_SCRIPT(
+        keys=[
+            _lines_key(uid), _lines_key(guest), favorites_key(uid), favorites_key(guest),
+            STOCK_KEY, _priced_key(guest),
+        ],
+        args=[CART_TTL, CART_MAX_QTY, FAVORITES_TTL, FAVORITES_MAX],
+    )
+    logger.debug("merge_guest_state: user %d merged %s cart lines from guest", uid, merged)
+    return int(merged)
@@ -0,0 +1,258 @@
+import gzip
+import json
+import threading
+from typing import Dict, List, Optional, Tuple, Any
+from .cache_utils import CATALOG_VERSION_KEY, STOCK_DB_VERSION_KEY, acquire_lock, release_lock
+from .db_utils import session_scope
+from .product_serializer import VIEWS, get_delivery_options, group_by_color, product_select, serialize_rows
+from ..core.logging import logger
+from ..extensions import redis_bin_client, redis_client
+from ..models import Shoe, Clothing, Accessory
+
+try:
+    import brotli
+except ImportError:  # без brotli снапшот отдаётся только gzip/identity
+    brotli = None
+    logger.warning("catalog_snapshot: brotli is not installed, br snapshots are disabled")
+
+SNAPSHOT_CATEGORIES: Dict[str, type] = {
+    "shoes":       Shoe,
+    "clothing":    Clothing,
+    "accessories": Accessory,
+}
+SNAPSHOT_ALL = "all"
+SNAPSHOT_VIEWS = tuple(VIEWS)
+SNAPSHOT_GROUPS = ("", "color")
+SNAPSHOT_TTL = 60 * 60 * 24 * 7
+SNAPSHOT_LOCK_KEY = "catalog:snapshot:lock"
+SNAPSHOT_LOCK_TTL = 120
+# Версия собранного снапшота "{catalog}.{stock}": указатель для всех воркеров
+SNAPSHOT_VERSION_KEY = "catalog:snapshot:version"
+# Заказы не сбрасывают снапшот: остатки в нём обновляются в фоне не чаще раза в интервал
+SNAPSHOT_REFRESH_KEY = "catalog:snapshot:refresh"
+SNAPSHOT_REFRESH_INTERVAL = 5 * 60
+
+
+def _snapshot_key(version: str, label: str, encoding: str) -> str:
+    return f"catalog:snapshot:{version}:{label}:{encoding}"
+
+
+def _label(category: str, view: str, group: str = "") -> str:
+    return f"{category}.{view}.{group}" if group else f"{category}.{view}"
+
+
+def _labels() -> List[str]:
+    categories = list(SNAPSHOT_CATEGORIES) + [SNAPSHOT_ALL]
+    return [_label(c, v, g) for c in categories for v in SNAPSHOT_VIEWS for g in SNAPSHOT_GROUPS]
+
+
+def _dumps(items: List[Dict[str, Any]]) -> bytes:
+    return json.dumps(items, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _concat(payloads: List[bytes]) -> bytes:
+    # склейка готовых JSON-массивов без повторной сериализации
+    inner = [p[1:-1] for p in payloads if len(p) > 2]
+    return b"[" + b",".join(inner) + b"]"
+
+
+def _encodings() -> List[str]:
+    return ["identity", "gzip"] + (["br"] if brotli is not None else [])
+
+
+class CatalogSnapshot:
+    """
+    Предкодированный каталог одной версии: "category.view[.group]" -> encoding -> bytes.
+    Объект неизменяем после создания, воркер подменяет ссылку целиком.
+    """
+
+    def __init__(self, version: str, bodies: Dict[str, Dict[str, bytes]]) -> None:
+        self.version = version
+        self.bodies = bodies
+
+    def body(self, category: str, view: str, accepted: List[str], group: str = "") -> Optional[tuple]:
+        """
+        Возвращает (bytes, content_encoding) с учётом Accept-Encoding клиента
+        или None, если категории/представления в снапшоте нет.
+        """
+        variants = self.bodies.get(_label(category, view, group))
+        if not variants:
+            return None
+        for enc in ("br", "gzip"):
+            if enc in accepted and enc in variants:
+                return variants[enc], enc
+        return variants["identity"], None
+
+
+# Per-worker snapshot
+_snapshot: Optional[CatalogSnapshot] = None
+_lock = threading.Lock()
+
+
+def _encode(payload: bytes) -> Dict[str, bytes]:
+    out = {"identity": payload, "gzip": gzip.compress(payload, compresslevel=6)}
+    if brotli is not None:
+        out["br"] = brotli.compress(payload, quality=9)
+    return out
+
+
+def build_catalog_snapshot(version: str) -> CatalogSnapshot:
+    """
+    Сериализует все товары по категориям, кодирует в JSON-байты (+gzip/br)
+    и сохраняет в Redis одной транзакцией.
+    """
+    context = "build_catalog_snapshot"
+    logger.debug("%s START version=%s", context, version)
+
+    parts: Dict[str, bytes] = {}
+    opts = get_delivery_options()
+    with session_scope() as session:
+        for view in SNAPSHOT_VIEWS:
+            fields = VIEWS[view]
+            per_view: List[bytes] = []
+            per_view_grouped: List[bytes] = []
+            for category, Model in SNAPSHOT_CATEGORIES.items():
+                stmt = product_select(Model, fields).where(Model.count_in_stock >= 0)
+                items: List[Dict[str, Any]] = serialize_rows(Model, session.execute(stmt), opts, fields)
+                payload = _dumps(items)
+                items.sort(key=lambda d: d.get("color_sku") or "")
+                grouped = _dumps(list(group_by_color(items)))
+                parts[_label(category, view)] = payload
+                parts[_label(category, view, "color")] = grouped
+                per_view.append(payload)
+                per_view_grouped.append(grouped)
+
+            parts[_label(SNAPSHOT_ALL, view)] = _concat(per_view)
+            parts[_label(SNAPSHOT_ALL, view, "color")] = _concat(per_view_grouped)
+
+    bodies = {category: _encode(payload) for category, payload in parts.items()}
+
+    pipe = redis_bin_client.pipeline(transaction=True)
+    for category, variants in bodies.items():
+        for enc, body in variants.items():
+            pipe.set(_snapshot_key(version, category, enc), body, ex=SNAPSHOT_TTL)
+    pipe.set(SNAPSHOT_VERSION_KEY, version, ex=SNAPSHOT_TTL)
+    pipe.execute()
+
+    logger.debug("%s END version=%s sizes=%s", context, version,
+                 {c: len(v["identity"]) for c, v in bodies.items()})
+    return CatalogSnapshot(version, bodies)
+
+
+def _load_snapshot(version: str) -> Optional[CatalogSnapshot]:
+    context = "load_snapshot"
+    encodings = _encodings()
+    labels = _labels()
+    keys = [_snapshot_key(version, label, e) for label in labels for e in encodings]
+    values = redis_bin_client.mget(keys)
+
+    bodies: Dict[str, Dict[str, bytes]] = {}
+    it = iter(values)
+    for label in labels:
+        variants = {enc: next(it) for enc in encodings}
+        if variants["identity"] is None:
+            logger.debug("%s: snapshot v%s missing %s", context, version, label)
+            return None
+        bodies[label] = {enc: body for enc, body in variants.items() if body is not None}
+
+    logger.debug("%s: loaded snapshot v%s from redis", context, version)
+    return CatalogSnapshot(version, bodies)
+
+
+def _versions() -> Tuple[int, int, Optional[str]]:
+    """
+    (catalog:version, stock:db:version, версия собранного снапшота) одним MGET.
+    """
+    raw = redis_client.mget(CATALOG_VERSION_KEY, STOCK_DB_VERSION_KEY, SNAPSHOT_VERSION_KEY)
+    try:
+        catalog, stock = int(raw[0] or 0), int(raw[1] or 0)
+    except (TypeError, ValueError):
+        logger.warning("catalog_snapshot: invalid versions %r", raw)
+        catalog, stock = 0, 0
+    return catalog, stock, raw[2]
+
+
+def _same_catalog(snapshot_version: Optional[str], catalog: int) -> bool:
+    return snapshot_version is not None and snapshot_version.split(".", 1)[0] == str(catalog)
+
+
+def get_listing_version() -> str:
+    """
+    Версия выдачи каталога для ETag: версия собранного снапшота, если он собран
+    под текущий каталог, иначе только версия каталога. Заказы её не меняют —
+    она сдвигается вместе с фоновым обновлением снапшота.
+    """
+    catalog, _, current = _versions()
+    return current if _same_catalog(current, catalog) else str(catalog)
+
+
+def _build_locked(blocking: bool) -> Optional[CatalogSnapshot]:
+    """
+    Собирает снапшот под текущие версии под локом воркера и Redis-локом.
+    None — сборка уже идёт (в этом воркере при blocking=False или в другом).
+    """
+    global _snapshot
+    if not _lock.acquire(blocking=blocking):
+        return None
+    try:
+        token = acquire_lock(SNAPSHOT_LOCK_KEY, SNAPSHOT_LOCK_TTL)
+        if token is None:
+            return None
+        try:
+            # версии читаются под локом: заказ во время сборки оставит снапшот
+            # с прежней версией остатков, и следующее обновление его пересоберёт
+            catalog, stock, _ = _versions()
+            snapshot = build_catalog_snapshot(f"{catalog}.{stock}")
+        finally:
+            release_lock(SNAPSHOT_LOCK_KEY, token)
+        _snapshot = snapshot
+        return snapshot
+    finally:
+        _lock.release()
+
+
+def rebuild_catalog_snapshot() -> Optional[CatalogSnapshot]:
+    """
+    Перестраивает снапшот под текущую версию каталога и подменяет его в памяти воркера.
+    """
+    return _build_locked(blocking=True)
+
+
+def refresh_catalog_snapshot() -> bool:
+    """
+    Фоновое обновление остатков в снапшоте (вызывается свипером): если после сборки
+    были заказы, пересобирает его не чаще раза в SNAPSHOT_REFRESH_INTERVAL.
+    """
+    catalog, stock, current = _versions()
+    if current == f"{catalog}.{stock}":
+        return False
+    if not redis_client.set(SNAPSHOT_REFRESH_KEY, 1, nx=True, ex=SNAPSHOT_REFRESH_INTERVAL):
+        return False
+    logger.debug("refresh_catalog_snapshot: %s -> %d.%d", current, catalog, stock)
+    return _build_locked(blocking=True) is not None
+
+
+def get_catalog_snapshot() -> Optional[CatalogSnapshot]:
+    """
+    Снапшот текущего каталога: из памяти воркера, иначе из Redis. Синхронно
+    (под Redis-локом) он строится только после изменения каталога или потери ключей,
+    остатки после заказов догоняет refresh_catalog_snapshot.
+    None — снапшот собирается другим воркером: вызывающий код идёт в БД,
+    чтобы не отдать байты старого каталога.
+    """
+    global _snapshot
+    context = "get_catalog_snapshot"
+    catalog, _, version = _versions()
+    if _same_catalog(version, catalog):
+        current = _snapshot
+        if current is not None and current.version == version:
+            return current
+        loaded = _load_snapshot(version)
+        if loaded is not None:
+            _snapshot = loaded
+            return loaded
+
+    snapshot = _build_locked(blocking=False)
+    if snapshot is None:
+        logger.debug("%s: catalog v%d is being built elsewhere, falling back to db", context, catalog)
+    return snapshot
@@ -0,0 +1,211 @@
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple, Any, Iterable
+from .cache_utils import get_catalog_version
+from .db_utils import session_scope
+from .pagination import DEFAULT_LIMIT, encode_cursor
+from ..core.logging import logger
+from .stock_index import stock_mirror_since
+from ..models import Shoe, Clothing, Accessory
+
+# Фасеты каталога и границы ценовых корзин (руб.)
+FACET_FIELDS: Tuple[str, ...] = ("category", "brand", "color", "size_label", "gender", "subcategory")
+PRICE_BUCKETS: Tuple[int, ...] = (0, 5000, 10000, 20000, 50000, 100000)
+PRODUCT_MODELS: Tuple[type, ...] = (Shoe, Clothing, Accessory)
+# ids отдаются страницами в порядке (price, variant_sku); курсор — как у list_products?sort=price_asc
+FACETS_SORT = "price_asc"
+
+
+def _bucket_label(price: int) -> str:
+    idx = bisect_right(PRICE_BUCKETS, price) - 1
+    lo = PRICE_BUCKETS[max(idx, 0)]
+    if idx >= len(PRICE_BUCKETS) - 1:
+        return f"{lo}+"
+    return f"{lo}-{PRICE_BUCKETS[idx + 1]}"
+
+
+def _split_values(field: str, value: Optional[str]) -> Iterable[str]:
+    if not value:
+        return ()
+    if field == "color":
+        # color хранится как отсортированный список через запятую: 'Белый, Черный'
+        return [c.strip() for c in value.split(",") if c.strip()]
+    return (value,)
+
+
+def _positions(mask: int) -> List[int]:
+    # bin() разворачивается в C, это быстрее побитового цикла на больших масках
+    bits = bin(mask)[:1:-1]
+    return [i for i, b in enumerate(bits) if b == "1"]
+
+
+class FacetIndex:
+    """
+    Инвертированный индекс каталога: для каждого значения фасета — битовая маска
+    (Python int) позиций вариантов. Позиции присвоены в порядке (price, variant_sku),
+    поэтому ценовой диапазон — это непрерывный отрезок битов.
+    Фасет in_stock не хранится в индексе, а берётся из зеркала остатков при запросе.
+    """
+
+    def __init__(self, version: int, rows: List[Dict[str, Any]]) -> None:
+        rows.sort(key=lambda r: (r["price"], r["variant_sku"]))
+        self.version = version
+        self.skus: List[str] = [r["variant_sku"] for r in rows]
+        self.prices: List[int] = [r["price"] for r in rows]
+        self.keys: List[Tuple[int, str]] = list(zip(self.prices, self.skus))
+        self.pos: Dict[str, int] = {sku: i for i, sku in enumerate(self.skus)}
+        self.all_mask: int = (1 << len(rows)) - 1
+        self.bitmaps: Dict[str, Dict[str, int]] = {f: {} for f in FACET_FIELDS}
+        self.bitmaps["price"] = {}
+        self._stock_mask = 0
+        self._stock_version: Optional[int] = None
+        self._stock_lock = threading.Lock()
+
+        for pos, row in enumerate(rows):
+            bit = 1 << pos
+            for field in FACET_FIELDS:
+                for val in _split_values(field, row.get(field)):
+                    bucket = self.bitmaps[field]
+                    bucket[val] = bucket.get(val, 0) | bit
+            price_map = self.bitmaps["price"]
+            label = _bucket_label(row["price"])
+            price_map[label] = price_map.get(label, 0) | bit
+
+    def _in_stock_mask(self) -> int:
+        """
+        Маска вариантов в наличии по зеркалу остатков. После заказа
+        переставляются только биты изменённых SKU, целиком — после перечитывания зеркала.
+        """
+        with self._stock_lock:
+            mirror, version, changed = stock_mirror_since(self._stock_version)
+            if changed is None:
+                bits = "".join("1" if mirror.get(sku, 0) > 0 else "0" for sku in reversed(self.skus))
+                mask = int(bits or "0", 2)
+            else:
+                mask = self._stock_mask
+                for sku in changed:
+                    pos = self.pos.get(sku)
+                    if pos is None:
+                        continue
+                    if mirror.get(sku, 0) > 0:
+                        mask |= 1 << pos
+                    else:
+                        mask &= ~(1 << pos)
+            self._stock_mask, self._stock_version = mask, version
+            return mask
+
+    def _range_mask(self, price_min: Optional[int], price_max: Optional[int]) -> int:
+        lo = bisect_left(self.prices, price_min) if price_min is not None else 0
+        hi = bisect_right(self.prices, price_max) if price_max is not None else len(self.prices)
+        if hi <= lo:
+            return 0
+        return ((1 << hi) - 1) ^ ((1 << lo) - 1)
+
+    def query(
+        self,
+        filters: Dict[str, List[str]],
+        price_min: Optional[int] = None,
+        price_max: Optional[int] = None,
+        limit: int = DEFAULT_LIMIT,
+        after: Optional[Tuple[int, str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Пересечение фасетов (ИЛИ внутри фасета, И между фасетами).
+        Счётчики каждого фасета считаются без его собственного фильтра,
+        чтобы клиент видел, сколько товаров даст выбор другого значения.
+        ids — не более limit variant_sku после позиции after (price, variant_sku),
+        count — всего совпадений, next_cursor — курсор следующей страницы или None.
+        """
+        in_stock = self._in_stock_mask()
+        bitmaps = dict(self.bitmaps)
+        bitmaps["in_stock"] = {"1": in_stock, "0": self.all_mask & ~in_stock}
+
+        masks: Dict[str, int] = {}
+        for field, values in filters.items():
+            bucket = bitmaps.get(field)
+            if bucket is None or not values:
+                continue
+            m = 0
+            for v in values:
+                m |= bucket.get(v, 0)
+            masks[field] = m
+        if price_min is not None or price_max is not None:
+            masks["__range"] = self._range_mask(price_min, price_max)
+
+        result = self.all_mask
+        for m in masks.values():
+            result &= m
+
+        facets: Dict[str, Dict[str, int]] = {}
+        for field, bucket in bitmaps.items():
+            base = self.all_mask
+            for other, m in masks.items():
+                if other != field:
+                    base &= m
+            facets[field] = {val: (bm & base).bit_count() for val, bm in bucket.items() if bm & base}
+
+        # страница: биты после позиции курсора, не больше limit + 1
+        start = bisect_right(self.keys, after) if after is not None else 0
+        positions = _positions(result >> start)[:limit + 1]
+        ids = [self.skus[start + i] for i in positions[:limit]]
+        next_cursor = None
+        if len(positions) > limit:
+            last = start + positions[limit - 1]
+            next_cursor = encode_cursor(FACETS_SORT, self.prices[last], self.skus[last])
+        return {"ids": ids, "count": result.bit_count(), "facets": facets, "next_cursor": next_cursor}
+
+
+# Per-worker index
+_index: Optional[FacetIndex] = None
+_lock = threading.Lock()
+
+
+def build_facet_index(version: int) -> FacetIndex:
+    """
+    Читает из всех таблиц товаров только колонки фасетов и строит индекс.
+    """
+    context = "build_facet_index"
+    logger.debug("%s START version=%d", context, version)
+    rows: List[Dict[str, Any]] = []
+    with session_scope() as session:
+        for Model in PRODUCT_MODELS:
+            q = session.query(
+                Model.variant_sku, Model.brand, Model.color, Model.size_label,
+                Model.gender, Model.subcategory, Model.price,
+            ).filter(Model.count_in_stock >= 0, Model.price.isnot(None))
+            category = Model.__tablename__
+            for r in q:
+                row = r._asdict()
+                row["category"] = category
+                rows.append(row)
+
+    index = FacetIndex(version, rows)
+    logger.debug("%s END variants=%d", context, len(index.skus))
+    return index
+
+
+def rebuild_facet_index() -> FacetIndex:
+    """
+    Принудительно перестраивает индекс текущего воркера под актуальную версию каталога.
+    """
+    global _index
+    with _lock:
+        _index = build_facet_index(get_catalog_version())
+        return _index
+
+
+def get_facet_index() -> FacetIndex:
+    """
+    Возвращает индекс воркера, лениво перестраивая его,
+    если версия каталога в Redis ушла вперёд. Заказы индекс не сбрасывают:
+    наличие берётся из зеркала остатков.
+    """
+    global _index
+    version = get_catalog_version()
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    with _lock:
+        if _index is None or _index.version != version:
+            _index = build_facet_index(version)
+        return _index
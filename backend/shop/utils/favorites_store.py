@@ -0,0 +1,188 @@
+import json
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from sqlalchemy import or_, select
+from .product_index import MODEL_BY_TABLE, fetch_products_by_sku
+from ..core.logging import logger
+from ..extensions import redis_client
+from ..models import ProductIndex
+
+# Избранное: sorted set favorites:{owner}:z, member — SKU, score — время добавления;
+# owner — user_id или "g:<token>" для гостя
+FAVORITES_TTL = 60 * 60 * 24 * 365
+FAVORITES_MAX = 500
+GUEST_TTL = 60 * 60 * 24 * 30
+
+
+def _ttl(uid: Union[int, str]) -> int:
+    return GUEST_TTL if str(uid).startswith("g:") else FAVORITES_TTL
+
+
+def favorites_key(uid: Union[int, str]) -> str:
+    return f"favorites:{uid}:z"
+
+
+def _legacy_key(uid: Union[int, str]) -> str:
+    return f"favorites:{uid}"
+
+
+def migrate_legacy_favorites(uid: Union[int, str]) -> None:
+    """
+    Переносит JSON-список favorites:{uid} в sorted set при первом обращении
+    (порядок списка сохраняется: последние элементы — самые новые).
+    """
+    raw = redis_client.get(_legacy_key(uid))
+    if raw is None:
+        return
+    try:
+        items = json.loads(raw).get("items", [])
+    except (ValueError, AttributeError):
+        items = []
+    skus = [i for i in items if isinstance(i, str) and i]
+    now = time.time()
+    pipe = redis_client.pipeline()
+    if skus:
+        pipe.zadd(favorites_key(uid), {sku: now - len(skus) + i for i, sku in enumerate(skus)}, nx=True)
+        pipe.expire(favorites_key(uid), _ttl(uid))
+    pipe.delete(_legacy_key(uid))
+    pipe.execute()
+    logger.debug("favorites_migrate_legacy: user %s migrated %d items", uid, len(skus))
+
+
+def ensure_favorites(uid: Union[int, str]) -> None:
+    if not redis_client.exists(favorites_key(uid)) and redis_client.exists(_legacy_key(uid)):
+        migrate_legacy_favorites(uid)
+
+
+def add_favorite(uid: Union[int, str], sku: str) -> int:
+    """
+    ZADD NX (повторное добавление не меняет дату), обрезка до FAVORITES_MAX самых новых.
+    Возвращает размер избранного.
+    """
+    ensure_favorites(uid)
+    key = favorites_key(uid)
+    pipe = redis_client.pipeline()
+    pipe.zadd(key, {sku: time.time()}, nx=True)
+    pipe.zremrangebyrank(key, 0, -FAVORITES_MAX - 1)
+    pipe.expire(key, _ttl(uid))
+    pipe.zcard(key)
+    return int(pipe.execute()[-1])
+
+
+def remove_favorites(uid: Union[int, str], skus: Iterable[str]) -> int:
+    """
+    ZREM одного или нескольких SKU. Возвращает размер избранного.
+    """
+    skus = list(skus)
+    ensure_favorites(uid)
+    key = favorites_key(uid)
+    pipe = redis_client.pipeline()
+    if skus:
+        pipe.zrem(key, *skus)
+    pipe.zcard(key)
+    return int(pipe.execute()[-1])
+
+
+def replace_favorites(uid: Union[int, str], skus: List[str]) -> int:
+    """
+    Полная замена (save_favorites): новые SKU получают текущее время,
+    у оставшихся сохраняется дата добавления.
+    """
+    ensure_favorites(uid)
+    key = favorites_key(uid)
+    skus = list(dict.fromkeys(s for s in skus if isinstance(s, str) and s))[-FAVORITES_MAX:]
+    current = set(redis_client.zrange(key, 0, -1))
+    now = time.time()
+    pipe = redis_client.pipeline()
+    stale = current - set(skus)
+    if stale:
+        pipe.zrem(key, *stale)
+    if skus:
+        pipe.zadd(key, {sku: now - len(skus) + i for i, sku in enumerate(skus)}, nx=True)
+        pipe.expire(key, _ttl(uid))
+    pipe.zcard(key)
+    return int(pipe.execute()[-1])
+
+
+def list_favorites(
+    uid: Union[int, str],
+    offset: int = 0,
+    limit: Optional[int] = None,
+    newest_first: bool = True,
+) -> Tuple[List[str], int]:
+    """
+    SKU избранного (по умолчанию от новых к старым) и общее количество — одним pipeline.
+    """
+    ensure_favorites(uid)
+    key = favorites_key(uid)
+    stop = -1 if limit is None else offset + limit - 1
+    pipe = redis_client.pipeline(transaction=False)
+    if newest_first:
+        pipe.zrevrange(key, offset, stop)
+    else:
+        pipe.zrange(key, offset, stop)
+    pipe.zcard(key)
+    pipe.expire(key, _ttl(uid))
+    skus, total, _ = pipe.execute()
+    return skus, int(total)
+
+
+def _missing_in_db(session, skus: List[str]) -> List[str]:
+    """
+    SKU, которых нет ни среди variant_sku, ни среди color_sku таблиц товаров.
+    Проверка идёт по самим таблицам, а не по product_index и реестру.
+    """
+    found = set()
+    for Model in MODEL_BY_TABLE.values():
+        rows = session.execute(
+            select(Model.variant_sku, Model.color_sku)
+            .where(or_(Model.variant_sku.in_(skus), Model.color_sku.in_(skus)))
+        )
+        for variant_sku, color_sku in rows:
+            found.update((variant_sku, color_sku))
+    return [s for s in skus if s not in found]
+
+
+def hydrate_favorites(
+    session,
+    uid: Union[int, str],
+    skus: List[str],
+    fields: Optional[Tuple[str, ...]] = None,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Актуальные данные видимых товаров в порядке избранного.
+    SKU ищутся как variant_sku, промахи — как color_sku (первый видимый вариант цвета).
+    Скрытые товары пропускаются, но остаются в избранном; удаляются только SKU,
+    которых нет в таблицах товаров. Возвращает (товары, сколько SKU удалено).
+    """
+    data_map = fetch_products_by_sku(session, skus, fields, visible_only=True)
+    misses = [s for s in skus if s not in data_map]
+    variants_by_color: Dict[str, List[str]] = {}
+    if misses:
+        rows = session.execute(
+            select(ProductIndex.color_sku, ProductIndex.variant_sku)
+            .where(ProductIndex.color_sku.in_(misses))
+            .order_by(ProductIndex.color_sku, ProductIndex.variant_sku)
+        )
+        for color_sku, variant_sku in rows:
+            variants_by_color.setdefault(color_sku, []).append(variant_sku)
+        if variants_by_color:
+            candidates = [v for variants in variants_by_color.values() for v in variants]
+            data_map.update(fetch_products_by_sku(session, candidates, fields, visible_only=True))
+
+    items: List[Dict[str, Any]] = []
+    unresolved: List[str] = []
+    for sku in skus:
+        data = data_map.get(sku)
+        if data is None:
+            data = next((data_map[v] for v in variants_by_color.get(sku, ()) if v in data_map), None)
+        if data is None:
+            unresolved.append(sku)
+            continue
+        items.append(dict(data, favorite_sku=sku))
+
+    gone = _missing_in_db(session, unresolved) if unresolved else []
+    if gone:
+        remove_favorites(uid, gone)
+        logger.debug("hydrate_favorites: user %s dropped %d missing skus", uid, len(gone))
+    return items, len(gone)
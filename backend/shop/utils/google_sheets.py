@@ -1,7 +1,10 @@
 from typing import Dict, List, Tuple, Optional, Any, Set
 from sqlalchemy import Enum as SQLEnum
+from .cache_utils import bump_catalog_version
 from .db_utils import session_scope
+from .product_index import publish_registry, refresh_product_index
 from .product_serializer import model_by_category
+from .stock_index import publish_stock
 from .validators import (
     normalize_str, validate_sku, validate_gender, validate_category,
     validate_subcategory, validate_required_fields,
@@ -226,6 +229,8 @@ def process_rows(category: str, rows: List[Dict[str, str]]) -> Tuple[int, int, i
         raise ValueError(f"Unknown category {category}")
     added = updated = deleted = 0
     skus = [r.get("variant_sku", "").strip() for r in rows]
+    removed_skus: List[str] = []
+    stock: List[Tuple[str, Any]] = []
     with session_scope() as session:
         # Подгружаем все существующие объекты одной операцией
         existing = session.query(Model).filter(Model.variant_sku.in_(skus)).all()
@@ -238,6 +243,7 @@ def process_rows(category: str, rows: List[Dict[str, str]]) -> Tuple[int, int, i
                 obj = exist_map.pop(sku, None)
                 if obj:
                     session.delete(obj)
+                    removed_skus.append(sku)
                     deleted += 1
                 continue
             obj = exist_map.get(sku)
@@ -261,6 +267,14 @@ def process_rows(category: str, rows: List[Dict[str, str]]) -> Tuple[int, int, i
                     updated += 1
         # Применяем все изменения
         session.flush()
+        if added or updated or deleted:
+            refresh_product_index(session, Model)
+            stock = session.query(Model.variant_sku, Model.count_in_stock).all()
+
+    if added or updated or deleted:
+        publish_stock(stock, removed_skus)
+        publish_registry(Model, removed_skus)
+        bump_catalog_version()
 
     logger.debug("%s END added=%d updated=%d deleted=%d", context, added, updated, deleted)
     return added, updated, deleted
@@ -1,6 +1,8 @@
 from datetime import datetime
+from typing import Iterable
 from zoneinfo import ZoneInfo
 from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import insert
 from ..models import ChangeLog
 from ..utils.db_utils import session_scope
 
@@ -21,3 +23,19 @@ def log_change(action_type: str, description: str) -> None:
                 timestamp=now,
             )
         )
+
+
+def log_changes(session, action_type: str, descriptions: Iterable[str]) -> int:
+    """
+    Пишет несколько записей ChangeLog одним multi-row INSERT в транзакции session.
+    Возвращает количество записей.
+    """
+    author_id = int(get_jwt_identity())
+    now = datetime.now(ZoneInfo("Europe/Moscow"))
+    rows = [
+        {"author_id": author_id, "action_type": action_type, "description": d, "timestamp": now}
+        for d in descriptions
+    ]
+    if rows:
+        session.execute(insert(ChangeLog).values(rows))
+    return len(rows)
@@ -0,0 +1,124 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from .cart_store import CART_MAX_QTY
+from .product_index import fetch_products_by_sku
+from .product_serializer import get_delivery_options
+from ..core.logging import logger
+from ..extensions import redis_client
+
+PRICING_FIELDS: Tuple[str, ...] = ("variant_sku", "price", "count_in_stock")
+# Способы доставки: delivery_type заказа -> (параметр courier_* в админке, цена по умолчанию),
+# те же, что показывает страница оформления заказа
+DELIVERY_TARIFFS: Dict[str, Tuple[str, int]] = {
+    "Курьер по Москве (в пределах МКАД)": ("courier_in_mkad", 400),
+    "Курьер по Москве (за МКАД)":         ("courier_out_mkad", 600),
+    "Доставка до ПВЗ":                    ("courier_to_pvz", 0),
+}
+
+
+class OrderPricingError(Exception):
+    """
+    Позиции заказа не прошли проверку: code — invalid_items, unknown_items, price_changed
+    или invalid_delivery_type, details — список проблемных позиций для ответа клиенту.
+    """
+
+    def __init__(self, code: str, details: List[Any]) -> None:
+        super().__init__(f"{code}: {details}")
+        self.code = code
+        self.details = details
+
+
+def _qty(raw: Any) -> Optional[int]:
+    try:
+        qty = int(raw if raw is not None else 1)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return qty if 1 <= qty <= CART_MAX_QTY else None
+
+
+def price_order_items(session, items: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Пересчитывает позиции заказа по текущим ценам: базовые цены всех SKU — одним запросом
+    на таблицу через product_index, множители доставки — одним чтением опций,
+    цена позиции — как в корзине: round(price * multiplier).
+    Цена клиента, если передана, должна совпасть с серверной, иначе price_changed.
+    Возвращает (позиции с серверной ценой и целым qty, сумма товаров).
+    """
+    context = "price_order_items"
+    invalid = []
+    for idx, it in enumerate(items):
+        if (
+            not isinstance(it, dict)
+            or not isinstance(it.get("variant_sku"), str) or not it["variant_sku"]
+            or not isinstance(it.get("delivery_option") or "", str)
+            or _qty(it.get("qty")) is None
+        ):
+            invalid.append(idx)
+    if invalid:
+        raise OrderPricingError("invalid_items", invalid)
+
+    opts = get_delivery_options()
+    opt_by_label = {o["label"]: o for o in opts}
+    data_map = fetch_products_by_sku(session, [it["variant_sku"] for it in items], PRICING_FIELDS, opts)
+
+    # неизвестные, скрытые и товары без цены заказать нельзя
+    unknown = [
+        it["variant_sku"] for it in items
+        if it["variant_sku"] not in data_map
+        or (data_map[it["variant_sku"]].get("count_in_stock") or 0) < 0
+        or data_map[it["variant_sku"]].get("price") is None
+    ]
+    if unknown:
+        raise OrderPricingError("unknown_items", list(dict.fromkeys(unknown)))
+
+    priced: List[Dict[str, Any]] = []
+    changed: List[Dict[str, Any]] = []
+    subtotal = 0
+    for it in items:
+        sku = it["variant_sku"]
+        label = it.get("delivery_option") or None
+        opt = opt_by_label.get(label) if label else None
+        if label and opt is None:
+            changed.append({"variant_sku": sku, "delivery_option": label, "reason": "delivery_option"})
+            continue
+        unit_price = round(data_map[sku]["price"] * (opt["multiplier"] if opt else 1))
+        client_price = it.get("price")
+        if client_price is not None:
+            try:
+                client_price = round(float(client_price))
+            except (TypeError, ValueError, OverflowError):
+                client_price = None
+            if client_price != unit_price:
+                changed.append({
+                    "variant_sku": sku, "delivery_option": label,
+                    "price": client_price, "unit_price": unit_price, "reason": "price",
+                })
+                continue
+
+        qty = _qty(it.get("qty"))
+        priced.append(dict(it, price=unit_price, qty=qty, delivery_option=label))
+        subtotal += unit_price * qty
+
+    if changed:
+        logger.debug("%s: %d items changed since checkout started", context, len(changed))
+        raise OrderPricingError("price_changed", changed)
+    logger.debug("%s: %d items subtotal=%d", context, len(priced), subtotal)
+    return priced, subtotal
+
+
+def price_delivery(delivery_type: Any) -> int:
+    """
+    Стоимость доставки по параметрам courier_* из Redis, как её считает витрина:
+    незаданный, нулевой или нечисловой параметр — цена по умолчанию.
+    Неизвестный delivery_type — OrderPricingError("invalid_delivery_type").
+    """
+    tariff = DELIVERY_TARIFFS.get(delivery_type) if isinstance(delivery_type, str) else None
+    if tariff is None:
+        raise OrderPricingError("invalid_delivery_type", [delivery_type])
+    key, default = tariff
+    try:
+        params = json.loads(redis_client.get("parameters") or "{}")
+        return round(float(params.get(key) or 0)) or default
+    except (TypeError, ValueError, OverflowError):
+        logger.warning("price_delivery: invalid parameter %s", key)
+        return default
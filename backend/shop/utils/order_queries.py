@@ -0,0 +1,132 @@
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+from sqlalchemy import Integer, Select, String, column, or_, select, tuple_, update, values
+from .pagination import encode_order_cursor
+from ..core.logging import logger
+from ..models import Addresses, Orders, Users
+
+SEARCH_MAX_TERMS = 5
+
+
+def _like(term: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def admin_orders_select(
+    statuses: Sequence[str] = (),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    user_id: Optional[int] = None,
+    payment_method: Optional[str] = None,
+    delivery_type: Optional[str] = None,
+    q: Optional[str] = None,
+) -> Select:
+    """
+    Один запрос заказов с клиентом и адресом (LEFT JOIN) без items_json.
+    q — слова через пробел; каждое должно найтись в имени, фамилии, отчестве,
+    телефоне, email клиента или совпасть с номером заказа.
+    """
+    stmt = (
+        select(
+            Orders.id, Orders.status, Orders.created_at, Orders.total, Orders.delivery_price,
+            Orders.payment_method, Orders.delivery_type, Orders.user_id,
+            Users.first_name, Users.last_name, Users.phone, Users.email,
+            Addresses.city, Addresses.street, Addresses.house,
+        )
+        .outerjoin(Users, Users.user_id == Orders.user_id)
+        .outerjoin(Addresses, Addresses.id == Orders.address_id)
+    )
+    if statuses:
+        stmt = stmt.where(Orders.status.in_(statuses))
+    if date_from is not None:
+        stmt = stmt.where(Orders.created_at >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(Orders.created_at < date_to)
+    if user_id is not None:
+        stmt = stmt.where(Orders.user_id == user_id)
+    if payment_method:
+        stmt = stmt.where(Orders.payment_method == payment_method)
+    if delivery_type:
+        stmt = stmt.where(Orders.delivery_type == delivery_type)
+
+    terms = [t.lstrip("#") for t in (q or "").split()[:SEARCH_MAX_TERMS]]
+    for term in filter(None, terms):
+        pattern = _like(term)
+        matches = [
+            col.ilike(pattern, escape="\\")
+            for col in (Users.first_name, Users.last_name, Users.middle_name, Users.phone, Users.email)
+        ]
+        if term.isdigit() and len(term) <= 9:
+            matches.append(Orders.id == int(term))
+        stmt = stmt.where(or_(*matches))
+    return stmt
+
+
+def order_summary(items: Sequence[dict]) -> Tuple[int, Optional[str]]:
+    """
+    (количество товаров с учётом qty, SKU первой позиции для превью) по items_json.
+    """
+    count = 0
+    for it in items or []:
+        try:
+            count += max(int(it.get("qty") or 1), 0)
+        except (TypeError, ValueError):
+            count += 1
+    thumbnail = next((it.get("variant_sku") for it in items or [] if it.get("variant_sku")), None)
+    return count, thumbnail
+
+
+def user_orders_select(user_id: int) -> Select:
+    """
+    Сводка заказов клиента: только колонки списка, без items_json.
+    """
+    return select(
+        Orders.id, Orders.status, Orders.created_at, Orders.total,
+        Orders.completed_at, Orders.delivery_date, Orders.item_count, Orders.thumbnail_sku,
+    ).where(Orders.user_id == user_id)
+
+
+def keyset_orders(
+    session,
+    stmt: Select,
+    limit: int,
+    after: Optional[Tuple[datetime, int]] = None,
+) -> Tuple[List[Any], Optional[str]]:
+    """
+    Страница заказов по ключу (created_at, id) от новых к старым без OFFSET.
+    Возвращает (строки, next_cursor).
+    """
+    if after is not None:
+        stmt = stmt.where(tuple_(Orders.created_at, Orders.id) < tuple_(*after))
+    stmt = stmt.order_by(Orders.created_at.desc(), Orders.id.desc()).limit(limit + 1)
+    rows = session.execute(stmt).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_order_cursor(rows[-1].created_at, rows[-1].id)
+    logger.debug("keyset_orders: returned=%d has_more=%s", len(rows), next_cursor is not None)
+    return rows, next_cursor
+
+
+def bulk_set_status(
+    session,
+    rows: Sequence[Tuple[int, str]],
+    status: str,
+    date_column: str,
+    at: datetime,
+) -> List[int]:
+    """
+    Переводит заказы (id, ожидаемый текущий статус) в status и проставляет date_column
+    одним UPDATE ... FROM (VALUES ...). Заказ, чей статус успели изменить, не трогается.
+    Возвращает отсортированные id обновлённых заказов.
+    """
+    v = values(column("id", Integer), column("prev_status", String), name="v").data(list(rows))
+    result = session.execute(
+        update(Orders)
+        .where(Orders.id == v.c.id, Orders.status == v.c.prev_status)
+        .values({Orders.status: status, getattr(Orders, date_column): at})
+        .returning(Orders.id)
+        .execution_options(synchronize_session=False)
+    )
+    return sorted(r.id for r in result)
@@ -0,0 +1,179 @@
+import base64
+import heapq
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import tuple_
+from .product_serializer import product_select
+from ..core.logging import logger
+
+# Режимы сортировки каталога: sort -> (колонка, по убыванию)
+SORT_MODES: Dict[str, Tuple[str, bool]] = {
+    "price_asc":  ("price", False),
+    "price_desc": ("price", True),
+    "newest":     ("created_at", True),
+    "popular":    ("count_sales", True),
+}
+DEFAULT_SORT = "newest"
+DEFAULT_LIMIT = 60
+MAX_LIMIT = 200
+
+
+# Cursor encoding
+def encode_cursor(sort: str, value: Any, sku: str) -> str:
+    """
+    Кодирует позицию (значение ключа сортировки, variant_sku) в непрозрачную строку.
+    """
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, sku], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Optional[Tuple[Any, str]]:
+    """
+    Декодирует курсор. Возвращает (value, sku) или None,
+    если курсор повреждён или выдан для другого режима сортировки.
+    value может быть None: курсор указывает на строку с NULL в колонке сортировки.
+    """
+    context = "decode_cursor"
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        c_sort, value, sku = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, TypeError) as exc:
+        logger.warning("%s: malformed cursor %r: %s", context, cursor, exc)
+        return None
+
+    if c_sort != sort or not isinstance(sku, str):
+        logger.warning("%s: cursor sort mismatch %r != %r", context, c_sort, sort)
+        return None
+
+    column, _ = SORT_MODES[sort]
+    if value is None:
+        # позиция внутри хвоста с NULL в колонке сортировки
+        return None, sku
+    if column == "created_at":
+        try:
+            value = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            logger.warning("%s: invalid datetime in cursor %r", context, value)
+            return None
+    elif not isinstance(value, int):
+        logger.warning("%s: invalid value in cursor %r", context, value)
+        return None
+    return value, sku
+
+
+# Keyset pagination
+def _sort_order(item: Tuple[type, Any], desc: bool) -> Tuple[bool, Any, str]:
+    # NULL-ключи идут последними в обоих направлениях; variant_sku сравнивается
+    # по кодовым точкам, как COLLATE "C" в запросе
+    row = item[1]
+    is_null = row._sort_key is None
+    return (not is_null if desc else is_null), row._sort_key, row._sort_sku
+
+
+def keyset_page(
+    session,
+    models: Sequence[type],
+    sort: str,
+    limit: int,
+    after: Optional[Tuple[Any, str]] = None,
+    fields: Optional[Tuple[str, ...]] = None,
+) -> Tuple[List[Tuple[type, Any]], Optional[str]]:
+    """
+    Возвращает страницу товаров из одной или нескольких таблиц по ключу
+    (колонка сортировки, variant_sku COLLATE "C") без OFFSET; строки с NULL в колонке
+    сортировки идут в конце (NULLS LAST) по variant_sku.
+    Из каждой таблицы читается не более limit + 1 строк по композитному индексу
+    (Core select только нужных полей, без ORM-гидрации), затем потоки сливаются heapq.merge.
+    Ключ сортировки добавляется в конец строки как _sort_key/_sort_sku.
+    Возвращает ([(Model, row), ...], next_cursor).
+    """
+    context = "keyset_page"
+    column, desc = SORT_MODES[sort]
+    logger.debug("%s START sort=%s limit=%d after=%r", context, sort, limit, after)
+
+    streams: List[List[Tuple[type, Any]]] = []
+    for Model in models:
+        col = getattr(Model, column)
+        sku = Model.variant_sku.collate("C")
+        base = (
+            product_select(Model, fields)
+            .add_columns(col.label("_sort_key"), Model.variant_sku.label("_sort_sku"))
+            .where(Model.count_in_stock >= 0)
+        )
+        rows: List[Any] = []
+        # Сначала строки с ключом (диапазон по индексу), затем — с NULL, если страница не набрана
+        if after is None or after[0] is not None:
+            stmt = base.where(col.isnot(None))
+            if after is not None:
+                key = tuple_(col, sku)
+                stmt = stmt.where(key < tuple_(*after) if desc else key > tuple_(*after))
+            if desc:
+                stmt = stmt.order_by(col.desc(), sku.desc())
+            else:
+                stmt = stmt.order_by(col.asc(), sku.asc())
+            rows = session.execute(stmt.limit(limit + 1)).all()
+        if len(rows) <= limit and Model.__table__.c[column].nullable:
+            stmt = base.where(col.is_(None))
+            if after is not None and after[0] is None:
+                stmt = stmt.where(sku < after[1] if desc else sku > after[1])
+            stmt = stmt.order_by(sku.desc() if desc else sku.asc())
+            rows += session.execute(stmt.limit(limit + 1 - len(rows))).all()
+        streams.append([(Model, row) for row in rows])
+
+    merged = heapq.merge(*streams, key=lambda item: _sort_order(item, desc), reverse=desc)
+    page: List[Tuple[type, Any]] = []
+    has_more = False
+    for item in merged:
+        if len(page) == limit:
+            has_more = True
+            break
+        page.append(item)
+
+    next_cursor = None
+    if has_more and page:
+        last = page[-1][1]
+        next_cursor = encode_cursor(sort, last._sort_key, last._sort_sku)
+
+    logger.debug("%s END returned=%d has_more=%s", context, len(page), has_more)
+    return page, next_cursor
+
+
+# Orders keyset: (created_at, id) по убыванию
+ORDERS_DEFAULT_LIMIT = 50
+ORDERS_MAX_LIMIT = 200
+
+
+def encode_order_cursor(created_at: datetime, order_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), order_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_order_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    """
+    Декодирует курсор списка заказов. None — курсор повреждён.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, order_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if not isinstance(order_id, int):
+            raise TypeError("order id must be int")
+        return datetime.fromisoformat(created_at), order_id
+    except (ValueError, TypeError) as exc:
+        logger.warning("decode_order_cursor: malformed cursor %r: %s", cursor, exc)
+        return None
+
+
+def parse_limit(raw: Optional[str], default: int, maximum: int) -> Optional[int]:
+    """
+    limit из query-строки: пустой — default, иначе обрезается до [1, maximum].
+    None — не целое число: вызывающий код отвечает 400 "invalid limit".
+    """
+    raw = (raw or "").strip()
+    try:
+        limit = int(raw) if raw else default
+    except ValueError:
+        return None
+    return max(1, min(limit, maximum))
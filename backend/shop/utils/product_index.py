@@ -0,0 +1,173 @@
+import threading
+from typing import Dict, List, Optional, Any, Iterable, Tuple
+from sqlalchemy import delete, literal, select
+from sqlalchemy.dialects.postgresql import insert
+from .cache_utils import get_catalog_version
+from .db_utils import session_scope
+from .product_serializer import product_select, serialize_rows
+from .search import search_text_expr, search_vector_expr
+from ..core.logging import logger
+from ..extensions import redis_client
+from ..models import ProductIndex, Shoe, Clothing, Accessory
+
+# Таблица товаров -> модель (category в product_index хранит имя таблицы)
+MODEL_BY_TABLE: Dict[str, type] = {M.__tablename__: M for M in (Shoe, Clothing, Accessory)}
+
+# Реестр SKU в Redis: variant_sku -> "table|id|color_sku"
+SKU_REGISTRY_KEY = "sku:registry"
+
+# Запись реестра: (таблица, id, color_sku)
+RegistryEntry = Tuple[str, int, Optional[str]]
+
+
+def refresh_product_index(session, Model: type) -> None:
+    """
+    Пересобирает строки product_index одной категории из её таблицы
+    (DELETE + INSERT ... SELECT в текущей транзакции) вместе с поисковыми колонками.
+    """
+    context = "refresh_product_index"
+    table = Model.__tablename__
+    session.execute(delete(ProductIndex).where(ProductIndex.category == table))
+    stmt = insert(ProductIndex).from_select(
+        ["variant_sku", "category", "product_id", "color_sku", "search_vector", "search_text"],
+        select(
+            Model.variant_sku, literal(table), Model.id, Model.color_sku,
+            search_vector_expr(Model), search_text_expr(Model),
+        ),
+    ).on_conflict_do_nothing(index_elements=["variant_sku"])
+    result = session.execute(stmt)
+    logger.debug("%s: category=%s indexed=%s", context, table, result.rowcount)
+
+
+def _encode_entry(table: str, pid: int, color_sku: Optional[str]) -> str:
+    return f"{table}|{pid}|{color_sku or ''}"
+
+
+def _decode_entry(raw: str) -> RegistryEntry:
+    table, pid, color_sku = raw.split("|", 2)
+    return table, int(pid), color_sku or None
+
+
+def publish_registry(Model: type, removed: Iterable[str] = ()) -> None:
+    """
+    Обновляет в Redis записи реестра одной категории из product_index
+    (вызывается из process_rows после фиксации импорта).
+    """
+    table = Model.__tablename__
+    with session_scope() as session:
+        rows = session.execute(
+            select(ProductIndex.variant_sku, ProductIndex.product_id, ProductIndex.color_sku)
+            .where(ProductIndex.category == table)
+        )
+        mapping = {r.variant_sku: _encode_entry(table, r.product_id, r.color_sku) for r in rows}
+    removed = [sku for sku in removed if sku not in mapping]
+    pipe = redis_client.pipeline()
+    if removed:
+        pipe.hdel(SKU_REGISTRY_KEY, *removed)
+    if mapping:
+        pipe.hset(SKU_REGISTRY_KEY, mapping=mapping)
+    pipe.execute()
+    logger.debug("publish_registry: category=%s entries=%d removed=%d", table, len(mapping), len(removed))
+
+
+def rebuild_registry() -> None:
+    """
+    Полностью пересобирает реестр SKU в Redis из product_index.
+    """
+    context = "rebuild_registry"
+    with session_scope() as session:
+        rows = session.execute(select(
+            ProductIndex.variant_sku, ProductIndex.category, ProductIndex.product_id, ProductIndex.color_sku,
+        ))
+        mapping = {r.variant_sku: _encode_entry(r.category, r.product_id, r.color_sku) for r in rows}
+    pipe = redis_client.pipeline()
+    pipe.delete(SKU_REGISTRY_KEY)
+    if mapping:
+        pipe.hset(SKU_REGISTRY_KEY, mapping=mapping)
+    pipe.execute()
+    logger.debug("%s: entries=%d", context, len(mapping))
+
+
+# Per-worker registry
+_registry: Dict[str, RegistryEntry] = {}
+_registry_version: Optional[int] = None
+_lock = threading.Lock()
+
+
+def get_registry() -> Dict[str, RegistryEntry]:
+    """
+    Реестр SKU в памяти воркера: перечитывается из Redis (HGETALL) при смене версии каталога,
+    пустой реестр в Redis пересобирается из product_index.
+    """
+    global _registry, _registry_version
+    version = get_catalog_version()
+    if _registry_version == version:
+        return _registry
+
+    with _lock:
+        if _registry_version == version:
+            return _registry
+        raw = redis_client.hgetall(SKU_REGISTRY_KEY)
+        if not raw:
+            rebuild_registry()
+            raw = redis_client.hgetall(SKU_REGISTRY_KEY)
+        _registry = {sku: _decode_entry(v) for sku, v in raw.items()}
+        _registry_version = version
+        logger.debug("get_registry: loaded %d skus v%d", len(_registry), version)
+        return _registry
+
+
+def resolve_skus(session, skus: Iterable[str]) -> Dict[str, Tuple[str, int]]:
+    """
+    variant_sku -> (таблица, id): из реестра в памяти, промахи — одним запросом по PK product_index.
+    """
+    skus = list(dict.fromkeys(s for s in skus if s))
+    if not skus:
+        return {}
+    registry = get_registry()
+    out: Dict[str, Tuple[str, int]] = {}
+    misses: List[str] = []
+    for sku in skus:
+        entry = registry.get(sku)
+        if entry is None:
+            misses.append(sku)
+        else:
+            out[sku] = entry[:2]
+    if misses:
+        rows = session.execute(
+            select(ProductIndex.variant_sku, ProductIndex.category, ProductIndex.product_id)
+            .where(ProductIndex.variant_sku.in_(misses))
+        )
+        out.update({r.variant_sku: (r.category, r.product_id) for r in rows})
+    return out
+
+
+def fetch_products_by_sku(
+    session,
+    skus: Iterable[str],
+    fields: Optional[Tuple[str, ...]] = None,
+    delivery_options: Optional[List[Dict[str, Any]]] = None,
+    visible_only: bool = False,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Сериализованные товары по списку variant_sku из любых категорий.
+    Обращается только к тем таблицам, где товары реально есть, и только по PK.
+    visible_only — пропускать скрытые товары (count_in_stock < 0) для публичной выдачи.
+    """
+    located = resolve_skus(session, skus)
+    ids_by_table: Dict[str, List[int]] = {}
+    for table, pid in located.values():
+        ids_by_table.setdefault(table, []).append(pid)
+
+    out: Dict[str, Dict[str, Any]] = {}
+    if fields is not None and "variant_sku" not in fields:
+        fields = fields + ("variant_sku",)
+    for table, ids in ids_by_table.items():
+        Model = MODEL_BY_TABLE[table]
+        stmt = product_select(Model, fields).where(Model.id.in_(ids))
+        if visible_only:
+            stmt = stmt.where(Model.count_in_stock >= 0)
+        rows = session.execute(stmt)
+        for data in serialize_rows(Model, rows, delivery_options, fields):
+            out[data["variant_sku"]] = data
+    return out
@@ -1,77 +1,243 @@
 import json
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from itertools import groupby
+from typing import Optional, List, Dict, Any, Iterable, Iterator, Sequence, Tuple
 from zoneinfo import ZoneInfo
+from flask import g, has_app_context
+from sqlalchemy import DateTime, select
+from sqlalchemy.sql import Select
 from ..extensions import BUCKET, redis_client
 from ..core.config import BACKEND_URL
 from ..core.logging import logger
 from ..models import Shoe, Clothing, Accessory
 
+MSK = ZoneInfo("Europe/Moscow")
+
+
+# Sparse fieldsets: производные поля и именованные представления
+DERIVED_FIELDS: Tuple[str, ...] = ("delivery_options", "images", "image")
+CARD_FIELDS: Tuple[str, ...] = (
+    "variant_sku", "color_sku", "name", "brand", "category", "subcategory", "gender",
+    "color", "size_label", "price", "count_in_stock", "count_sales", "created_at", "image",
+)
+VIEWS: Dict[str, Optional[Tuple[str, ...]]] = {
+    "full": None,
+    "card": CARD_FIELDS,
+}
+_PLAN_CACHE_LIMIT = 64
+
+
+class ColumnPlan:
+    """
+    Скомпилированный один раз на (модель, набор полей) план сериализации:
+    какие колонки выбирать в SQL, какие из них отдавать, позиции datetime-полей
+    и префикс ссылок на изображения.
+    fields=None — все колонки и все производные поля.
+    """
+
+    def __init__(self, Model: type, fields: Optional[Tuple[str, ...]] = None) -> None:
+        table_cols = Model.__table__.columns
+        if fields is None:
+            out_names = [c.name for c in table_cols]
+            derived = set(DERIVED_FIELDS)
+        else:
+            out_names = [f for f in fields if f in table_cols]
+            derived = set(fields) & set(DERIVED_FIELDS)
+
+        # Колонки, нужные только для производных полей, выбираем, но не отдаём
+        fetch_names = list(out_names)
+        if derived & {"images", "image"}:
+            fetch_names += [n for n in ("color_sku", "count_images") if n not in fetch_names]
+
+        columns = tuple(table_cols[n] for n in fetch_names)
+        self.columns = columns
+        self.names: Tuple[str, ...] = tuple(fetch_names)
+        self.output_count = len(out_names)
+        self.datetime_idx: Tuple[int, ...] = tuple(
+            i for i, c in enumerate(columns[:self.output_count]) if isinstance(c.type, DateTime)
+        )
+        self.with_delivery = "delivery_options" in derived
+        self.with_images = "images" in derived
+        self.with_image = "image" in derived
+        self.count_images_idx = self.names.index("count_images") if "count_images" in self.names else None
+        self.color_sku_idx = self.names.index("color_sku") if "color_sku" in self.names else None
+        self.image_prefix = f"{BACKEND_URL}/{BUCKET}/{Model.__tablename__}/"
+
+
+_PLANS: Dict[Tuple[type, Optional[Tuple[str, ...]]], ColumnPlan] = {}
+
+
+def column_plan(Model: type, fields: Optional[Tuple[str, ...]] = None) -> ColumnPlan:
+    key = (Model, fields)
+    plan = _PLANS.get(key)
+    if plan is None:
+        plan = ColumnPlan(Model, fields)
+        if len(_PLANS) < _PLAN_CACHE_LIMIT:
+            _PLANS[key] = plan
+        logger.debug("column_plan: compiled plan for %s (%d columns)", Model.__name__, len(plan.names))
+    return plan
+
+
+def product_select(Model: type, fields: Optional[Tuple[str, ...]] = None) -> Select:
+    """
+    Core select колонок модели в порядке плана сериализации.
+    """
+    return select(*column_plan(Model, fields).columns)
+
+
+def resolve_fields(view: str, fields: str) -> Tuple[Optional[Tuple[str, ...]], Optional[str]]:
+    """
+    Разбирает параметры ?view=card|full и ?fields=a,b,c.
+    Возвращает (fields, error): fields=None — полное представление.
+    """
+    fields = (fields or "").strip()
+    if fields:
+        names = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+        unknown = [f for f in names if f not in PRODUCT_FIELDS]
+        if unknown:
+            return None, f"unknown fields: {', '.join(unknown)}"
+        return names, None
+
+    view = (view or "full").strip().lower()
+    if view not in VIEWS:
+        return None, f"unknown view: {view}"
+    return VIEWS[view], None
+
+
+def format_datetime(val: datetime) -> str:
+    return val.astimezone(MSK).isoformat(timespec="microseconds") + "Z"
+
+
+def get_delivery_options() -> List[Dict[str, Any]]:
+    """
+    Опции доставки из Redis, не чаще одного чтения на запрос (кеш во flask.g).
+    """
+    if has_app_context() and "delivery_options" in g:
+        return g.delivery_options
+    raw = redis_client.get("delivery_options") or "[]"
+    opts = json.loads(raw)
+    if has_app_context():
+        g.delivery_options = opts
+    return opts
+
 
 # Product Serialization
-def serialize_product(obj: Any) -> Dict[str, Any]:
-    """
-    Преобразует объект продукта в dict для JSON-ответа,
-    включая delivery_options и ссылки на изображения.
-    """
-    context = "serialize_product"
-    sku = getattr(obj, "variant_sku", None)
-    logger.debug("%s START variant_sku=%s", context, sku)
-
-    data: Dict[str, Any] = {}
-    try:
-        # Основные поля из таблицы
-        for col in obj.__table__.columns:
-            val = getattr(obj, col.name)
-            if isinstance(val, datetime):
-                data[col.name] = val.astimezone(ZoneInfo("Europe/Moscow")).isoformat(timespec="microseconds") + "Z"
-            else:
-                data[col.name] = val
-
-        # Опции доставки из Redis
-        raw = redis_client.get("delivery_options") or "[]"
-        data["delivery_options"] = json.loads(raw)
-
-        # Ссылки на изображения
-        cnt = getattr(obj, "count_images", 0) or 0
-        folder = obj.__tablename__
-        images: List[str] = []
-        for i in range(1, cnt + 1):
-            key_path = f"{folder}/{obj.color_sku}_{i}.webp"
-            images.append(f"{BACKEND_URL}/{BUCKET}/{key_path}")
-
-        data["images"] = images
-        data["image"] = images[0] if images else None
-
-    except Exception as exc:
-        logger.exception("%s: failed to serialize product %s", context, sku, exc_info=exc)
-        return {}
-
-    logger.debug("%s END variant_sku=%s", context, sku)
+def serialize_row(
+    Model: type,
+    row: Sequence[Any],
+    delivery_options: Optional[List[Dict[str, Any]]] = None,
+    fields: Optional[Tuple[str, ...]] = None,
+) -> Dict[str, Any]:
+    """
+    Преобразует строку Core select (колонки в порядке column_plan) в dict для JSON-ответа,
+    включая delivery_options и ссылки на изображения, если они входят в набор полей.
+    """
+    plan = column_plan(Model, fields)
+    values = list(row[:plan.output_count])
+    for i in plan.datetime_idx:
+        if values[i] is not None:
+            values[i] = format_datetime(values[i])
+    data: Dict[str, Any] = dict(zip(plan.names, values))
+
+    if plan.with_delivery:
+        data["delivery_options"] = get_delivery_options() if delivery_options is None else delivery_options
+
+    if plan.with_images or plan.with_image:
+        cnt = row[plan.count_images_idx] or 0
+        color_sku = row[plan.color_sku_idx]
+        if plan.with_images:
+            images = [f"{plan.image_prefix}{color_sku}_{i}.webp" for i in range(1, cnt + 1)]
+            data["images"] = images
+        if plan.with_image:
+            data["image"] = f"{plan.image_prefix}{color_sku}_1.webp" if cnt else None
     return data
 
 
+def serialize_rows(
+    Model: type,
+    rows: Iterable[Sequence[Any]],
+    delivery_options: Optional[List[Dict[str, Any]]] = None,
+    fields: Optional[Tuple[str, ...]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Пакетная сериализация строк одной модели: план и опции доставки берутся один раз.
+    """
+    plan = column_plan(Model, fields)
+    opts = delivery_options
+    if opts is None and plan.with_delivery:
+        opts = get_delivery_options()
+    return [serialize_row(Model, row, opts, fields) for row in rows]
+
+
+# Color grouping: одна карточка на color_sku
+SIZE_FIELDS: Tuple[str, ...] = ("variant_sku", "size_label", "price", "count_in_stock")
+GROUP_REQUIRED_FIELDS: Tuple[str, ...] = ("color_sku",) + SIZE_FIELDS
+# Поля, которые различаются у размеров одного цвета и не поднимаются в карточку как есть
+_VARIANT_ONLY_FIELDS = frozenset(SIZE_FIELDS + (
+    "id", "sku", "world_sku", "size_category", "count_sales", "created_at", "updated_at",
+))
+
+
+def with_group_fields(fields: Optional[Tuple[str, ...]]) -> Optional[Tuple[str, ...]]:
+    """
+    Дополняет набор полей колонками, без которых нельзя собрать карточку цвета.
+    """
+    if fields is None:
+        return None
+    return fields + tuple(f for f in GROUP_REQUIRED_FIELDS if f not in fields)
+
+
+def group_by_color(items: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """
+    Сворачивает размеры в карточки по color_sku.
+    items должны идти подряд по color_sku (ORDER BY color_sku или sorted()).
+    Вариант без color_sku — отдельная карточка (ключ группы — его variant_sku).
+    Карточка: общие поля первого размера + sizes[{variant_sku, size_label, price, count_in_stock}],
+    min_price, а также сумма count_sales и самая ранняя created_at, если они запрошены.
+    """
+    for _, group in groupby(items, key=lambda d: d.get("color_sku") or d.get("variant_sku")):
+        variants = list(group)
+        head = variants[0]
+        card = {k: v for k, v in head.items() if k not in _VARIANT_ONLY_FIELDS}
+        card["color_sku"] = head.get("color_sku")
+        card["sizes"] = [{k: v.get(k) for k in SIZE_FIELDS} for v in variants]
+        prices = [v["price"] for v in variants if v.get("price") is not None]
+        card["min_price"] = min(prices) if prices else None
+        if "count_sales" in head:
+            card["count_sales"] = sum(v.get("count_sales") or 0 for v in variants)
+        if "created_at" in head:
+            # ISO-строки в одной таймзоне сравниваются лексикографически
+            dates = [v["created_at"] for v in variants if v.get("created_at")]
+            card["created_at"] = min(dates) if dates else None
+        yield card
+
+
 # Category Model Mapping
+CATEGORY_MODELS: Dict[str, type] = {
+    "shoes":       Shoe,
+    "clothing":    Clothing,
+    "accessories": Accessory,
+    "обувь":       Shoe,
+    "одежда":      Clothing,
+    "аксессуары":  Accessory,
+}
+
+
 def model_by_category(cat: str) -> Optional[type]:
     """
     Возвращает SQLAlchemy-модель по названию категории cat.
     """
     context = "model_by_category"
-    key = cat.strip().lower()
-
-    mapping: Dict[str, Any] = {
-        "shoes":       Shoe,
-        "clothing":    Clothing,
-        "accessories": Accessory,
-        "обувь":       Shoe,
-        "одежда":      Clothing,
-        "аксессуары":  Accessory,
-    }
-
-    model = mapping.get(key)
+    model = CATEGORY_MODELS.get(cat.strip().lower())
     if model:
         logger.debug("%s: category '%s' -> model %s", context, cat, model.__name__)
     else:
         logger.warning("%s: unknown category '%s'", context, cat)
 
     return model
+
+
+# Все допустимые имена полей товара (колонки всех категорий + производные)
+PRODUCT_FIELDS = frozenset(
+    [c.name for M in (Shoe, Clothing, Accessory) for c in M.__table__.columns] + list(DERIVED_FIELDS)
+)
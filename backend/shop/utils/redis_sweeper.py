@@ -0,0 +1,294 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+from flask import Flask
+from .cart_store import CART_TTL, migrate_legacy_cart
+from .catalog_snapshot import refresh_catalog_snapshot
+from .favorites_store import FAVORITES_TTL, GUEST_TTL, migrate_legacy_favorites
+from .stock_index import release_expired_holds
+from ..core.logging import logger
+from ..extensions import redis_client
+
+# Фоновая чистка корзин и избранного: SCAN батчами, брошенные ключи получают короткий TTL
+SWEEP_INTERVAL = 6 * 60 * 60
+# Просроченные резервы остатков снимаются чаще основного прохода
+HOLDS_SWEEP_INTERVAL = 60
+SWEEP_BATCH = 500
+SWEEP_LOCK_KEY = "sweep:lock"
+SWEEP_LOCK_TTL = 30 * 60
+SWEEP_STATS_TTL = 60 * 60 * 24 * 400
+SWEEP_PATTERNS = ("cart:*", "favorites:*")
+
+# Брошенный ключ — без обращений дольше ABANDONED_AFTER. Последнее обращение
+# восстанавливается по TTL: каждое чтение и запись продлевают его до полного.
+ABANDONED_AFTER_USER = 60 * 60 * 24 * 60
+ABANDONED_AFTER_GUEST = 60 * 60 * 24 * 7
+ABANDONED_GRACE = 60 * 60 * 24 * 14
+ABANDONED_FAVORITES_KEEP = 50
+
+STAT_FIELDS = (
+    "scanned",
+    "carts_abandoned",
+    "favorites_abandoned",
+    "favorites_trimmed",
+    "empty_deleted",
+    "legacy_deleted",
+    "legacy_compacted",
+    "bytes_reclaimed",
+    "bytes_expiring",
+)
+
+
+def _classify(key: str) -> Optional[Tuple[str, str]]:
+    """
+    (вид ключа, owner) или None для чужих и служебных ключей.
+    """
+    prefix, _, rest = key.partition(":")
+    if prefix == "cart":
+        if rest.endswith(":priced"):
+            return None
+        kind, owner = ("cart", rest[:-6]) if rest.endswith(":lines") else ("legacy_cart", rest)
+    elif prefix == "favorites":
+        kind, owner = ("favorites", rest[:-2]) if rest.endswith(":z") else ("legacy_favorites", rest)
+    else:
+        return None
+    if not (owner.isdigit() or owner.startswith("g:")):
+        return None
+    return kind, owner
+
+
+def _full_ttl(kind: str, owner: str) -> int:
+    if owner.startswith("g:"):
+        return GUEST_TTL
+    return CART_TTL if kind in ("cart", "legacy_cart") else FAVORITES_TTL
+
+
+def _abandoned_after(owner: str) -> int:
+    return ABANDONED_AFTER_GUEST if owner.startswith("g:") else ABANDONED_AFTER_USER
+
+
+def _memory(result: Any) -> int:
+    # MEMORY USAGE может быть недоступна (ACL, эмуляторы) — тогда не считаем
+    return result if isinstance(result, int) else 0
+
+
+def _sweep_batch(keys: List[str], stats: Dict[str, int]) -> None:
+    """
+    Обрабатывает батч ключей: TTL, размер и длина читаются одним pipeline.
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.ttl(key)
+        pipe.memory_usage(key)
+        pipe.type(key)
+    meta = pipe.execute(raise_on_error=False)
+
+    actions = redis_client.pipeline(transaction=False)
+    # (статистика, размер, позиция zremrangebyrank или None, позиция expire) в ответе pipeline
+    expiring: List[Tuple[str, int, Optional[int], int]] = []
+    for i, key in enumerate(keys):
+        ttl, mem, key_type = meta[3 * i:3 * i + 3]
+        parsed = _classify(key)
+        if parsed is None or not isinstance(ttl, int) or ttl == -2:
+            continue
+        kind, owner = parsed
+        stats["scanned"] += 1
+        mem = _memory(mem)
+        full = _full_ttl(kind, owner)
+        if ttl == -1:
+            # ключ без срока жизни: запускаем отсчёт с полного TTL
+            actions.expire(key, full)
+            continue
+        if full - ttl < _abandoned_after(owner):
+            if kind.startswith("legacy_"):
+                _compact_legacy(kind, owner, ttl, mem, stats)
+            continue
+
+        if kind.startswith("legacy_"):
+            actions.delete(key)
+            stats["legacy_deleted"] += 1
+            stats["bytes_reclaimed"] += mem
+        elif kind == "cart" and key_type == "hash":
+            actions.delete(f"cart:{owner}:priced")
+            expiring.append(("carts_abandoned", mem, None, len(actions)))
+            actions.expire(key, ABANDONED_GRACE, lt=True)
+        elif kind == "favorites" and key_type == "zset":
+            trim_at = len(actions)
+            actions.zremrangebyrank(key, 0, -ABANDONED_FAVORITES_KEEP - 1)
+            expiring.append(("favorites_abandoned", mem, trim_at, len(actions)))
+            actions.expire(key, ABANDONED_GRACE, lt=True)
+
+    if not len(actions):
+        return
+    results = actions.execute(raise_on_error=False)
+    for stat, mem, trim_at, expire_at in expiring:
+        if trim_at is not None and isinstance(results[trim_at], int):
+            stats["favorites_trimmed"] += results[trim_at]
+        # EXPIRE LT срабатывает один раз — повторные проходы брошенный ключ не пересчитывают
+        if results[expire_at] is True:
+            stats[stat] += 1
+            stats["bytes_expiring"] += mem
+
+
+def _compact_legacy(kind: str, owner: str, ttl: int, mem: int, stats: Dict[str, int]) -> None:
+    """
+    Переносит живой JSON-ключ в компактный формат, сохраняя его оставшийся TTL.
+    Если ключ нового формата уже есть, старый устарел — он просто удаляется.
+    """
+    if kind == "legacy_cart":
+        legacy_key, new_key = f"cart:{owner}", f"cart:{owner}:lines"
+    else:
+        legacy_key, new_key = f"favorites:{owner}", f"favorites:{owner}:z"
+    if redis_client.exists(new_key):
+        redis_client.delete(legacy_key)
+        stats["legacy_deleted"] += 1
+        stats["bytes_reclaimed"] += _memory(mem)
+        return
+
+    if kind == "legacy_cart":
+        migrate_legacy_cart(owner)
+    else:
+        migrate_legacy_favorites(owner)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.expire(new_key, ttl)
+    pipe.memory_usage(new_key)
+    _, new_mem = pipe.execute(raise_on_error=False)
+    stats["legacy_compacted"] += 1
+    stats["bytes_reclaimed"] += max(_memory(mem) - _memory(new_mem), 0)
+
+
+def _week_key(now: Optional[datetime] = None) -> str:
+    year, week, _ = (now or datetime.now(ZoneInfo("Europe/Moscow"))).isocalendar()
+    return f"sweep:stats:{year}-W{week:02d}"
+
+
+def sweep_abandoned() -> Dict[str, int]:
+    """
+    Один проход по всем корзинам и избранному через SCAN:
+    - пустые корзины удаляются;
+    - брошенные корзины и избранное получают TTL ABANDONED_GRACE (EXPIRE LT),
+      избранное обрезается до ABANDONED_FAVORITES_KEEP новых позиций;
+    - старые JSON-ключи с полными объектами товаров переводятся в компактный формат
+      или удаляются, если брошены.
+    Итоги прибавляются к недельной статистике sweep:stats:{год}-W{неделя}.
+    """
+    context = "sweep_abandoned"
+    logger.debug("%s START", context)
+    started = time.monotonic()
+    stats = {field: 0 for field in STAT_FIELDS}
+
+    for pattern in SWEEP_PATTERNS:
+        batch: List[str] = []
+        for key in redis_client.scan_iter(match=pattern, count=SWEEP_BATCH):
+            batch.append(key)
+            if len(batch) >= SWEEP_BATCH:
+                _sweep_empty_carts(batch, stats)
+                _sweep_batch(batch, stats)
+                batch = []
+        if batch:
+            _sweep_empty_carts(batch, stats)
+            _sweep_batch(batch, stats)
+
+    week_key = _week_key()
+    pipe = redis_client.pipeline()
+    for field, value in stats.items():
+        if value:
+            pipe.hincrby(week_key, field, value)
+    pipe.hincrby(week_key, "runs", 1)
+    pipe.expire(week_key, SWEEP_STATS_TTL)
+    pipe.execute()
+
+    logger.info("%s END %.1fs %s", context, time.monotonic() - started, stats)
+    return stats
+
+
+def _sweep_empty_carts(keys: List[str], stats: Dict[str, int]) -> None:
+    """
+    Удаляет хеши корзин, в которых осталось только служебное поле версии.
+    """
+    carts = [k for k in keys if k.startswith("cart:") and k.endswith(":lines")]
+    if not carts:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    for key in carts:
+        pipe.hlen(key)
+        pipe.memory_usage(key)
+    meta = pipe.execute(raise_on_error=False)
+    empty = [(key, _memory(meta[2 * i + 1])) for i, key in enumerate(carts) if meta[2 * i] == 1]
+    if not empty:
+        return
+    redis_client.delete(*(key for key, _ in empty))
+    stats["empty_deleted"] += len(empty)
+    stats["bytes_reclaimed"] += sum(mem for _, mem in empty)
+    # удалённые ключи не должны попасть в основной проход батча
+    gone = {key for key, _ in empty}
+    keys[:] = [k for k in keys if k not in gone]
+
+
+def run_sweep() -> Optional[Dict[str, int]]:
+    """
+    Проход под Redis-локом: при нескольких воркерах чистит только один.
+    """
+    if not redis_client.set(SWEEP_LOCK_KEY, "1", nx=True, ex=SWEEP_LOCK_TTL):
+        logger.debug("run_sweep: already running elsewhere")
+        return None
+    try:
+        return sweep_abandoned()
+    finally:
+        redis_client.delete(SWEEP_LOCK_KEY)
+
+
+def get_sweep_stats(weeks: int = 8) -> List[Dict[str, Any]]:
+    """
+    Недельная статистика чистки, от текущей недели к прошлым.
+    """
+    now = datetime.now(ZoneInfo("Europe/Moscow"))
+    week_keys = [_week_key(now - timedelta(weeks=i)) for i in range(weeks)]
+    pipe = redis_client.pipeline(transaction=False)
+    for key in week_keys:
+        pipe.hgetall(key)
+    out = []
+    for key, data in zip(week_keys, pipe.execute()):
+        row: Dict[str, Any] = {"week": key.rsplit(":", 1)[-1]}
+        row.update({field: int(data.get(field, 0)) for field in ("runs",) + STAT_FIELDS})
+        out.append(row)
+    return out
+
+
+_thread: Optional[threading.Thread] = None
+
+
+def _loop(app: Flask) -> None:
+    next_sweep = 0.0
+    while True:
+        try:
+            release_expired_holds()
+        except Exception:
+            logger.exception("redis_sweeper: releasing holds failed")
+        try:
+            with app.app_context():
+                refresh_catalog_snapshot()
+        except Exception:
+            logger.exception("redis_sweeper: catalog snapshot refresh failed")
+        if time.monotonic() >= next_sweep:
+            next_sweep = time.monotonic() + SWEEP_INTERVAL
+            try:
+                run_sweep()
+            except Exception:
+                logger.exception("redis_sweeper: sweep failed")
+        time.sleep(HOLDS_SWEEP_INTERVAL)
+
+
+def start_sweeper(app: Flask) -> None:
+    """
+    Запускает фоновый поток чистки, снятия просроченных резервов
+    и обновления остатков в снапшоте каталога (один на процесс).
+    """
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    _thread = threading.Thread(target=_loop, args=(app,), name="redis-sweeper", daemon=True)
+    _thread.start()
+    logger.debug("start_sweeper: started, interval=%ds holds=%ds", SWEEP_INTERVAL, HOLDS_SWEEP_INTERVAL)
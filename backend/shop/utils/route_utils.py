@@ -1,8 +1,16 @@
 import functools
+import hashlib
+import json
+import re
+import time
+from datetime import datetime, timezone
 from functools import wraps
-from typing import List
-from flask import request, jsonify
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+from flask import request, jsonify, make_response, Response, stream_with_context
+from flask_jwt_extended import get_jwt_identity
+from .cache_utils import acquire_lock, release_lock
 from ..core.logging import logger
+from ..extensions import redis_client
 
 
 # Parsers: request args and JSON validation
@@ -34,6 +42,9 @@ def require_json(*names: str):
         def wrapper(*args, **kwargs):
             context = fn.__name__
             data = request.get_json(silent=True) or {}
+            if not isinstance(data, dict):
+                logger.warning("%s: json body is not an object", context)
+                return jsonify({"error": "json body must be an object"}), 400
             missing: List[str] = [n for n in names if data.get(n) is None]
             if missing:
                 logger.warning("%s: missing json fields %s", context, missing)
@@ -62,3 +73,204 @@ def handle_errors(fn):
             logger.exception("%s: unexpected error", context)
             return jsonify({"error": "internal error"}), 500
     return wrapper
+
+
+# Streaming JSON responses
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_YIELD_PER = 500
+
+
+def stream_json(items: Callable[[], Iterator[Any]], key: Optional[str] = None) -> Response:
+    """
+    Потоковый JSON-ответ: массив (или {key: [...]}) пишется по мере сериализации
+    элементов и сбрасывается клиенту кусками по ~STREAM_CHUNK_SIZE.
+    items — фабрика генератора; она вызывается уже внутри ответа, поэтому сессию БД
+    (session_scope + yield_per) нужно открывать в самом генераторе.
+    """
+    head, tail = ("[", "]") if key is None else (f'{{{json.dumps(key)}:[', "]}")
+
+    def generate() -> Iterator[str]:
+        context = "stream_json"
+        buf: List[str] = [head]
+        size = len(head)
+        count = 0
+        for item in items():
+            part = json.dumps(item, ensure_ascii=False, separators=(",", ":"))
+            if count:
+                part = "," + part
+            buf.append(part)
+            size += len(part)
+            count += 1
+            if size >= STREAM_CHUNK_SIZE:
+                yield "".join(buf)
+                buf.clear()
+                size = 0
+        buf.append(tail)
+        yield "".join(buf)
+        logger.debug("%s: streamed %d items key=%s", context, count, key)
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+# Conditional GET: ETag / Last-Modified
+def conditional_get(
+    version_fn: Callable[[], Tuple[Optional[str], Optional[datetime]]],
+    cache_control: str,
+    weak: bool = False,
+    vary: Optional[str] = None,
+):
+    """
+    Декоратор conditional GET.
+    version_fn() дёшево (без обращения к данным) возвращает (etag, last_modified).
+    Если клиент прислал совпадающий If-None-Match (или If-Modified-Since не старше
+    last_modified) — сразу 304 без вызова обработчика.
+    Иначе к успешному ответу добавляются ETag, Last-Modified и Cache-Control.
+    weak — слабый ETag (W/"..."): для ответов, тело которых отличается кодировкой;
+    vary — заголовок Vary, ставится и на 200, и на 304.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            context = fn.__name__
+            try:
+                etag, last_modified = version_fn()
+            except Exception:
+                logger.warning("%s: version lookup failed, skipping conditional GET", context, exc_info=True)
+                return fn(*args, **kwargs)
+
+            if last_modified is not None:
+                last_modified = last_modified.astimezone(timezone.utc).replace(microsecond=0)
+
+            not_modified = False
+            if etag and request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag) or request.if_none_match.star_tag
+            elif last_modified is not None and request.if_modified_since:
+                not_modified = last_modified <= request.if_modified_since
+
+            if not_modified:
+                logger.debug("%s: 304 etag=%s", context, etag)
+                resp = make_response("", 304)
+            else:
+                resp = make_response(fn(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+
+            if etag:
+                resp.set_etag(etag, weak=weak)
+            if vary:
+                resp.vary.add(vary)
+            if last_modified is not None:
+                resp.last_modified = last_modified
+            resp.headers["Cache-Control"] = cache_control
+            return resp
+        return wrapper
+    return decorator
+
+
+# Idempotency-Key: повтор запроса получает сохранённый первый ответ
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_KEY_RE = re.compile(r"^[A-Za-z0-9_.:-]{8,128}$")
+IDEMPOTENCY_TTL = 60 * 60 * 24
+IDEMPOTENCY_LOCK_TTL = 30
+IDEMPOTENCY_WAIT = 10.0
+IDEMPOTENCY_POLL = 0.1
+
+def _idempotency_owner() -> str:
+    # identity из JWT, если обработчик под jwt_required; анонимные ключи — общее пространство
+    try:
+        return str(get_jwt_identity() or "anon")
+    except RuntimeError:
+        return "anon"
+
+
+def _request_fingerprint() -> str:
+    """
+    Хеш тела запроса для проверки, что ключ повторно прислан с тем же запросом.
+    У multipart граница меняется от попытки к попытке — хешируются поля и содержимое файлов.
+    """
+    digest = hashlib.sha256()
+    if request.mimetype == "multipart/form-data":
+        for name, value in sorted(request.form.items(multi=True)):
+            digest.update(f"{name}={value}\n".encode("utf-8"))
+        for name, storage in sorted(request.files.items(multi=True), key=lambda kv: kv[0]):
+            digest.update(f"{name}:{storage.filename}:".encode("utf-8"))
+            for chunk in iter(lambda: storage.stream.read(64 * 1024), b""):
+                digest.update(chunk)
+            storage.stream.seek(0)
+    else:
+        digest.update(request.get_data(cache=True))
+    return digest.hexdigest()
+
+
+def _replay(context: str, raw: str, fingerprint: str) -> Response:
+    stored = json.loads(raw)
+    if stored["f"] != fingerprint:
+        logger.warning("%s: idempotency key reused with a different payload", context)
+        return make_response(jsonify({"error": "Idempotency-Key reused with a different request"}), 422)
+    resp = Response(stored["b"], status=stored["s"], mimetype=stored["m"])
+    resp.headers["Idempotent-Replayed"] = "true"
+    logger.debug("%s: replayed stored response status=%d", context, stored["s"])
+    return resp
+
+
+def idempotent(fn):
+    """
+    Декоратор для POST-создания сущностей с заголовком Idempotency-Key.
+    Первый успешный (2xx/3xx) ответ хранится в Redis IDEMPOTENCY_TTL секунд,
+    повторы с тем же ключом получают его без вызова обработчика и без обращения к БД.
+    Параллельный дубль ждёт до IDEMPOTENCY_WAIT секунд, пока первый запрос держит лок,
+    затем получает его ответ или 409. Ошибки не сохраняются — повтор выполнится заново.
+    Ставится после jwt_required/handle_errors: ключ привязан к пользователю JWT.
+    Без заголовка обработчик вызывается как обычно.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        context = fn.__name__
+        key = request.headers.get(IDEMPOTENCY_HEADER, "").strip()
+        if not key:
+            return fn(*args, **kwargs)
+        if not IDEMPOTENCY_KEY_RE.match(key):
+            logger.warning("%s: invalid idempotency key", context)
+            return jsonify({"error": f"invalid {IDEMPOTENCY_HEADER}"}), 400
+
+        owner = _idempotency_owner()
+        result_key = f"idem:{context}:{owner}:{key}"
+        lock_key = f"{result_key}:lock"
+        fingerprint = _request_fingerprint()
+
+        raw = redis_client.get(result_key)
+        if raw is not None:
+            return _replay(context, raw, fingerprint)
+
+        token = acquire_lock(lock_key, IDEMPOTENCY_LOCK_TTL)
+        if token is None:
+            deadline = time.monotonic() + IDEMPOTENCY_WAIT
+            while time.monotonic() < deadline:
+                time.sleep(IDEMPOTENCY_POLL)
+                raw = redis_client.get(result_key)
+                if raw is not None:
+                    return _replay(context, raw, fingerprint)
+                if not redis_client.exists(lock_key):
+                    break
+            logger.warning("%s: duplicate request still in progress", context)
+            return jsonify({"error": "request with this Idempotency-Key is in progress"}), 409
+
+        try:
+            # первый запрос мог завершиться между GET и захватом лока
+            raw = redis_client.get(result_key)
+            if raw is not None:
+                return _replay(context, raw, fingerprint)
+            resp = make_response(fn(*args, **kwargs))
+            if resp.status_code < 400 and not resp.is_streamed:
+                stored = {
+                    "s": resp.status_code,
+                    "b": resp.get_data(as_text=True),
+                    "m": resp.mimetype,
+                    "f": fingerprint,
+                }
+                redis_client.set(result_key, json.dumps(stored, ensure_ascii=False), ex=IDEMPOTENCY_TTL)
+                logger.debug("%s: stored response status=%d", context, resp.status_code)
+            return resp
+        finally:
+            release_lock(lock_key, token)
+    return wrapper
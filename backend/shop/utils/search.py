@@ -0,0 +1,92 @@
+from typing import List, Optional, Tuple
+from sqlalchemy import and_, func, literal_column, or_, select
+from sqlalchemy.sql import ColumnElement
+from ..core.logging import logger
+from ..models import ProductIndex, Shoe, Clothing, Accessory
+
+# Конфигурации полнотекстового поиска: русская морфология + simple для брендов и артикулов
+TS_RUSSIAN = literal_column("'russian'::regconfig")
+TS_SIMPLE = literal_column("'simple'::regconfig")
+SEARCH_MAX_QUERY = 100
+SEARCH_DEFAULT_LIMIT = 30
+SEARCH_MAX_LIMIT = 100
+SEARCH_MAX_OFFSET = 1000
+
+
+def _text(col) -> ColumnElement:
+    return func.coalesce(col, "")
+
+
+def search_vector_expr(Model: type) -> ColumnElement:
+    """
+    tsvector товара: name и brand — вес A, color и material — B, description — D.
+    Название и бренд дополнительно индексируются конфигурацией simple (без стемминга).
+    """
+    def weighted(config, value, weight: str) -> ColumnElement:
+        return func.setweight(func.to_tsvector(config, value), literal_column(f"'{weight}'"))
+
+    name_brand = _text(Model.name).op("||")(" ").op("||")(_text(Model.brand))
+    attrs = _text(Model.color).op("||")(" ").op("||")(_text(Model.material))
+    return (
+        weighted(TS_RUSSIAN, name_brand, "A")
+        .op("||")(weighted(TS_SIMPLE, name_brand, "A"))
+        .op("||")(weighted(TS_RUSSIAN, attrs, "B"))
+        .op("||")(weighted(TS_RUSSIAN, _text(Model.description), "D"))
+    )
+
+
+def search_text_expr(Model: type) -> ColumnElement:
+    """
+    Строка для триграммного поиска с опечатками: бренд и название в нижнем регистре.
+    """
+    return func.lower(_text(Model.brand).op("||")(" ").op("||")(_text(Model.name)))
+
+
+def visible_expr() -> ColumnElement:
+    """
+    Строка product_index ссылается на нескрытый товар (count_in_stock >= 0).
+    """
+    return or_(*(
+        and_(
+            ProductIndex.category == Model.__tablename__,
+            select(Model.id).where(Model.id == ProductIndex.product_id, Model.count_in_stock >= 0).exists(),
+        )
+        for Model in (Shoe, Clothing, Accessory)
+    ))
+
+
+def search_skus(
+    session,
+    q: str,
+    limit: int,
+    offset: int = 0,
+    category: Optional[str] = None,
+) -> Tuple[List[str], bool]:
+    """
+    Ранжированный поиск по product_index.
+    Совпадение — по tsvector (russian или simple) или по word_similarity триграмм.
+    Скрытые товары (count_in_stock < 0) не возвращаются.
+    Возвращает (variant_sku в порядке релевантности, есть ли следующая страница).
+    """
+    context = "search_skus"
+    q = q.strip()[:SEARCH_MAX_QUERY]
+    q_lower = q.lower()
+    tsq = func.websearch_to_tsquery(TS_RUSSIAN, q).op("||")(func.websearch_to_tsquery(TS_SIMPLE, q))
+    vector = ProductIndex.search_vector
+    text = ProductIndex.search_text
+
+    rank = (func.ts_rank_cd(vector, tsq) + func.word_similarity(q_lower, text)).label("rank")
+    stmt = (
+        select(ProductIndex.variant_sku, rank)
+        .where(or_(vector.op("@@")(tsq), text.op("%>")(q_lower)), visible_expr())
+        .order_by(rank.desc(), ProductIndex.variant_sku)
+        .offset(offset)
+        .limit(limit + 1)
+    )
+    if category:
+        stmt = stmt.where(ProductIndex.category == category)
+
+    skus = [r.variant_sku for r in session.execute(stmt)]
+    has_more = len(skus) > limit
+    logger.debug("%s: q=%r category=%s offset=%d found=%d", context, q, category, offset, len(skus))
+    return skus[:limit], has_more
@@ -0,0 +1,396 @@
+import secrets
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import Integer, column, update, values
+from .db_utils import session_scope
+from .product_index import MODEL_BY_TABLE, resolve_skus
+from ..core.logging import logger
+from ..extensions import redis_client
+from ..models import Shoe, Clothing, Accessory
+
+# Остатки: Redis-хеш variant_sku -> count_in_stock и счётчик его изменений
+STOCK_KEY = "stock"
+STOCK_VERSION_KEY = "stock:version"
+# Журнал изменений: zset версия -> "версия:sku1,sku2"; по нему воркеры дочитывают
+# в зеркало только изменившиеся SKU. Импорт журнал очищает — зеркала перечитываются целиком.
+STOCK_CHANGES_KEY = "stock:changes"
+STOCK_CHANGES_KEEP = 1000
+STOCK_MODELS: Tuple[type, ...] = (Shoe, Clothing, Accessory)
+STOCK_REBUILD_LOCK_KEY = "stock:rebuild:lock"
+STOCK_REBUILD_LOCK_TTL = 30
+
+# Резервы на время оформления заказа: hold:{id} — SKU -> qty, holds — id по времени истечения
+HOLD_TTL = 15 * 60
+HOLDS_KEY = "holds"
+
+# Общая часть скриптов: новая версия остатков и запись изменённых SKU в журнал
+_LOG_CHANGES = """
+local function log_changes(version_key, changes_key, skus)
+    local version = redis.call('INCR', version_key)
+    redis.call('ZADD', changes_key, version, version .. ':' .. table.concat(skus, ','))
+    redis.call('ZREMRANGEBYRANK', changes_key, 0, -%d)
+    return version
+end
+""" % (STOCK_CHANGES_KEEP + 1)
+
+# Меняет только известные и не скрытые (>= 0) SKU: заказ не создаёт остатки
+# несуществующим товарам и не возвращает в каталог скрытые
+# KEYS: stock, stock:version, stock:changes  ARGV: пары sku, delta
+_ADJUST_SCRIPT = redis_client.register_script(_LOG_CHANGES + """
+local changed = {}
+for i = 1, #ARGV, 2 do
+    local stock = redis.call('HGET', KEYS[1], ARGV[i])
+    if stock and tonumber(stock) >= 0 then
+        redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+        table.insert(changed, ARGV[i])
+    end
+end
+return log_changes(KEYS[2], KEYS[3], changed)
+""")
+
+
+# Списывает остатки всех позиций или ни одной; SKU вне хеша считается отсутствующим.
+# Хеш резерва живёт без TTL: срок отслеживает zset holds, снимает release_expired_holds.
+# KEYS: stock, hold, holds, stock:version, stock:changes  ARGV: hold_id, expire_at, далее пары sku, qty
+_RESERVE_SCRIPT = redis_client.register_script(_LOG_CHANGES + """
+local short = {}
+for i = 3, #ARGV, 2 do
+    local stock = redis.call('HGET', KEYS[1], ARGV[i])
+    if not stock or tonumber(stock) < tonumber(ARGV[i + 1]) then
+        table.insert(short, ARGV[i])
+    end
+end
+if #short > 0 then
+    return short
+end
+local changed = {}
+for i = 3, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[1], ARGV[i], -tonumber(ARGV[i + 1]))
+    redis.call('HINCRBY', KEYS[2], ARGV[i], tonumber(ARGV[i + 1]))
+    table.insert(changed, ARGV[i])
+end
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('ZADD', KEYS[3], ARGV[2], ARGV[1])
+end
+log_changes(KEYS[4], KEYS[5], changed)
+return {}
+""")
+
+# Возвращает зарезервированное в остатки; повторный вызов ничего не делает.
+# KEYS: stock, hold, holds, stock:version, stock:changes  ARGV: hold_id
+_RELEASE_SCRIPT = redis_client.register_script(_LOG_CHANGES + """
+if redis.call('ZREM', KEYS[3], ARGV[1]) == 0 then
+    return 0
+end
+local held = redis.call('HGETALL', KEYS[2])
+local changed = {}
+for i = 1, #held, 2 do
+    local stock = redis.call('HGET', KEYS[1], held[i])
+    if stock and tonumber(stock) >= 0 then
+        redis.call('HINCRBY', KEYS[1], held[i], held[i + 1])
+        table.insert(changed, held[i])
+    end
+end
+redis.call('DEL', KEYS[2])
+log_changes(KEYS[4], KEYS[5], changed)
+return 1
+""")
+
+
+class InsufficientStock(Exception):
+    """Остатка не хватает на часть позиций заказа."""
+
+    def __init__(self, skus: List[str]) -> None:
+        super().__init__(f"insufficient stock: {', '.join(skus)}")
+        self.skus = skus
+
+
+def publish_stock(items: Iterable[Tuple[str, Optional[int]]], removed: Iterable[str] = ()) -> None:
+    """
+    Записывает остатки из БД в хеш (после импорта таблицы) одной транзакцией.
+    """
+    mapping = {sku: int(cnt or 0) for sku, cnt in items}
+    removed = [sku for sku in removed if sku not in mapping]
+    pipe = redis_client.pipeline()
+    if removed:
+        pipe.hdel(STOCK_KEY, *removed)
+    if mapping:
+        pipe.hset(STOCK_KEY, mapping=mapping)
+    pipe.incr(STOCK_VERSION_KEY)
+    pipe.delete(STOCK_CHANGES_KEY)
+    pipe.execute()
+    logger.debug("publish_stock: updated=%d removed=%d", len(mapping), len(removed))
+
+
+def rebuild_stock() -> None:
+    """
+    Полностью пересобирает хеш остатков из всех таблиц товаров.
+    """
+    context = "rebuild_stock"
+    logger.debug("%s START", context)
+    mapping: Dict[str, int] = {}
+    with session_scope() as session:
+        for Model in STOCK_MODELS:
+            for sku, cnt in session.query(Model.variant_sku, Model.count_in_stock):
+                mapping[sku] = int(cnt or 0)
+    pipe = redis_client.pipeline()
+    pipe.delete(STOCK_KEY)
+    if mapping:
+        pipe.hset(STOCK_KEY, mapping=mapping)
+    pipe.incr(STOCK_VERSION_KEY)
+    pipe.delete(STOCK_CHANGES_KEY)
+    pipe.execute()
+    logger.debug("%s END variants=%d", context, len(mapping))
+
+
+def ensure_stock() -> None:
+    """
+    Гарантирует, что хеш остатков заполнен (свежий деплой, сброс Redis):
+    пересобирает его из БД под Redis-локом, остальные воркеры ждут готовности.
+    """
+    if redis_client.exists(STOCK_KEY):
+        return
+    if redis_client.set(STOCK_REBUILD_LOCK_KEY, "1", nx=True, ex=STOCK_REBUILD_LOCK_TTL):
+        try:
+            if not redis_client.exists(STOCK_KEY):
+                rebuild_stock()
+        finally:
+            redis_client.delete(STOCK_REBUILD_LOCK_KEY)
+        return
+    deadline = time.monotonic() + STOCK_REBUILD_LOCK_TTL
+    while time.monotonic() < deadline and redis_client.exists(STOCK_REBUILD_LOCK_KEY):
+        time.sleep(0.1)
+    logger.debug("ensure_stock: waited for rebuild elsewhere")
+
+
+def adjust_stock(deltas: Dict[str, int]) -> None:
+    """
+    Атомарно сдвигает остатки: отрицательная дельта — заказ, положительная — отмена.
+    """
+    deltas = {sku: d for sku, d in deltas.items() if sku and d}
+    if not deltas:
+        return
+    args: List = []
+    for sku, delta in deltas.items():
+        args += [sku, delta]
+    _ADJUST_SCRIPT(keys=[STOCK_KEY, STOCK_VERSION_KEY, STOCK_CHANGES_KEY], args=args)
+    logger.debug("adjust_stock: %s", deltas)
+
+
+def order_stock_deltas(items: Iterable[dict], sign: int) -> Dict[str, int]:
+    """
+    Дельты остатков по позициям заказа {variant_sku, qty}: sign=-1 — списание, +1 — возврат.
+    """
+    deltas: Dict[str, int] = {}
+    for it in items or []:
+        sku = it.get("variant_sku")
+        try:
+            qty = int(it.get("qty") or 1)
+        except (TypeError, ValueError):
+            continue
+        if sku and qty > 0:
+            deltas[sku] = deltas.get(sku, 0) + sign * qty
+    return deltas
+
+
+def _hold_key(hold_id: str) -> str:
+    return f"hold:{hold_id}"
+
+
+def reserve_stock(deltas: Dict[str, int]) -> str:
+    """
+    Атомарно резервирует остатки под оформление заказа (deltas: SKU -> -qty).
+    Резерв живёт HOLD_TTL секунд: если заказ не подтверждён, остатки вернёт release_expired_holds
+    (вызывается здесь и фоновым потоком redis_sweeper).
+    Возвращает hold_id или бросает InsufficientStock.
+    """
+    ensure_stock()
+    release_expired_holds()
+    hold_id = secrets.token_hex(8)
+    args: List = [hold_id, time.time() + HOLD_TTL]
+    for sku, delta in deltas.items():
+        if sku and delta < 0:
+            args += [sku, -delta]
+    short = _RESERVE_SCRIPT(
+        keys=[STOCK_KEY, _hold_key(hold_id), HOLDS_KEY, STOCK_VERSION_KEY, STOCK_CHANGES_KEY], args=args,
+    )
+    if short:
+        logger.debug("reserve_stock: insufficient %s", short)
+        raise InsufficientStock(list(short))
+    logger.debug("reserve_stock: hold %s %s", hold_id, deltas)
+    return hold_id
+
+
+def release_hold(hold_id: str) -> bool:
+    """
+    Снимает резерв и возвращает остатки (заказ не создан).
+    """
+    released = _RELEASE_SCRIPT(
+        keys=[STOCK_KEY, _hold_key(hold_id), HOLDS_KEY, STOCK_VERSION_KEY, STOCK_CHANGES_KEY], args=[hold_id],
+    )
+    logger.debug("release_hold: %s released=%s", hold_id, released)
+    return bool(released)
+
+
+def confirm_hold(hold_id: str) -> None:
+    """
+    Заказ зафиксирован в БД: резерв становится списанием, остатки не возвращаются.
+    """
+    pipe = redis_client.pipeline()
+    pipe.zrem(HOLDS_KEY, hold_id)
+    pipe.delete(_hold_key(hold_id))
+    pipe.execute()
+    logger.debug("confirm_hold: %s", hold_id)
+
+
+def release_expired_holds() -> int:
+    """
+    Возвращает остатки по резервам, которые не подтвердили вовремя.
+    """
+    expired = redis_client.zrangebyscore(HOLDS_KEY, 0, time.time())
+    released = sum(1 for hold_id in expired if release_hold(hold_id))
+    if released:
+        logger.info("release_expired_holds: released %d holds", released)
+    return released
+
+
+def apply_stock_db(session, deltas: Dict[str, int]) -> None:
+    """
+    Сдвигает count_in_stock в Postgres одним UPDATE ... FROM (VALUES ...) на таблицу.
+    Строка меняется, только если вариант не скрыт и остаток не уходит в минус;
+    если списание (delta < 0) совпало не со всеми SKU — InsufficientStock (транзакцию откатывает вызывающий).
+    """
+    deltas = {sku: d for sku, d in deltas.items() if sku and d}
+    located = resolve_skus(session, deltas.keys())
+    short = [sku for sku, d in deltas.items() if d < 0 and sku not in located]
+    by_table: Dict[str, List[Tuple[int, int]]] = {}
+    sku_by_row: Dict[Tuple[str, int], str] = {}
+    for sku, (table, pid) in located.items():
+        by_table.setdefault(table, []).append((pid, deltas[sku]))
+        sku_by_row[(table, pid)] = sku
+
+    for table, rows in by_table.items():
+        Model = MODEL_BY_TABLE[table]
+        v = values(column("id", Integer), column("delta", Integer), name="v").data(rows)
+        result = session.execute(
+            update(Model)
+            .where(
+                Model.id == v.c.id,
+                Model.count_in_stock >= 0,
+                Model.count_in_stock + v.c.delta >= 0,
+            )
+            .values(count_in_stock=Model.count_in_stock + v.c.delta)
+            .returning(Model.id)
+            .execution_options(synchronize_session=False)
+        )
+        matched = {r.id for r in result}
+        short += [sku_by_row[(table, pid)] for pid, delta in rows if delta < 0 and pid not in matched]
+        logger.debug("apply_stock_db: %s rows=%d matched=%d", table, len(rows), len(matched))
+
+    if short:
+        logger.warning("apply_stock_db: not enough stock in db for %s", short)
+        raise InsufficientStock(short)
+
+
+def get_stock(skus: List[str]) -> Dict[str, Optional[int]]:
+    """
+    Остатки списка SKU одним HMGET. None — SKU нет в каталоге.
+    """
+    if not skus:
+        return {}
+    counts = redis_client.hmget(STOCK_KEY, skus)
+    return {sku: (max(int(v), 0) if v is not None else None) for sku, v in zip(skus, counts)}
+
+
+# Per-worker mirror
+_mirror: Dict[str, int] = {}
+_mirror_version: Optional[int] = None
+# дочитанные изменения зеркала: (с версии, по версию, SKU) — для производных структур воркера
+_mirror_changes: Deque[Tuple[int, int, List[str]]] = deque(maxlen=STOCK_CHANGES_KEEP)
+_lock = threading.Lock()
+
+
+def _load_changes(since: int) -> Tuple[int, Optional[List[str]]]:
+    """
+    (текущая версия, SKU, изменённые после since) одной транзакцией;
+    None вместо списка — журнал не покрывает весь промежуток (импорт, обрезка, сброс Redis).
+    """
+    pipe = redis_client.pipeline()
+    pipe.get(STOCK_VERSION_KEY)
+    pipe.zrangebyscore(STOCK_CHANGES_KEY, f"({since}", "+inf", withscores=True)
+    raw, entries = pipe.execute()
+    version = int(raw or 0)
+    if version < since or [int(score) for _, score in entries] != list(range(since + 1, version + 1)):
+        return version, None
+    skus: List[str] = []
+    for member, _ in entries:
+        skus += [sku for sku in member.partition(":")[2].split(",") if sku]
+    return version, list(dict.fromkeys(skus))
+
+
+def get_stock_mirror() -> Dict[str, int]:
+    """
+    Копия хеша остатков в памяти воркера. Когда stock:version ушёл вперёд,
+    дочитывает HMGET только SKU из журнала изменений; целиком (HGETALL) —
+    при первом обращении и после импорта. Пустой хеш пересобирается из БД.
+    Словарь обновляется на месте: читать по ключам, не итерировать.
+    """
+    global _mirror, _mirror_version
+    raw = redis_client.get(STOCK_VERSION_KEY)
+    version = int(raw or 0)
+    if version == _mirror_version and raw is not None:
+        return _mirror
+
+    with _lock:
+        if _mirror_version is not None and raw is not None:
+            version, changed = _load_changes(_mirror_version)
+            if changed is not None:
+                if changed:
+                    for sku, cnt in zip(changed, redis_client.hmget(STOCK_KEY, changed)):
+                        if cnt is None:
+                            _mirror.pop(sku, None)
+                        else:
+                            _mirror[sku] = max(int(cnt), 0)
+                _mirror_changes.append((_mirror_version, version, changed))
+                _mirror_version = version
+                logger.debug("get_stock_mirror: refreshed %d variants v%d", len(changed), version)
+                return _mirror
+
+        if not redis_client.exists(STOCK_KEY):
+            ensure_stock()
+        pipe = redis_client.pipeline()
+        pipe.get(STOCK_VERSION_KEY)
+        pipe.hgetall(STOCK_KEY)
+        raw, data = pipe.execute()
+        _mirror = {sku: max(int(v), 0) for sku, v in data.items()}
+        _mirror_version = int(raw or 0)
+        _mirror_changes.clear()
+        logger.debug("get_stock_mirror: loaded %d variants v%d", len(_mirror), _mirror_version)
+        return _mirror
+
+
+def stock_mirror_since(version: Optional[int]) -> Tuple[Dict[str, int], Optional[int], Optional[List[str]]]:
+    """
+    Зеркало остатков, его версия и SKU, изменённые после version.
+    None вместо списка — зеркало с тех пор перечитывалось целиком,
+    производные данные нужно пересчитать полностью.
+    """
+    get_stock_mirror()
+    with _lock:
+        mirror, current = _mirror, _mirror_version
+        if version is None or current is None:
+            return mirror, current, None
+        skus: List[str] = []
+        reached = version
+        for since, upto, changed in _mirror_changes:
+            if upto <= version:
+                continue
+            if since != reached:
+                return mirror, current, None
+            skus += changed
+            reached = upto
+        if reached != current:
+            return mirror, current, None
+        return mirror, current, list(dict.fromkeys(skus))
@@ -0,0 +1,223 @@
+import heapq
+import json
+import threading
+from typing import Dict, List, Optional, Tuple, Any
+from .cache_utils import get_catalog_version
+from .db_utils import session_scope
+from .google_sheets import SUBCATEGORY_MAP
+from ..core.logging import logger
+from ..extensions import redis_client
+from ..models import Shoe, Clothing, Accessory
+
+SUGGEST_MODELS: Tuple[type, ...] = (Shoe, Clothing, Accessory)
+SUGGEST_TOP_K = 10
+SUGGEST_TTL = 60 * 60 * 24 * 7
+SUGGEST_LOCK_KEY = "suggest:lock"
+SUGGEST_LOCK_TTL = 60
+
+# Подсказка: (текст, тип, вес по count_sales)
+Entry = Tuple[str, str, int]
+
+
+def _suggest_key(version: int) -> str:
+    return f"suggest:{version}"
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().replace("ё", "е").split())
+
+
+class _Node:
+    __slots__ = ("edges", "entries", "top")
+
+    def __init__(self) -> None:
+        # первый символ ребра -> (метка ребра, дочерний узел)
+        self.edges: Dict[str, Tuple[str, "_Node"]] = {}
+        self.entries: List[int] = []
+        self.top: List[int] = []
+
+
+def _common_prefix(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class SuggestIndex:
+    """
+    Сжатое префиксное дерево (radix tree) подсказок.
+    Каждый узел хранит заранее посчитанный топ-K подсказок поддерева по весу,
+    поэтому поиск — это только спуск по префиксу запроса.
+    Ключи — нормализованный текст подсказки и его окончания с начала каждого слова,
+    чтобы "air" находил "Nike Air Max".
+    """
+
+    def __init__(self, version: int, entries: List[Entry]) -> None:
+        self.version = version
+        self.entries = entries
+        self.root = _Node()
+        for idx, (text, _, _) in enumerate(entries):
+            words = normalize(text).split(" ")
+            for i in range(len(words)):
+                self._insert(" ".join(words[i:]), idx)
+        self._fill_top(self.root)
+
+    def _insert(self, key: str, idx: int) -> None:
+        node = self.root
+        while key:
+            edge = node.edges.get(key[0])
+            if edge is None:
+                child = _Node()
+                node.edges[key[0]] = (key, child)
+                node = child
+                key = ""
+                break
+            label, child = edge
+            common = _common_prefix(label, key)
+            if common < len(label):
+                # расщепляем ребро по общему префиксу
+                mid = _Node()
+                mid.edges[label[common]] = (label[common:], child)
+                node.edges[key[0]] = (label[:common], mid)
+                child = mid
+            node = child
+            key = key[common:]
+        # ключи одной подсказки вставляются подряд — дубль может быть только последним
+        if not node.entries or node.entries[-1] != idx:
+            node.entries.append(idx)
+
+    def _rank(self, idx: int) -> Tuple[int, str]:
+        text, _, weight = self.entries[idx]
+        return weight, text
+
+    def _fill_top(self, root: _Node) -> None:
+        # обход в обратном порядке без рекурсии: дети раньше родителей
+        order: List[_Node] = []
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(child for _, child in node.edges.values())
+        for node in reversed(order):
+            candidates = set(node.entries)
+            for _, child in node.edges.values():
+                candidates.update(child.top)
+            node.top = heapq.nlargest(SUGGEST_TOP_K, candidates, key=self._rank)
+
+    def lookup(self, prefix: str, limit: int = SUGGEST_TOP_K) -> List[Dict[str, Any]]:
+        key = normalize(prefix)
+        node = self.root
+        while key:
+            edge = node.edges.get(key[0])
+            if edge is None:
+                return []
+            label, child = edge
+            if label.startswith(key):
+                node = child
+                break
+            if not key.startswith(label):
+                return []
+            node = child
+            key = key[len(label):]
+        return [
+            {"text": text, "type": kind}
+            for text, kind, _ in (self.entries[i] for i in node.top[:limit])
+        ]
+
+
+def collect_entries() -> List[Entry]:
+    """
+    Бренды, названия и подкатегории (русские ключи SUBCATEGORY_MAP)
+    с весами — суммой count_sales их вариантов.
+    """
+    weights: Dict[Tuple[str, str], int] = {("subcategory", sub): 0 for sub in SUBCATEGORY_MAP}
+    texts: Dict[Tuple[str, str], str] = {("subcategory", sub): sub for sub in SUBCATEGORY_MAP}
+    with session_scope() as session:
+        for Model in SUGGEST_MODELS:
+            q = session.query(
+                Model.name, Model.brand, Model.subcategory, Model.count_sales,
+            ).filter(Model.count_in_stock >= 0)
+            for name, brand, subcategory, sales in q:
+                for kind, text in (("brand", brand), ("name", name), ("subcategory", subcategory)):
+                    if not text or not text.strip():
+                        continue
+                    key = (kind, normalize(text))
+                    weights[key] = weights.get(key, 0) + (sales or 0)
+                    texts.setdefault(key, text.strip())
+    return [(texts[key], key[0], weight) for key, weight in weights.items()]
+
+
+# Per-worker index
+_index: Optional[SuggestIndex] = None
+_lock = threading.Lock()
+
+
+def build_suggest_index(version: int) -> SuggestIndex:
+    """
+    Собирает подсказки из БД, публикует их в Redis для остальных воркеров
+    и строит дерево.
+    """
+    context = "build_suggest_index"
+    logger.debug("%s START version=%d", context, version)
+    entries = collect_entries()
+    redis_client.set(
+        _suggest_key(version),
+        json.dumps(entries, ensure_ascii=False, separators=(",", ":")),
+        ex=SUGGEST_TTL,
+    )
+    index = SuggestIndex(version, entries)
+    logger.debug("%s END entries=%d", context, len(entries))
+    return index
+
+
+def _load_suggest_index(version: int) -> Optional[SuggestIndex]:
+    raw = redis_client.get(_suggest_key(version))
+    if raw is None:
+        return None
+    entries = [tuple(e) for e in json.loads(raw)]
+    logger.debug("load_suggest_index: loaded %d entries v%d from redis", len(entries), version)
+    return SuggestIndex(version, entries)
+
+
+def rebuild_suggest_index() -> SuggestIndex:
+    """
+    Перестраивает дерево под текущую версию каталога (вызывается после синхронизации).
+    """
+    global _index
+    with _lock:
+        _index = build_suggest_index(get_catalog_version())
+        return _index
+
+
+def get_suggest_index() -> Optional[SuggestIndex]:
+    """
+    Дерево актуальной версии: из памяти воркера, иначе из опубликованных в Redis подсказок.
+    В БД идёт только если в Redis нет данных этой версии (под Redis-локом);
+    пока другой воркер их собирает, отдаётся предыдущее дерево.
+    """
+    global _index
+    context = "get_suggest_index"
+    version = get_catalog_version()
+    current = _index
+    if current is not None and current.version == version:
+        return current
+
+    with _lock:
+        if _index is not None and _index.version == version:
+            return _index
+
+        loaded = _load_suggest_index(version)
+        if loaded is None:
+            if not redis_client.set(SUGGEST_LOCK_KEY, "1", nx=True, ex=SUGGEST_LOCK_TTL):
+                logger.debug("%s: rebuild in progress elsewhere, serving v%s", context,
+                             _index.version if _index else None)
+                return _index
+            try:
+                loaded = build_suggest_index(version)
+            finally:
+                redis_client.delete(SUGGEST_LOCK_KEY)
+
+        _index = loaded
+        return loaded